@@ -51,6 +51,19 @@ MIDDLEWARE_CLASSES = (
     'django.middleware.transaction.TransactionMiddleware',
 )
 
+# The cache is shared by all processes only if it is e.g. memcached: with the
+# default (local memory) cache, every process keeps its own, of at most
+# MAX_ENTRIES entries (the oldest are culled first)
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'scipycentral',
+        'OPTIONS': {
+            'MAX_ENTRIES': 1000,
+        },
+    }
+}
+
 AUTH_PROFILE_MODULE = 'person.UserProfile'
 
 MEDIA_ROOT = os.path.join(DATA_DIR, 'media')
@@ -152,6 +165,11 @@ SPC = {
     # revision control system executable.
     'revisioning_executable': '',
 
+    # Run Mercurial commands through long-lived command server processes
+    # (``hg serve --cmdserver pipe``), instead of starting a new ``hg``
+    # process for every command.
+    'revisioning_command_server': True,
+
     # Where should files from each submission be stored?
     # Files are stored using revision control in directories as follows:
     #
@@ -160,6 +178,24 @@ SPC = {
     # where <storage> is the variable defined next
     'storage_dir': os.path.join(DATA_DIR, 'code'),
 
+    # Lock files that serialize writes to (and reads from) the repos in
+    # ``storage_dir`` across processes. Requests wait at most this many
+    # seconds for a lock, before giving up.
+    'repo_lock_dir': os.path.join(DATA_DIR, 'locks'),
+    'repo_lock_timeout': 60,
+
+    # Store submitted files in the repos (and send the emails about the
+    # submission) from a worker process: ``manage.py storage_worker``, rather
+    # than during the request. Uploaded ZIP files wait in the spool directory
+    # until the worker has stored them. Jobs that failed for a reason that may
+    # go away (the repo was locked, the disk was full) are tried again, after
+    # ``storage_job_retry_delay`` seconds times the attempts made so far. The
+    # submitter is emailed if their submission could not be stored.
+    'storage_async': False,
+    'storage_spool_dir': os.path.join(DATA_DIR, 'spool'),
+    'storage_job_max_attempts': 3,
+    'storage_job_retry_delay': 30,
+
     # Image storage directories. Do not change these settings. They are used
     # in the Sphinx extension to ensure user does not resize image beyond
     # the maximum width or height.
@@ -175,6 +211,33 @@ SPC = {
     # required to sure this location exists for production servers.
     'comment_compile_dir': os.path.join(DATA_DIR, 'cache', 'compile'),
 
+    # The HTML compiled from ReST is kept in the cache (see CACHES) for NNN
+    # seconds, keyed by a hash of the ReST and of the Sphinx set-up, so that
+    # repeated previews, and unchanged descriptions, skip Sphinx. Set to 0 to
+    # always compile.
+    'rest_html_cache_timeout': 7 * 24 * 3600,
+
+    # ReST is compiled in NNN worker processes, so that slow markup doesn't
+    # hold up the web server. A worker that takes more than NNN seconds on a
+    # snippet is killed. Once NNN snippets wait for a worker, previews are
+    # refused (HTTP 503). Set the number of workers to 0 to compile in the web
+    # server process.
+    'rest_compile_workers': 2,
+    'rest_compile_timeout': 10,
+    'rest_compile_queue_size': 8,
+
+    # ZIP files of package revisions are cached in this location, and the
+    # least recently downloaded are removed once the cache grows beyond the
+    # maximum size (in bytes). Set the location to '' to disable the cache.
+    'archive_cache_dir': os.path.join(DATA_DIR, 'cache', 'archives'),
+    'archive_cache_max_size': 1024 * 1024 * 1024,
+
+    # Cached ZIP files may be sent by the web server rather than by Django:
+    # set this to the header the web server uses to do that, e.g.
+    # 'X-Sendfile' (Apache with mod_xsendfile) or 'X-Lighttpd-Send-File'.
+    # The header's value is the full path to the cached file.
+    'archive_sendfile_header': '',
+
     # Default name of license file (e.g. 'COPYING.TXT')
     'license_filename': 'LICENSE.TXT',
 
@@ -185,6 +248,44 @@ SPC = {
     # views over the past NNN days (the horizon).
     'hit_horizon': 60,
 
+    # Items are ordered by their page views (over the hit horizon) from a
+    # ranking that is recounted at most every NNN seconds.
+    'pagehit_ranking_interval': 600,
+
+    # Page hits are spooled to a file in this location, and written to the
+    # database in batches: once a process has recorded ``pagehit_flush_size``
+    # hits, or every ``pagehit_flush_interval`` seconds (after a request), or
+    # with ``manage.py flush_pagehits``. New hits are dropped once the spool
+    # grows beyond ``pagehit_spool_max_size`` bytes. Set the location to '' to
+    # write every hit straight away.
+    'pagehit_spool_dir': os.path.join(DATA_DIR, 'pagehits'),
+    'pagehit_flush_size': 100,
+    'pagehit_flush_interval': 30,
+    'pagehit_spool_max_size': 64 * 1024 * 1024,
+
+    # Hits from bots (user agents that match the patterns in
+    # ``scipy_central/pagehit/filters.py``, or these extra ones) are not
+    # recorded, nor are hits on the same item by the same visitor (IP address
+    # and user agent) within ``pagehit_dedupe_window`` seconds. Each process
+    # remembers the last ``pagehit_dedupe_size`` hits.
+    'pagehit_bot_patterns': [],
+    'pagehit_dedupe_window': 300,
+    'pagehit_dedupe_size': 10000,
+
+    # Raw page hits older than ``pagehit_retention_days`` days are moved out of
+    # the database, into gzip'd JSON lines files (one per month) in this
+    # location, by ``manage.py archive_pagehits``: run it regularly, e.g. daily
+    # from cron. The daily counts of page views are kept. The retention must
+    # be at least ``hit_horizon`` days.
+    'pagehit_archive_dir': os.path.join(DATA_DIR, 'pagehit_archive'),
+    'pagehit_retention_days': 365,
+
+    # The tag autocomplete returns at most NNN tags. It searches an index of
+    # the tag names kept by each process, and rebuilt when tags are added (if
+    # the processes share the cache) or after ``tag_index_max_age`` seconds.
+    'tag_autocomplete_limit': 20,
+    'tag_index_max_age': 1800,
+
     # Number of entries per page is search output and table outputs
     'entries_per_page': 20,
 
@@ -40,3 +40,11 @@ JQUERYUI_CSS = 'https://ajax.googleapis.com/ajax/libs/jqueryui/1.10.2/themes/smo
 # If you use Piwik, Google Analytics, etc: add the code snippet here that
 # will be placed as the last entry in the closing </head> tag.
 ANALYTICS_SNIPPET = ''
+
+# Write page hits straight to the database, rather than in batches through
+# the spool (see ``SPC['pagehit_spool_dir']``)
+SPC['pagehit_spool_dir'] = ''
+
+# Compile ReST in the web server process, rather than in worker processes
+# (see ``SPC['rest_compile_workers']``)
+SPC['rest_compile_workers'] = 0
@@ -15,6 +15,7 @@ from django.core.exceptions import ObjectDoesNotExist, ValidationError
 # scipy central imports
 from scipy_central.comments.forms import SpcCommentEditForm
 from scipy_central.rest_comments.views import compile_rest_to_html
+from scipy_central.rest_comments.pool import CompilerBusy
 
 # other imports
 from sphinx.application import SphinxError
@@ -197,9 +198,13 @@ def preview(request):
         raise Http404
     start_time = time.time()
     try:
-        html_comment = compile_rest_to_html(rest_comment).replace("\n", "<br>")
+        html_comment = compile_rest_to_html(rest_comment, wait=False).replace("\n", "<br>")
         data["html_comment"] = html_comment
         data["success"] = True
+    except CompilerBusy:
+        logger.warning("Comment compilers busy: preview refused")
+        return HttpResponse(simplejson.dumps(data), status=503,
+                            mimetype="application/json")
     except SphinxError:
         data["success"] = False
         logger.warning("Unable to compile comment:: Sphinx compile error")
@@ -0,0 +1,216 @@
+"""
+Creates ZIP archives of the files in a ``FileSet``, streamed chunk by chunk,
+so that an archive never has to be held in memory in its entirety, and
+caches the archives of committed revisions on disk.
+"""
+from scipy_central import utils
+
+import logging
+import os
+import struct
+import tempfile
+import time
+import zlib
+import zipfile
+
+logger = logging.getLogger('scipycentral')
+
+
+class _StreamSink(object):
+    """
+    A write-only, file-like object that ``zipfile.ZipFile`` writes to. Output
+    is collected until it is drained by ``iter_zip``.
+    """
+    def __init__(self):
+        self.chunks = []
+        self.position = 0
+
+    def write(self, data):
+        self.chunks.append(data)
+        self.position += len(data)
+
+    def tell(self):
+        return self.position
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = ''.join(self.chunks)
+        self.chunks = []
+        return data
+
+
+def iter_zip(members, chunk_size=64 * 1024):
+    """
+    Yields a (deflated) ZIP file, in chunks, for the ``members``: an iterable
+    of ``(name, file_object)`` tuples. Each member is read, compressed and
+    yielded ``chunk_size`` bytes at a time; its CRC and sizes are written in a
+    data descriptor after the compressed data, so nothing needs to be seeked.
+    """
+    sink = _StreamSink()
+    zipf = zipfile.ZipFile(sink, 'w', zipfile.ZIP_DEFLATED)
+    for name, file_obj in members:
+        zinfo = zipfile.ZipInfo(name, time.localtime(time.time())[:6])
+        zinfo.compress_type = zipfile.ZIP_DEFLATED
+        zinfo.create_system = 0
+        zinfo.external_attr = 0600 << 16
+        zinfo.flag_bits |= 0x08
+        zinfo.header_offset = sink.tell()
+        sink.write(zinfo.FileHeader())
+
+        compressor = zlib.compressobj(zlib.Z_DEFAULT_COMPRESSION,
+                                      zlib.DEFLATED, -15)
+        crc, file_size, compress_size = 0, 0, 0
+        try:
+            while True:
+                data = file_obj.read(chunk_size)
+                if not data:
+                    break
+                crc = zlib.crc32(data, crc)
+                file_size += len(data)
+                data = compressor.compress(data)
+                compress_size += len(data)
+                sink.write(data)
+                if data:
+                    yield sink.drain()
+        finally:
+            file_obj.close()
+
+        data = compressor.flush()
+        compress_size += len(data)
+        sink.write(data)
+
+        zinfo.CRC = crc & 0xffffffff
+        zinfo.file_size = file_size
+        zinfo.compress_size = compress_size
+        sink.write(struct.pack('<LLLL', zipfile._DD_SIGNATURE, zinfo.CRC,
+                               zinfo.compress_size, zinfo.file_size))
+        zipf.filelist.append(zinfo)
+        zipf.NameToInfo[zinfo.filename] = zinfo
+        yield sink.drain()
+
+    # Writes the central directory
+    zipf.close()
+    yield sink.drain()
+
+
+class ArchiveCache(object):
+    """
+    An on-disk cache of prebuilt archives, keyed by the repo path and the
+    revision's hash. Revisions never change once committed, so a cached
+    archive never needs to be invalidated; the least recently used archives
+    are evicted once the cache grows beyond ``max_size`` bytes.
+
+    The cache is only scanned when it may have grown too large: each process
+    adds the size of the archives it writes to the size found by its last
+    scan (archives written by other processes are only counted by the next
+    scan).
+
+    The cache is disabled if ``cache_dir`` is empty.
+    """
+    def __init__(self, cache_dir, max_size):
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+        # The size of the cache, or None if it has not been scanned yet
+        self.size = None
+
+    def path(self, repo_path, hash_id):
+        """ Returns the location of the archive for this revision. """
+        return os.path.join(self.cache_dir, repo_path.strip('/'),
+                            hash_id + '.zip')
+
+    def get(self, repo_path, hash_id):
+        """
+        Returns the location of the cached archive for this revision, or
+        None if it has not been cached (yet).
+        """
+        if not self.cache_dir:
+            return None
+        fname = self.path(repo_path, hash_id)
+        try:
+            # Marks the archive as recently used
+            os.utime(fname, None)
+        except OSError:
+            return None
+        return fname
+
+    def iter_fill(self, repo_path, hash_id, chunks):
+        """
+        Yields the ``chunks`` of an archive, while writing them to the cache.
+        The archive only appears in the cache once all the chunks have been
+        written, so an interrupted download leaves nothing behind.
+        """
+        if not self.cache_dir:
+            for chunk in chunks:
+                yield chunk
+            return
+
+        fname = self.path(repo_path, hash_id)
+        utils.ensuredir(os.path.dirname(fname))
+        fd, temp_name = tempfile.mkstemp(suffix='.tmp',
+                                         dir=os.path.dirname(fname))
+        temp_file = os.fdopen(fd, 'wb')
+        try:
+            for chunk in chunks:
+                temp_file.write(chunk)
+                yield chunk
+            temp_file.close()
+            os.rename(temp_name, fname)
+        finally:
+            if not temp_file.closed:
+                temp_file.close()
+            if os.path.exists(temp_name):
+                os.remove(temp_name)
+        self.added(os.path.getsize(fname))
+
+    def added(self, size):
+        """ Counts an archive of ``size`` bytes written to the cache, and
+        evicts archives if the cache may have grown too large. """
+        if self.size is None or self.size + size > self.max_size:
+            self.evict()
+        else:
+            self.size += size
+
+    def fill(self, repo_path, hash_id, chunks):
+        """
+        Writes the archive to the cache (unless it is already cached) and
+        returns its location.
+        """
+        fname = self.get(repo_path, hash_id)
+        if fname is None:
+            for _ in self.iter_fill(repo_path, hash_id, chunks):
+                pass
+            fname = self.get(repo_path, hash_id)
+        return fname
+
+    def evict(self):
+        """
+        Removes the least recently used archives until the cache is no
+        larger than ``max_size``.
+        """
+        entries = []
+        total = 0
+        for path, dirs, files in os.walk(self.cache_dir):
+            for name in files:
+                if not name.endswith('.zip'):
+                    continue
+                fname = os.path.join(path, name)
+                try:
+                    stat = os.stat(fname)
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, fname))
+                total += stat.st_size
+
+        entries.sort()
+        for mtime, size, fname in entries:
+            if total <= self.max_size:
+                break
+            try:
+                os.remove(fname)
+            except OSError:
+                continue
+            total -= size
+            logger.debug('Evicted archive from cache: %s' % fname)
+        self.size = total
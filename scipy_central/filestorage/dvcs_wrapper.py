@@ -4,7 +4,8 @@ Simplified BSD-license. (c) Kevin Dunn, 2011.
 
 Hg wrapper: modified from: https://bitbucket.org/kevindunn/ucommentapp
 """
-import re, subprocess, os
+import re, subprocess, os, struct, threading, atexit, time
+from collections import OrderedDict
 
 # http://code.activestate.com/recipes/52224-find-a-file-given-a-search-path/
 def search_file(filename, search_path):
@@ -23,6 +24,55 @@ def search_file(filename, search_path):
 
 testing = False
 
+# Run Mercurial verbs through a pool of long-lived ``hg serve --cmdserver
+# pipe`` processes, rather than forking a new ``hg`` for every verb. Can be
+# overridden per repository with the ``command_server`` keyword to DVCSRepo.
+use_command_server = True
+
+# Maximum number of command server processes kept alive at any time. The
+# least recently used server is shut down when this is exceeded.
+max_command_servers = 8
+
+# Seconds during which commands run in a new process, rather than trying to
+# start a command server again, after a command server failed to start for a
+# repository. Doubled after each failure in a row, up to the maximum.
+command_server_retry_delay = 60
+max_command_server_retry_delay = 3600
+
+# Maximum number of ``DVCSRepo`` handles kept by ``repo_handles``
+max_repo_handles = 256
+
+# Executables already found (and checked), keyed by (backend, executable)
+_executables = {}
+
+def find_executable(backend, dvcs_executable=''):
+    """
+    Returns the full path to the executable for ``backend``: either the given
+    ``dvcs_executable``, or the one found on the ``PATH``. The result is
+    remembered, so the ``PATH`` is only searched once per process.
+
+    Raises a ``DVCSError`` if the executable cannot be found.
+    """
+    key = (backend, dvcs_executable)
+    executable = _executables.get(key)
+    if executable is not None:
+        return executable
+
+    executable = dvcs_executable
+    if not executable:
+        if os.name == 'posix':
+            executable = search_file(backend, os.environ['PATH'])
+        elif os.name == 'nt':
+            executable = search_file(backend + '.exe', os.environ['PATH'])
+    if not executable:
+        raise DVCSError(('Please provide the full path to the executable '
+                         'for %s.' % backend))
+    if not os.path.exists(executable):
+        raise DVCSError(('The given executable file (%s) for %s does not '
+                         'exist.' % (dvcs_executable, backend)))
+    _executables[key] = executable
+    return executable
+
 class DVCSError(RuntimeError):
     """ Exception class used to raise errors related to the DVCS operations."""
     def __init__(self, value, original_message=''):
@@ -30,6 +80,251 @@ class DVCSError(RuntimeError):
         self.value = value
         self.original_message = original_message
 
+class CommandServer(object):
+    """
+    A single ``hg serve --cmdserver pipe`` process for the repository in
+    ``repo_dir``. Commands are sent using Mercurial's command server protocol:
+    see http://mercurial.selenic.com/wiki/CommandServer
+
+    Only one command can be in flight at a time, so ``run_command`` serializes
+    callers from different threads.
+    """
+    def __init__(self, executable, repo_dir, env):
+        self.repo_dir = repo_dir
+        self.lock = threading.Lock()
+        self.process = subprocess.Popen([executable, 'serve', '--cmdserver',
+                                         'pipe', '--config',
+                                         'ui.interactive=False'],
+                                        stdin=subprocess.PIPE,
+                                        stdout=subprocess.PIPE,
+                                        cwd=repo_dir, env=env,
+                                        close_fds=(os.name == 'posix'))
+
+        # The server always starts by writing a "hello" message on the
+        # output channel, listing its capabilities.
+        channel, hello = self._read_channel()
+        if channel != 'o' or 'runcommand' not in hello:
+            self.close()
+            raise DVCSError('Unexpected greeting from the command server',
+                            original_message=str(hello))
+
+    def _read_channel(self):
+        """
+        Returns a tuple ``(channel, data)`` for the next message from the
+        server. For the input channels (``I`` and ``L``) ``data`` is the
+        number of bytes the server is asking for.
+        """
+        header = self.process.stdout.read(5)
+        if len(header) < 5:
+            raise DVCSError('The command server for %s exited unexpectedly'
+                            % self.repo_dir)
+        channel, length = struct.unpack('>cI', header)
+        if channel in ('I', 'L'):
+            return channel, length
+        return channel, self.process.stdout.read(length)
+
+    def run_command(self, args):
+        """
+        Runs the Mercurial command given by the list ``args`` (without the
+        executable name) and returns ``(returncode, stdout, stderr)``.
+
+        If anything goes wrong half way through (an unexpected channel, a
+        short read, an interrupt), what the server sends next can no longer be
+        trusted: the server is killed before the exception is re-raised.
+        """
+        args = [arg.encode('utf-8') if isinstance(arg, unicode) else str(arg)
+                for arg in args]
+        data = '\0'.join(args)
+        with self.lock:
+            try:
+                return self._run_command(data)
+            except BaseException:
+                self._kill()
+                raise
+
+    def _run_command(self, data):
+        """ Sends the ``runcommand`` request, and reads the replies. """
+        self.process.stdin.write('runcommand\n')
+        self.process.stdin.write(struct.pack('>I', len(data)) + data)
+        self.process.stdin.flush()
+
+        stdout, stderr = [], []
+        while True:
+            channel, data = self._read_channel()
+            if channel == 'o':
+                stdout.append(data)
+            elif channel == 'e':
+                stderr.append(data)
+            elif channel == 'r':
+                returncode = struct.unpack('>i', data)[0]
+                return returncode, ''.join(stdout), ''.join(stderr)
+            elif channel in ('I', 'L'):
+                # We never run interactively: answer with end-of-input
+                self.process.stdin.write(struct.pack('>I', 0))
+                self.process.stdin.flush()
+            elif channel.isupper():
+                # Required channels that we do not understand
+                raise DVCSError('Unsupported command server channel %r'
+                                % channel)
+            # Unknown lower-case channels are optional and are ignored
+
+    def is_alive(self):
+        return self.process.poll() is None
+
+    def _kill(self):
+        """ Kills the server process, without waiting for the command. """
+        try:
+            if self.is_alive():
+                self.process.kill()
+            self.process.wait()
+        except OSError:
+            pass
+
+    def close(self):
+        """ Shuts down the server process, once any running command ends."""
+        with self.lock:
+            if self.is_alive():
+                try:
+                    self.process.stdin.close()
+                    self.process.wait()
+                except (IOError, OSError):
+                    pass
+
+
+class CommandServerPool(object):
+    """
+    A bounded, least-recently-used set of ``CommandServer`` instances, one per
+    repository directory.
+
+    Once a command server has failed to start for a repository, ``get`` raises
+    ``DVCSError`` straight away until ``command_server_retry_delay`` seconds
+    have passed, rather than trying to start it again for every command.
+    """
+    def __init__(self, max_servers):
+        self.max_servers = max_servers
+        self.servers = OrderedDict()
+        # (time of the next attempt, delay) after servers failed to start
+        self.failures = {}
+        self.lock = threading.Lock()
+        self.pid = os.getpid()
+
+    def get(self, executable, repo_dir, env):
+        """
+        Returns a running command server for ``repo_dir``, starting a new one
+        if required.
+        """
+        key = (executable, os.path.abspath(repo_dir))
+        evicted = []
+        with self.lock:
+            # Servers started by a parent process cannot be shared with a
+            # forked child: start over in the child.
+            if self.pid != os.getpid():
+                self.servers = OrderedDict()
+                self.pid = os.getpid()
+
+            server = self.servers.pop(key, None)
+            if server is not None and not server.is_alive():
+                server = None
+            if server is None:
+                retry_at, delay = self.failures.get(key, (0, 0))
+                if time.time() < retry_at:
+                    raise DVCSError('The command server failed to start '
+                                    'recently: not trying again yet.')
+                try:
+                    server = CommandServer(executable, repo_dir, env)
+                except (DVCSError, OSError):
+                    delay = min(max(delay * 2, command_server_retry_delay),
+                                max_command_server_retry_delay)
+                    self.failures[key] = (time.time() + delay, delay)
+                    raise
+                self.failures.pop(key, None)
+            self.servers[key] = server
+
+            while len(self.servers) > self.max_servers:
+                evicted.append(self.servers.popitem(last=False)[1])
+
+        for old_server in evicted:
+            old_server.close()
+        return server
+
+    def remove(self, server):
+        """ Forgets ``server`` (which has been shut down). """
+        with self.lock:
+            for key, pooled in self.servers.items():
+                if pooled is server:
+                    del self.servers[key]
+
+    def discard(self, repo_dir):
+        """ Shuts down any command servers running for ``repo_dir``. """
+        repo_dir = os.path.abspath(repo_dir)
+        with self.lock:
+            keys = [key for key in self.servers if key[1] == repo_dir]
+            removed = [self.servers.pop(key) for key in keys]
+        for server in removed:
+            server.close()
+
+    def close_all(self):
+        with self.lock:
+            removed = self.servers.values()
+            self.servers = OrderedDict()
+        if self.pid == os.getpid():
+            for server in removed:
+                server.close()
+
+command_servers = CommandServerPool(max_command_servers)
+atexit.register(command_servers.close_all)
+
+
+class RepoHandles(object):
+    """
+    A bounded, least-recently-used set of ``DVCSRepo`` handles for existing
+    repositories, keyed by the repository directory. A handle is only kept
+    once its repository exists, so it never needs to ``init`` again.
+    """
+    def __init__(self, max_handles):
+        self.max_handles = max_handles
+        self.handles = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, backend, repo_dir, dvcs_executable='', do_init=False):
+        """
+        Returns the handle for the repository in ``repo_dir``, creating it
+        (and, if ``do_init`` is True, the repository too) if required.
+        """
+        key = (backend, os.path.abspath(repo_dir))
+        with self.lock:
+            repo = self.handles.pop(key, None)
+            if repo is not None:
+                self.handles[key] = repo
+        if repo is not None and os.path.isdir(os.path.join(repo_dir,
+                                                           '.' + backend)):
+            return repo
+
+        repo = DVCSRepo(backend, repo_dir, do_init=do_init,
+                        dvcs_executable=dvcs_executable)
+        if os.path.isdir(os.path.join(repo_dir, '.' + backend)):
+            with self.lock:
+                self.handles[key] = repo
+                while len(self.handles) > self.max_handles:
+                    self.handles.popitem(last=False)
+        else:
+            self.discard(repo_dir)
+        return repo
+
+    def discard(self, repo_dir):
+        """ Forgets the handle (if any) for ``repo_dir``. """
+        repo_dir = os.path.abspath(repo_dir)
+        with self.lock:
+            for key in [key for key in self.handles if key[1] == repo_dir]:
+                del self.handles[key]
+
+    def clear(self):
+        with self.lock:
+            self.handles = OrderedDict()
+
+repo_handles = RepoHandles(max_repo_handles)
+
+
 class DVCSRepo(object):
     """
     A class for dealing with a DVCS repository.
@@ -37,12 +332,17 @@ class DVCSRepo(object):
     Note: requires to turn on `purge` extension shipped by default
     in config (`.hgrc` file)
     """
-    def __init__(self, backend, repo_dir, do_init=True, dvcs_executable=''):
+    def __init__(self, backend, repo_dir, do_init=True, dvcs_executable='',
+                 command_server=None):
         """
         Creates and report a DVCSRepo object in the ``repo_dir`` directory.
         If ``do_init`` is True, it will create this directory and initialize
         an empty repository at that location.
 
+        If ``command_server`` is True, commands are run through a long-lived
+        command server process (Mercurial only); if None, the module-level
+        ``use_command_server`` setting is used.
+
         A ``DCVSError`` is raised if the directory cannot be written to, but
         only if the directory does not already contain a repository.
         i.e. if a ``.hg`` directory exists within ``repo_dir``, then an
@@ -50,6 +350,9 @@ class DVCSRepo(object):
         """
         self.backend = backend
         self.remote_dir = ''
+        if command_server is None:
+            command_server = use_command_server
+        self.command_server = command_server
         if backend == 'hg':
             # Dictionary of Mercurial verbs:  key=internal verb, value = list:
             # First list entry is the actual verb to use at the command line,
@@ -66,12 +369,19 @@ class DVCSRepo(object):
                 'purge':    ['purge',    [], {}],
                 'update':   ['update',   [], {}],
                 'heads':    ['heads',    [], {0: '<string>'}],
-                'commit':   ['commit',   ['-m', '-u'], {1: 'Nothing changed'}],
+                'commit':   ['commit',   ['-m', '-u', '-v'],
+                                             {0: '<string>', 1: 'Nothing changed'}],
                 'push':     ['push',     [], {}],
                 'summary':  ['summary',  [], {0: '<string>'}],# return stdout
+                'manifest': ['manifest', ['-r'], {0: '<string>'}],
+                'cat':      ['cat',      ['-r'], {0: '<string>'}],
+                'archive':  ['archive',  ['-r', '-t', '-p', '-X'], {}],
             }
             self.local_prefix = 'file://'
 
+            # Verbs that create repositories are always run in a new process
+            self.no_server_verbs = ('init', 'clone')
+
         elif backend == 'git':
             self.local_prefix = ''
             self.verbs = {}
@@ -83,23 +393,12 @@ class DVCSRepo(object):
         else:
             raise NotImplementedError('That DVCS is not implemented yet.')
 
-        self.executable = dvcs_executable
-        if not self.executable:
-            if os.name == 'posix':
-                self.executable = search_file(self.backend,
-                                              os.environ['PATH'])
-            elif os.name == 'nt':
-                self.executable = search_file(self.backend + '.exe',
-                                              os.environ['PATH'])
-        if not self.executable:
-            raise DVCSError(('Please provide the full path to the executable '
-                             'for %s.' % self.backend))
-        if not os.path.exists(self.executable):
-            raise DVCSError(('The given executable file (%s) for %s does not '
-                             'exist.' % (dvcs_executable, self.backend)))
+        self.executable = find_executable(self.backend, dvcs_executable)
 
         self.local_dir = repo_dir
-        if do_init:
+        # There is no need to initialize an existing repository
+        if do_init and not os.path.isdir(os.path.join(repo_dir,
+                                                      '.' + backend)):
             try:
                 self.init(repo_dir)
             except DVCSError:
@@ -130,8 +429,24 @@ class DVCSRepo(object):
         env = dict(os.environ)
         env['HOME'] = os.path.abspath(os.path.dirname(__file__))
 
+        command[0] = self.verbs[verb][0]
+        if self._can_use_command_server(verb, repo_dir):
+            try:
+                server = command_servers.get(self.executable, repo_dir, env)
+            except (DVCSError, OSError):
+                # Fall back to a new process for this command
+                server = None
+            if server is not None:
+                try:
+                    returncode, stdout, stderr = server.run_command(command)
+                except BaseException:
+                    # The server was killed: it must not be handed out again
+                    command_servers.remove(server)
+                    raise
+                return self._command_output(command, actions, returncode,
+                                            stdout, stderr)
+
         try:
-            command[0] = self.verbs[verb][0]
             command.insert(0, self.executable)
             out = subprocess.Popen(command, stdout=subprocess.PIPE,
                                    stderr=subprocess.PIPE,
@@ -139,20 +454,37 @@ class DVCSRepo(object):
                                    env=env)
 
             stdout, stderr = out.communicate()
-
-            if out.returncode == 0 or out.returncode is None:
-                if actions.get(0, '') == '<string>':
-                    return stdout
-                else:
-                    return out.returncode
-            else:
-                raise DVCSError("DVCS command %r failed %d: %s" % (
-                    command, out.returncode, stderr + stdout))
+            return self._command_output(command, actions, out.returncode,
+                                        stdout, stderr)
         except OSError as err:
             if err.strerror == 'No such file or directory':
                 raise DVCSError(('The DVCS executable file was not found, or '
                                  'the repo directory is invalid'))
 
+    def _can_use_command_server(self, verb, repo_dir):
+        """
+        Command servers are only used for verbs that operate on this
+        (existing) repository.
+        """
+        return (self.command_server and self.backend == 'hg' and
+                verb not in self.no_server_verbs and
+                os.path.abspath(repo_dir) == os.path.abspath(self.local_dir)
+                and os.path.isdir(os.path.join(repo_dir, '.' + self.backend)))
+
+    def _command_output(self, command, actions, returncode, stdout, stderr):
+        """
+        Returns ``stdout`` or the return code of a command, depending on
+        the verb's ``actions``, or raises a DVCSError if the command failed.
+        """
+        if returncode == 0 or returncode is None:
+            if actions.get(0, '') == '<string>':
+                return stdout
+            else:
+                return returncode
+        else:
+            raise DVCSError("DVCS command %r failed %d: %s" % (
+                command, returncode, stderr + stdout))
+
     def set_remote(self, remote_repo):
         """ Sets the remote repository. Only used when pushing.
         Remote path must already exist. If the repository is on a remote
@@ -252,6 +584,44 @@ class DVCSRepo(object):
         self.run_dvcs_command(command)
         return self.get_revision_info()
 
+    def manifest(self, rev='tip'):
+        """
+        Returns a list of all the files tracked in revision ``rev``, with
+        paths relative to the repository root and '/' as separator. The
+        working copy is not touched.
+        """
+        command = [self.verbs['manifest'][0],]
+        command.extend(self.verbs['manifest'][1])
+        command.extend([str(rev),])
+        output = self.run_dvcs_command(command)
+        return [line for line in output.split('\n') if line]
+
+    def cat(self, path, rev='tip'):
+        """
+        Returns the contents of the file ``path`` (relative to the repository
+        root) as it was in revision ``rev``. The working copy is not touched.
+        """
+        command = [self.verbs['cat'][0],]
+        command.extend(self.verbs['cat'][1])
+        command.extend([str(rev), 'path:' + path])
+        return self.run_dvcs_command(command)
+
+    def archive(self, destination, rev='tip', archive_type='zip'):
+        """
+        Writes an archive of revision ``rev`` to the file ``destination``.
+        Files are stored relative to the repository root; Mercurial's own
+        ``.hg_archival.txt`` file is left out.
+        """
+        command = [self.verbs['archive'][0],]
+        command.extend([self.verbs['archive'][1][0], str(rev)])
+        command.extend([self.verbs['archive'][1][1], archive_type])
+        command.extend([self.verbs['archive'][1][2], '.'])
+        command.extend([self.verbs['archive'][1][3], '.hg_archival.txt'])
+        command.extend([os.path.abspath(destination),])
+        out = self.run_dvcs_command(command)
+        if out != None and out != 0:
+            raise DVCSError('Could not create an archive of revision %s' % rev)
+
     def clone(self, destination):
         """ Creates a clone of ``self`` and places it at the destination
         location given by ``dest``.
@@ -275,7 +645,8 @@ class DVCSRepo(object):
         ``message`` and commit as ``user``. If ``user`` is None, then it
         commits as the user set in the .hgrc file.
 
-        Returns the hexadecimal revision number.
+        Returns the hexadecimal revision number, as reported by the commit
+        itself (no extra ``summary`` command is needed).
         """
         command = [self.verbs['commit'][0],]
         command.append(self.verbs['commit'][1][0])
@@ -286,8 +657,12 @@ class DVCSRepo(object):
         else:
             command.append(self.verbs['commit'][1][1])
             command.extend(["System user",])
+        command.append(self.verbs['commit'][1][2])
 
-        self.run_dvcs_command(command)
+        output = self.run_dvcs_command(command)
+        committed = re.search(r'committed changeset \d+:(\w+)', output or '')
+        if committed:
+            return committed.group(1)
         return self.get_revision_info()
 
     def push(self):
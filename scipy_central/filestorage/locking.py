@@ -0,0 +1,221 @@
+"""
+Reader/writer locks on the repositories in the file storage.
+
+Locks are ``fcntl.flock`` locks on a lock file per repo, so they are
+respected by all the (web server) processes on the machine. Any number of
+readers may hold a repo's lock at the same time, while a writer holds it on
+its own. Writers in the same process are queued and get the lock in the order
+they asked for it.
+
+Locks are reentrant within a thread: a thread holding a repo's write lock may
+take its read or write lock again without waiting. A lock may be released by
+another thread than the one that acquired it, e.g. when the web server closes
+a streamed download in another thread.
+"""
+from django.conf import settings
+from dvcs_wrapper import DVCSError
+
+import os
+import time
+import fcntl
+import logging
+import threading
+import collections
+
+lock_dir = settings.SPC.get('repo_lock_dir') or \
+                    os.path.join(settings.SPC['storage_dir'], '.locks')
+lock_timeout = settings.SPC.get('repo_lock_timeout', 60)
+
+logger = logging.getLogger('scipycentral')
+
+
+class LockTimeout(DVCSError):
+    """ The lock on a repo could not be acquired in time. """
+    pass
+
+
+class _WriteQueue(object):
+    """
+    First-come, first-served queue of the threads (in this process) waiting
+    to write to each repo.
+    """
+    def __init__(self):
+        self.condition = threading.Condition()
+        self.queues = {}
+
+    def enter(self, key, deadline):
+        """
+        Waits until this thread is at the front of the ``key`` queue. Returns
+        False if ``deadline`` passes first.
+        """
+        token = object()
+        with self.condition:
+            queue = self.queues.setdefault(key, collections.deque())
+            queue.append(token)
+            while queue[0] is not token:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    queue.remove(token)
+                    if not queue:
+                        del self.queues[key]
+                    self.condition.notify_all()
+                    return False
+                self.condition.wait(remaining)
+        return True
+
+    def leave(self, key):
+        """ Removes this thread from the front of the ``key`` queue. """
+        with self.condition:
+            queue = self.queues[key]
+            queue.popleft()
+            if not queue:
+                del self.queues[key]
+            self.condition.notify_all()
+
+
+class _LockStats(object):
+    """ How long, and how often, lock requests have had to wait. """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.stats = {}
+            for mode in ('read', 'write'):
+                self.stats[mode] = {'acquired': 0, 'contended': 0,
+                                    'timeouts': 0, 'total_wait': 0.0,
+                                    'max_wait': 0.0}
+
+    def record(self, mode, wait, contended, acquired):
+        with self.lock:
+            stats = self.stats[mode]
+            if acquired:
+                stats['acquired'] += 1
+            else:
+                stats['timeouts'] += 1
+            if contended:
+                stats['contended'] += 1
+            stats['total_wait'] += wait
+            stats['max_wait'] = max(stats['max_wait'], wait)
+
+    def snapshot(self):
+        with self.lock:
+            return dict((mode, dict(values)) for mode, values in
+                        self.stats.items())
+
+
+_write_queue = _WriteQueue()
+_held = threading.local()
+_stats = _LockStats()
+
+
+def lock_stats():
+    """
+    Returns the lock wait-time statistics of this process, for ``read`` and
+    ``write`` locks: the number of locks acquired, how many of those had to
+    wait (``contended``), the number of timeouts, and the total and longest
+    wait (in seconds).
+    """
+    return _stats.snapshot()
+
+
+def reset_lock_stats():
+    """ Resets the statistics returned by ``lock_stats()``. """
+    _stats.reset()
+
+
+class RepoLock(object):
+    """
+    A read (shared) or write (``exclusive``) lock on the repo at
+    ``repo_path`` (relative to the storage directory). Use it as a context
+    manager, or call ``acquire()`` and ``release()``.
+
+    Raises ``LockTimeout`` if the lock cannot be acquired within ``timeout``
+    seconds (the ``repo_lock_timeout`` setting, by default).
+    """
+    def __init__(self, repo_path, exclusive=False, timeout=None):
+        self.key = repo_path.strip('/').replace('/', '-') or '_root'
+        self.exclusive = exclusive
+        self.timeout = lock_timeout if timeout is None else timeout
+        # The (thread's locks, lock entry) pairs this lock has acquired
+        self._acquired = []
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.release()
+
+    def acquire(self):
+        held = _held.__dict__.setdefault('locks', {})
+        if self.key in held:
+            entry = held[self.key]
+            if self.exclusive and not entry['exclusive']:
+                raise DVCSError('Cannot upgrade the read lock on "%s" to a '
+                                'write lock.' % self.key)
+            entry['count'] += 1
+            self._acquired.append((held, entry))
+            return
+
+        mode = 'write' if self.exclusive else 'read'
+        start = time.time()
+        deadline = start + self.timeout
+        if self.exclusive and not _write_queue.enter(self.key, deadline):
+            self._timed_out(mode, start)
+
+        try:
+            if not os.path.exists(lock_dir):
+                os.makedirs(lock_dir)
+        except OSError:
+            pass
+        lock_file = open(os.path.join(lock_dir, self.key + '.lock'), 'a')
+        operation = fcntl.LOCK_EX if self.exclusive else fcntl.LOCK_SH
+        delay = 0.005
+        contended = False
+        while True:
+            try:
+                fcntl.flock(lock_file.fileno(), operation | fcntl.LOCK_NB)
+                break
+            except IOError:
+                contended = True
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    lock_file.close()
+                    if self.exclusive:
+                        _write_queue.leave(self.key)
+                    self._timed_out(mode, start)
+                time.sleep(min(delay, remaining))
+                delay = min(delay * 2, 0.1)
+
+        wait = time.time() - start
+        _stats.record(mode, wait, contended or wait > 0.001, True)
+        if wait > 1.0:
+            logger.info('Waited %.2f seconds for the %s lock on repo "%s"'
+                        % (wait, mode, self.key))
+        entry = {'exclusive': self.exclusive, 'count': 1, 'file': lock_file}
+        held[self.key] = entry
+        self._acquired.append((held, entry))
+
+    def release(self):
+        # The entry is not looked up in the current thread's locks: this may
+        # not be the thread that acquired the lock
+        held, entry = self._acquired.pop()
+        entry['count'] -= 1
+        if entry['count']:
+            return
+        if held.get(self.key) is entry:
+            del held[self.key]
+        fcntl.flock(entry['file'].fileno(), fcntl.LOCK_UN)
+        entry['file'].close()
+        if entry['exclusive']:
+            _write_queue.leave(self.key)
+
+    def _timed_out(self, mode, start):
+        wait = time.time() - start
+        _stats.record(mode, wait, True, False)
+        logger.warning('Timed out after %.2f seconds waiting for the %s lock '
+                       'on repo "%s"' % (wait, mode, self.key))
+        raise LockTimeout('Timed out waiting for the %s lock on the '
+                          'repository.' % mode)
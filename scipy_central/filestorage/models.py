@@ -2,19 +2,48 @@ from django.db import models
 from django.conf import settings
 from scipy_central import utils
 
-from dvcs_wrapper import DVCSError, DVCSRepo
+import archive
+import dvcs_wrapper
+from dvcs_wrapper import DVCSError, repo_handles, command_servers
+from locking import RepoLock
 # Python imports
 import os
+import functools
 import logging
 import shutil
 import json
+
+try:
+    from cStringIO import StringIO
+except ImportError:
+    from StringIO import StringIO
+
 storage_dir = settings.SPC['storage_dir']
 backend = settings.SPC['revisioning_backend']
 revisioning_executable = settings.SPC['revisioning_executable']
+dvcs_wrapper.use_command_server = settings.SPC.get('revisioning_command_server',
+                                                   True)
+archive_cache = archive.ArchiveCache(settings.SPC.get('archive_cache_dir', ''),
+                       settings.SPC.get('archive_cache_max_size', 0))
 
 logger = logging.getLogger('scipycentral')
 logger.debug('Initializing filestorage::models.py')
 
+
+def locked(exclusive=False):
+    """
+    Decorates a ``FileSet`` method, so that it runs while holding the read
+    (or, if ``exclusive``, the write) lock on the fileset's repo.
+    """
+    def decorator(method):
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            with RepoLock(self.repo_path, exclusive=exclusive):
+                return method(self, *args, **kwargs)
+        return wrapper
+    return decorator
+
+
 class FileSet(models.Model):
     """
     Every file-based submission is stored under revision control. This class
@@ -33,17 +62,15 @@ class FileSet(models.Model):
         super(FileSet, self).save(*args, **kwargs)
 
 
+    @locked(exclusive=True)
     def create_empty(self):
         """
         Create an empty repo (``init``) and returns it.
         """
-        repo = DVCSRepo(backend, os.path.join(storage_dir, self.repo_path), do_init=True,
-                        dvcs_executable=revisioning_executable)
-        # Save the location for next time
-        globals()['revisioning_executable'] = repo.executable
-        return repo
+        return self._repo(do_init=True)
 
 
+    @locked(exclusive=True)
     def add_file_from_string(self, filename, list_strings, commit_msg='',
                                  user=None):
         """
@@ -56,10 +83,7 @@ class FileSet(models.Model):
         f.writelines(list_strings)
         f.close()
 
-        repo = DVCSRepo(backend, os.path.join(storage_dir, self.repo_path),
-                             dvcs_executable=revisioning_executable)
-        # Save the location for next time
-        globals()['revisioning_executable'] = repo.executable
+        repo = self._repo(do_init=True)
 
         # Only add this file
         try:
@@ -75,15 +99,14 @@ class FileSet(models.Model):
             repo.commit(commit_msg, user=user)
 
 
+    @locked(exclusive=True)
     def add_file(self, pattern, commit_msg='', user=None, repo=None):
         """
         Add a single file, or a file ``pattern``, to the repo.
         A commit will be written to the repo if ``commit_msg`` is not empty.
         """
         if repo is None:
-            repo = DVCSRepo(backend, os.path.join(storage_dir, self.repo_path),
-                            do_init=False,
-                            dvcs_executable=revisioning_executable)
+            repo = self._repo()
 
 
         try:
@@ -96,13 +119,133 @@ class FileSet(models.Model):
             repo.commit(commit_msg, user=user)
 
 
+    def _repo(self, do_init=False):
+        """
+        Returns the (cached) DVCS repo object. The repo is created first if
+        ``do_init`` is True and it does not exist yet.
+        """
+        return repo_handles.get(backend,
+                                os.path.join(storage_dir, self.repo_path),
+                                dvcs_executable=revisioning_executable,
+                                do_init=do_init)
+
+
+    def forget_repo(self):
+        """
+        Drops the cached repo object and any command server for this repo:
+        call it when the repo is removed.
+        """
+        full_path = os.path.join(storage_dir, self.repo_path)
+        repo_handles.discard(full_path)
+        command_servers.discard(full_path)
+
+
+    def read_lock(self, timeout=None):
+        """
+        Returns the (shared) read lock on the repo: use it in a ``with``
+        statement to make several reads consistent with each other.
+        """
+        return RepoLock(self.repo_path, exclusive=False, timeout=timeout)
+
+
+    def write_lock(self, timeout=None):
+        """
+        Returns the (exclusive) write lock on the repo: use it in a ``with``
+        statement around any changes to the repo or its working copy.
+        """
+        return RepoLock(self.repo_path, exclusive=True, timeout=timeout)
+
+
+    def begin(self):
+        """
+        Starts staging the files for a new commit. Staged files are written
+        to the working copy straight away, but are only added to the repo,
+        and committed in a single changeset, when ``commit()`` is called.
+        """
+        self.staged_files = []
+        self.removed_files = []
+
+
+    def stage_file(self, filename):
+        """
+        Stages a file (or pattern) that already exists in the working copy.
+        The ``filename`` is either absolute, or relative to the repo.
+        """
+        if getattr(self, 'staged_files', None) is None:
+            raise DVCSError('Call begin() before staging files.')
+        self.staged_files.append(os.path.join(storage_dir, self.repo_path,
+                                              filename))
+
+
+    def stage_removal(self, filename):
+        """
+        Deletes ``filename`` (relative to the repo) from the working copy,
+        along with any directories left empty, and stages its removal from
+        the repo.
+        """
+        if getattr(self, 'staged_files', None) is None:
+            raise DVCSError('Call begin() before staging files.')
+        base_dir = os.path.normpath(os.path.join(storage_dir, self.repo_path))
+        fname = os.path.join(base_dir, filename)
+        if os.path.lexists(fname):
+            os.remove(fname)
+        path = os.path.dirname(fname)
+        while path != base_dir and path.startswith(base_dir):
+            try:
+                os.rmdir(path)
+            except OSError:
+                # Not empty
+                break
+            path = os.path.dirname(path)
+        self.removed_files.append(fname)
+
+
+    def stage_bytes(self, filename, data):
+        """
+        Writes ``data`` (a string, or a list of strings) to ``filename``,
+        relative to the repo, and stages the file.
+        """
+        fname = os.path.join(storage_dir, self.repo_path, filename)
+        utils.ensuredir(os.path.dirname(fname))
+        if isinstance(data, basestring):
+            data = [data]
+        f = open(fname, 'wb')
+        for chunk in data:
+            if isinstance(chunk, unicode):
+                chunk = chunk.encode('utf-8')
+            f.write(chunk)
+        f.close()
+        self.stage_file(fname)
+
+
+    @locked(exclusive=True)
+    def commit(self, commit_msg, user=None):
+        """
+        Adds all the staged files with a single ``add`` (and removes the files
+        staged for removal with a single ``remove``), and writes exactly one
+        commit to the repo.
+
+        Returns the hash of the new revision.
+        """
+        if getattr(self, 'staged_files', None) is None:
+            raise DVCSError('Call begin() before committing staged files.')
+
+        repo = self._repo()
+        staged_files, self.staged_files = self.staged_files, None
+        removed_files, self.removed_files = self.removed_files, None
+        if removed_files:
+            repo.remove(['--after'] + removed_files)
+        if staged_files:
+            repo.add(staged_files)
+        return repo.commit(commit_msg, user=user)[0:60]
+
+
+    @locked()
     def get_hash(self):
         """
         Returns the current repo hash for this fileset
         """
-        repo = DVCSRepo(backend, os.path.join(storage_dir, self.repo_path),
-                            do_init=False,
-                            dvcs_executable=revisioning_executable)
+        repo = self._repo()
         return repo.get_revision_info()[0:60]
 
 
@@ -110,18 +253,16 @@ class FileSet(models.Model):
         """
         Returns the DVCS repo object
         """
-        return DVCSRepo(backend, os.path.join(storage_dir, self.repo_path),
-                         dvcs_executable=revisioning_executable)
+        return self._repo(do_init=True)
 
 
+    @locked(exclusive=True)
     def checkout_revision(self, hash_id):
         """ Set the repo state to the revision given by ``hash_id``
 
         Equivalent, for e.g., to ``hg checkout 28ed0c6faa19`` for that hash_id.
         """
-        repo = DVCSRepo(backend, os.path.join(storage_dir, self.repo_path),
-                    do_init=False,
-                    dvcs_executable=revisioning_executable)
+        repo = self._repo()
         hash_str = repo.check_out(hash_id)
         if hash_str==hash_id:
             return repo
@@ -129,9 +270,132 @@ class FileSet(models.Model):
             return None
 
 
-    def list_iterator(self):
+    @locked()
+    def list_files(self, hash_id):
+        """
+        Returns a list of the files (paths relative to the repo, using '/'
+        as separator) in the revision given by ``hash_id``.
+
+        Reads straight from the repo store: the working copy is not touched.
+        """
+        repo = self._repo()
+        return repo.manifest(hash_id)
+
+
+    @locked()
+    def open_file(self, hash_id, path):
+        """
+        Returns a read-only file object with the contents of ``path`` (as
+        returned by ``list_files``) in the revision given by ``hash_id``.
+
+        Reads straight from the repo store: the working copy is not touched.
+        """
+        repo = self._repo()
+        return StringIO(repo.cat(path, hash_id))
+
+
+    @locked()
+    def archive(self, hash_id, destination, archive_type='zip'):
+        """
+        Writes an archive (ZIP file by default) of the revision given by
+        ``hash_id`` to ``destination``, without touching the working copy.
+        """
+        repo = self._repo()
+        repo.archive(destination, hash_id, archive_type=archive_type)
+
+
+    def iter_files(self, hash_id=None):
         """
-        Returns a list of all files in a repo. For example, if the repo has:
+        Returns a generator of ``(name, file_object)`` tuples for every file
+        in the revision given by ``hash_id`` (read from the repo store), or
+        in the working copy if ``hash_id`` is None. Files are only opened as
+        the generator reaches them.
+
+        The generator holds the read lock on the repo from the first file
+        until it is exhausted or closed.
+        """
+        names = None
+        if hash_id is not None:
+            # Raises DVCSError straight away if there is no such revision
+            names = self.list_files(hash_id)
+        return self._iter_files(hash_id, names)
+
+    def _iter_files(self, hash_id, names):
+        with self.read_lock():
+            if hash_id is not None:
+                for name in names:
+                    yield name, self.open_file(hash_id, name)
+                return
+
+            base_dir = os.path.join(storage_dir, self.repo_path)
+            names = []
+            for path, dirs, files in os.walk(base_dir):
+                for entry in dirs[:]:
+                    if entry in settings.SPC['common_rcs_dirs']:
+                        dirs.remove(entry)
+                for name in files:
+                    full_name = os.path.join(path, name)
+                    names.append(os.path.relpath(full_name, base_dir).replace(
+                                                                os.sep, '/'))
+            for name in sorted(names):
+                yield name, open(os.path.join(base_dir, name), 'rb')
+
+
+    def iter_archive(self, hash_id=None):
+        """
+        Returns a generator that yields a ZIP file of the revision given by
+        ``hash_id`` (or of the working copy), a chunk at a time. Like
+        ``iter_files``, it holds the read lock on the repo until it is
+        exhausted or closed.
+
+        The ZIP file of a revision is written to the archive cache as it is
+        generated.
+        """
+        return self._iter_archive(hash_id, self.iter_files(hash_id))
+
+    def _iter_archive(self, hash_id, files):
+        chunks = archive.iter_zip(files)
+        if hash_id is not None:
+            chunks = archive_cache.iter_fill(self.repo_path, hash_id, chunks)
+        with self.read_lock():
+            try:
+                for chunk in chunks:
+                    yield chunk
+            finally:
+                # Releases the lock held by ``files`` now, and not whenever
+                # the generators are garbage collected
+                chunks.close()
+                files.close()
+
+
+    def cached_archive(self, hash_id):
+        """
+        Returns the location of the cached ZIP file of the revision given by
+        ``hash_id``, or None if it has not been cached.
+        """
+        return archive_cache.get(self.repo_path, hash_id)
+
+
+    def cache_archive(self, hash_id):
+        """
+        Writes the ZIP file of the revision given by ``hash_id`` to the
+        archive cache, and returns its location (None if the cache is
+        disabled).
+        """
+        if not archive_cache.cache_dir:
+            return None
+        return archive_cache.fill(self.repo_path, hash_id,
+                            archive.iter_zip(self.iter_files(hash_id)))
+
+
+    @locked()
+    def list_iterator(self, hash_id=None):
+        """
+        Returns a list of all files in a repo. If ``hash_id`` is given, the
+        files in that revision are listed (from the repo store), otherwise
+        the files in the working copy are listed.
+
+        For example, if the repo has:
             /dir1/abc.png
             /dir1/def.png
             /dir2/            <-- empty dir
@@ -170,7 +434,25 @@ class FileSet(models.Model):
                                             if x not in settings.SPC['common_rcs_dirs']]
             return pdic
 
-        base_dir = os.path.join(storage_dir, self.repo_path)
+        def manifest_to_dict(root, paths):
+            tree = {}
+            for path in paths:
+                node = tree
+                parts = path.split('/')
+                for part in parts[:-1]:
+                    node = node.setdefault(part, {})
+                node[parts[-1]] = None
+
+            def node_to_list(node):
+                return [name if child is None else {name: node_to_list(child)}
+                        for name, child in sorted(node.items())]
+
+            return {os.path.split(root)[1]: node_to_list(tree)}
+
+        base_dir = os.path.normpath(os.path.join(storage_dir, self.repo_path))
+        if hash_id is not None:
+            return json.dumps(manifest_to_dict(base_dir,
+                                               self.list_files(hash_id)))
         return json.dumps(path_to_dict(base_dir))
         
     def __unicode__(self):
@@ -10,8 +10,13 @@ from scipy_central import utils
 import os
 import shutil
 import tempfile
+import json
+import zipfile
+import threading
+from StringIO import StringIO
 
 import scipy_central.filestorage.dvcs_wrapper as dvcs
+from scipy_central.filestorage import models, archive, locking
 
 class DVCS_Tests(TestCase):
     def setUp(self):
@@ -120,3 +125,318 @@ class DVCS_Tests(TestCase):
             with open(os.path.join(self.local_path, 'index.rst'), 'r') as f_handle:
                 local_lines = f_handle.readlines()
             self.assertEqual(local_lines, final_result)
+
+    def test_command_server(self):
+        """ Commands run through the command server must give the same
+        results as commands run in a new process each time.
+        """
+        utils.ensuredir(self.local_path)
+        f = open(os.path.join(self.local_path, 'index.rst'), 'w')
+        f.writelines(['Header\n','======\n', '\n', 'Paragraph 1\n'])
+        f.close()
+
+        server_repo = dvcs.DVCSRepo('hg', self.local_path, command_server=True)
+        process_repo = dvcs.DVCSRepo('hg', self.local_path, do_init=False,
+                                     command_server=False)
+        server_repo.add([os.path.join(self.local_path, 'index.rst')])
+        server_hash = server_repo.commit('Initial commit', user='Alan Thompson')
+        self.assertEqual(server_hash, process_repo.get_revision_info())
+
+        f = open(os.path.join(self.local_path, 'index.rst'), 'a')
+        f.writelines(['\n', 'Paragraph 2\n'])
+        f.close()
+        process_hash = process_repo.commit('Second commit')
+        self.assertEqual(process_hash, server_repo.get_revision_info())
+        self.assertEqual(server_repo.heads(), process_repo.heads())
+
+        # Errors are reported in the same way
+        self.assertRaises(dvcs.DVCSError, server_repo.check_out, rev='99')
+
+        # A server that sends garbage is shut down, and replaced
+        key, server = [(key, server) for key, server in
+                       dvcs.command_servers.servers.items()
+                       if key[1] == os.path.abspath(self.local_path)][0]
+        server._read_channel = lambda: ('X', '')
+        self.assertRaises(dvcs.DVCSError, server_repo.heads)
+        self.assertFalse(server.is_alive())
+        self.assertFalse(key in dvcs.command_servers.servers)
+        self.assertEqual(server_repo.heads(), process_repo.heads())
+        self.assertTrue(dvcs.command_servers.servers[key].is_alive())
+        dvcs.command_servers.discard(self.local_path)
+
+        # A server that fails to start is not started again for a while:
+        # commands run in a new process meanwhile
+        calls = []
+        def failing_server(*args):
+            calls.append(args)
+            raise OSError('Cannot start the command server')
+        command_server = dvcs.CommandServer
+        dvcs.CommandServer = failing_server
+        try:
+            self.assertEqual(server_repo.heads(), process_repo.heads())
+            self.assertEqual(server_repo.heads(), process_repo.heads())
+            self.assertEqual(len(calls), 1)
+            retry_at, delay = dvcs.command_servers.failures[key]
+            self.assertEqual(delay, dvcs.command_server_retry_delay)
+
+            # ... then it is tried again, and given longer if it fails again
+            dvcs.command_servers.failures[key] = (0, delay)
+            self.assertEqual(server_repo.heads(), process_repo.heads())
+            self.assertEqual(len(calls), 2)
+            self.assertEqual(dvcs.command_servers.failures[key][1], 2 * delay)
+        finally:
+            dvcs.CommandServer = command_server
+            dvcs.command_servers.failures.clear()
+        self.assertEqual(server_repo.heads(), process_repo.heads())
+        self.assertTrue(dvcs.command_servers.servers[key].is_alive())
+        dvcs.command_servers.discard(self.local_path)
+
+
+class FileSet_Tests(TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.storage_dir = models.storage_dir
+        models.storage_dir = self.tempdir
+        self.archive_cache = models.archive_cache
+        models.archive_cache = archive.ArchiveCache(
+                                  os.path.join(self.tempdir, 'cache'), 10**6)
+        self.lock_dir = locking.lock_dir
+        locking.lock_dir = os.path.join(self.tempdir, 'locks')
+
+    def tearDown(self):
+        models.storage_dir = self.storage_dir
+        models.archive_cache = self.archive_cache
+        locking.lock_dir = self.lock_dir
+        shutil.rmtree(self.tempdir)
+
+    def test_single_commit(self):
+        """ All staged files are written in exactly one commit. """
+        fileset = models.FileSet(repo_path='2011/01/000001')
+        fileset.save()
+        repo = fileset.create_empty()
+
+        fileset.begin()
+        fileset.stage_bytes('snippet.py', u'print "Hello \u00e9"\n')
+        fileset.stage_bytes('LICENSE.TXT', ['line 1\n', 'line 2\n'])
+        hash_id = fileset.commit('Add snippet', user='/user/1/')
+
+        self.assertEqual(hash_id, fileset.get_hash())
+        log = repo.run_dvcs_command(['heads'])
+        self.assertTrue(log.startswith('changeset:   0:'))
+
+        # Staging is required before committing
+        self.assertRaises(dvcs.DVCSError, fileset.commit, 'No files')
+
+    def test_read_revision(self):
+        """ Files in older revisions are read without a checkout. """
+        fileset = models.FileSet(repo_path='2011/01/000002')
+        fileset.save()
+        fileset.create_empty()
+
+        fileset.begin()
+        fileset.stage_bytes('pkg/mod.py', 'x = 1\n')
+        first = fileset.commit('First')
+        fileset.begin()
+        fileset.stage_bytes('pkg/mod.py', 'x = 2\n')
+        fileset.stage_bytes('README', 'Read me\n')
+        second = fileset.commit('Second')
+
+        self.assertEqual(fileset.list_files(first), ['pkg/mod.py'])
+        self.assertEqual(fileset.list_files(second), ['README', 'pkg/mod.py'])
+        self.assertEqual(fileset.open_file(first, 'pkg/mod.py').read(),
+                         'x = 1\n')
+        self.assertEqual(json.loads(fileset.list_iterator(second)),
+                         {'000002': ['README', {'pkg': ['mod.py']}]})
+
+        # The working copy is still at the latest revision
+        self.assertEqual(fileset.get_hash(), second)
+
+    def test_streamed_archive(self):
+        """ The ZIP file streamed in chunks is valid, with correct CRCs. """
+        fileset = models.FileSet(repo_path='2011/01/000003')
+        fileset.save()
+        fileset.create_empty()
+
+        big_data = ''.join(chr(i % 251) for i in xrange(200000))
+        fileset.begin()
+        fileset.stage_bytes('pkg/data.bin', big_data)
+        fileset.stage_bytes('README', 'Read me\n')
+        fileset.stage_bytes('empty.txt', '')
+        hash_id = fileset.commit('First')
+
+        for rev in (hash_id, None):
+            chunks = list(fileset.iter_archive(rev))
+            self.assertTrue(len(chunks) > 2)
+            zipf = zipfile.ZipFile(StringIO(''.join(chunks)), 'r')
+            self.assertEqual(zipf.testzip(), None)
+            self.assertEqual(sorted(zipf.namelist()),
+                             ['README', 'empty.txt', 'pkg/data.bin'])
+            self.assertEqual(zipf.read('pkg/data.bin'), big_data)
+            self.assertEqual(zipf.read('empty.txt'), '')
+            zipf.close()
+
+    def test_archive_cache(self):
+        """ Archives of revisions are cached, and evicted when too large. """
+        fileset = models.FileSet(repo_path='2011/01/000004/')
+        fileset.save()
+        fileset.create_empty()
+        fileset.begin()
+        fileset.stage_bytes('README', 'Read me\n')
+        first = fileset.commit('First')
+        fileset.begin()
+        fileset.stage_bytes('README', 'Read me again\n')
+        second = fileset.commit('Second')
+
+        # An interrupted download leaves nothing in the cache
+        chunks = fileset.iter_archive(first)
+        chunks.next()
+        chunks.close()
+        self.assertEqual(fileset.cached_archive(first), None)
+
+        data = ''.join(fileset.iter_archive(first))
+        cached = fileset.cached_archive(first)
+        self.assertEqual(open(cached, 'rb').read(), data)
+        self.assertEqual(os.listdir(os.path.dirname(cached)),
+                         [first + '.zip'])
+        self.assertEqual(models.archive_cache.size, len(data))
+
+        # Only the most recently used archive fits in the cache
+        models.archive_cache.max_size = len(data) + 10
+        os.utime(cached, (0, 0))
+        self.assertNotEqual(fileset.cache_archive(second), None)
+        self.assertEqual(fileset.cached_archive(first), None)
+        self.assertEqual(models.archive_cache.size,
+                         os.path.getsize(fileset.cached_archive(second)))
+
+    def test_repo_locks(self):
+        """ Readers share a repo's lock, while a writer holds it alone. """
+        fileset = models.FileSet(repo_path='2011/01/000005/')
+        locking.reset_lock_stats()
+
+        def hold(lock, acquired, release):
+            with lock:
+                acquired.set()
+                release.wait()
+
+        # Another reader does not wait for a reader
+        acquired, release = threading.Event(), threading.Event()
+        thread = threading.Thread(target=hold, args=(fileset.read_lock(),
+                                                     acquired, release))
+        thread.start()
+        acquired.wait()
+        with fileset.read_lock(timeout=0):
+            pass
+        self.assertRaises(locking.LockTimeout,
+                          fileset.write_lock(timeout=0.05).acquire)
+        release.set()
+        thread.join()
+
+        # ... but readers and writers wait for a writer
+        acquired, release = threading.Event(), threading.Event()
+        thread = threading.Thread(target=hold, args=(fileset.write_lock(),
+                                                     acquired, release))
+        thread.start()
+        acquired.wait()
+        self.assertRaises(locking.LockTimeout,
+                          fileset.read_lock(timeout=0.05).acquire)
+        self.assertRaises(locking.LockTimeout,
+                          fileset.write_lock(timeout=0.05).acquire)
+        release.set()
+        thread.join()
+
+        stats = locking.lock_stats()
+        self.assertEqual(stats['read']['timeouts'], 1)
+        self.assertEqual(stats['write']['timeouts'], 2)
+        self.assertTrue(stats['write']['max_wait'] >= 0.05)
+
+        # Locks are reentrant, but a read lock cannot become a write lock
+        with fileset.write_lock():
+            with fileset.read_lock():
+                with fileset.write_lock(timeout=0):
+                    pass
+        with fileset.read_lock():
+            self.assertRaises(dvcs.DVCSError, fileset.write_lock().acquire)
+        with fileset.write_lock(timeout=0):
+            pass
+
+    def test_iter_files_lock(self):
+        """ Files are read while holding the read lock on the repo. """
+        fileset = models.FileSet(repo_path='2011/01/000007/')
+        fileset.save()
+        fileset.create_empty()
+        fileset.begin()
+        fileset.stage_bytes('README', 'Read me\n')
+        fileset.stage_bytes('setup.py', 'pass\n')
+        rev = fileset.commit('First')
+
+        def write(result):
+            try:
+                with fileset.write_lock(timeout=0.05):
+                    result.append(True)
+            except locking.LockTimeout:
+                result.append(False)
+
+        def can_write():
+            # Locks are reentrant: the writer has to be another thread
+            result = []
+            thread = threading.Thread(target=write, args=(result,))
+            thread.start()
+            thread.join()
+            return result[0]
+
+        for hash_id in (rev, None):
+            files = fileset.iter_files(hash_id)
+            files.next()
+            self.assertFalse(can_write())
+            list(files)
+            self.assertTrue(can_write())
+
+            chunks = fileset.iter_archive(hash_id)
+            chunks.next()
+            self.assertFalse(can_write())
+            chunks.close()
+            self.assertTrue(can_write())
+
+        # The web server may close a download in another thread
+        chunks = fileset.iter_archive(rev)
+        chunks.next()
+        thread = threading.Thread(target=chunks.close)
+        thread.start()
+        thread.join()
+        self.assertTrue(can_write())
+        with fileset.write_lock(timeout=0):
+            pass
+
+    def test_repo_handles(self):
+        """ Repo objects are reused, without searching or init-ing again. """
+        calls = []
+        search_file, init = dvcs.search_file, dvcs.DVCSRepo.init
+        def counted_search_file(*args):
+            calls.append('search')
+            return search_file(*args)
+        def counted_init(repo, dest):
+            calls.append('init')
+            return init(repo, dest)
+
+        dvcs._executables.clear()
+        dvcs.search_file = counted_search_file
+        dvcs.DVCSRepo.init = counted_init
+        try:
+            fileset = models.FileSet(repo_path='2011/01/000006/')
+            fileset.save()
+            repo = fileset.create_empty()
+            self.assertEqual(fileset.create_empty(), repo)
+            self.assertEqual(fileset.get_repo(), repo)
+            fileset.begin()
+            fileset.stage_bytes('README', 'Read me\n')
+            fileset.commit('First')
+            self.assertEqual(calls, ['search', 'init'])
+
+            # A removed repo is created again, from scratch
+            fileset.forget_repo()
+            shutil.rmtree(os.path.join(self.tempdir, fileset.repo_path))
+            fileset.save()
+            self.assertNotEqual(fileset.create_empty(), repo)
+            self.assertEqual(calls, ['search', 'init', 'init'])
+        finally:
+            dvcs.search_file, dvcs.DVCSRepo.init = search_file, init
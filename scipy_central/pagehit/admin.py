@@ -1,9 +1,27 @@
 from django.contrib import admin
-from models import PageHit
+from models import PageHit, PageHitDaily, PageViewTotal, UserAgent
 
 class PageHitAdmin(admin.ModelAdmin):
-    list_display = ('datetime', 'ip_address', 'item', 'item_pk', 'ua_string',
+    list_display = ('datetime', 'ip_address', 'item', 'item_pk', 'user_agent',
                     'extra_info')
+    list_select_related = True
     list_per_page = 1000
 
+class UserAgentAdmin(admin.ModelAdmin):
+    list_display = ('ua_string',)
+    search_fields = ('ua_string',)
+
+class PageHitDailyAdmin(admin.ModelAdmin):
+    list_display = ('day', 'item', 'item_pk', 'hits')
+    list_filter = ('item',)
+    ordering = ['-day']
+
+class PageViewTotalAdmin(admin.ModelAdmin):
+    list_display = ('item', 'item_pk', 'hits')
+    list_filter = ('item',)
+    ordering = ['-hits']
+
 admin.site.register(PageHit, PageHitAdmin)
+admin.site.register(PageHitDaily, PageHitDailyAdmin)
+admin.site.register(PageViewTotal, PageViewTotalAdmin)
+admin.site.register(UserAgent, UserAgentAdmin)
@@ -0,0 +1,83 @@
+"""
+Decides which hits are worth recording: hits from crawlers (and other
+programs) are dropped, and so are hits that repeat a recent hit from the same
+visitor (IP address and user agent) on the same item.
+"""
+from django.conf import settings
+
+import re
+import time
+import threading
+import collections
+
+# Substrings of the user agents of well-known crawlers, feed readers, link
+# checkers and HTTP libraries: product names, rather than words that may also
+# be in a browser's user agent
+BOT_PATTERNS = ['crawl', 'spider', 'slurp', 'archiver', 'teoma', 'yandex',
+                'baidu', 'mediapartners', 'facebookexternalhit', 'slackbot',
+                'feedfetcher', 'feedparser', 'linkchecker', 'w3c-checklink',
+                'pingdom', 'curl', 'wget', 'libwww', 'python-urllib',
+                'python-requests', 'apache-httpclient', 'go-http-client',
+                'scrapy', 'phantomjs', 'headlesschrome']
+
+# Regular expressions for the names that are too short to be matched
+# anywhere: "bot" as a word or at the end of a product token (Googlebot/2.1,
+# Googlebot-Image), but not in e.g. the Cubot phones' user agents, and Java's
+# own user agent, but not the apps that mention Java
+BOT_TOKENS = [r'\bbot\b', r'bot[/;-]', r'^java/']
+
+bot_re = re.compile('|'.join(BOT_TOKENS + [re.escape(pattern) for pattern in
+                             BOT_PATTERNS + settings.SPC.get(
+                                 'pagehit_bot_patterns', [])]), re.IGNORECASE)
+
+
+def is_bot(ua_string):
+    """ Is ``ua_string`` (empty for most scripts) the user agent of a bot? """
+    return not ua_string.strip() or bot_re.search(ua_string) is not None
+
+
+class RecentHits(object):
+    """
+    The most recent hits, at most ``max_size`` of them, in least recently
+    seen order.
+    """
+    def __init__(self, max_size, window):
+        self.max_size = max_size
+        self.window = window
+        self.lock = threading.Lock()
+        self.hits = collections.OrderedDict()
+
+    def seen(self, key, now=None):
+        """
+        Returns True if the hit ``key`` was seen less than ``window`` seconds
+        ago (the hit is then not counted), and records it as seen.
+        """
+        if not self.window or not self.max_size:
+            return False
+        if now is None:
+            now = time.time()
+        with self.lock:
+            last_seen = self.hits.pop(key, None)
+            repeated = last_seen is not None and now - last_seen < self.window
+            # The window starts at the first hit, so that a visitor that keeps
+            # coming back is counted once per window
+            self.hits[key] = last_seen if repeated else now
+            while len(self.hits) > self.max_size:
+                self.hits.popitem(last=False)
+        return repeated
+
+
+recent_hits = RecentHits(settings.SPC.get('pagehit_dedupe_size', 10000),
+                         settings.SPC.get('pagehit_dedupe_window', 300))
+
+
+def is_counted(hit):
+    """
+    Should ``hit`` (a dictionary of ``PageHit`` fields, with the browser's
+    ``ua_string``) be recorded?
+    """
+    if is_bot(hit['ua_string']):
+        return False
+    return not recent_hits.seen((hit['ip_address'], hit['ua_string'],
+                                 hit['item'], hit['item_pk'],
+                                 hit['extra_info']))
@@ -0,0 +1,143 @@
+from django.conf import settings
+from django.core.management.base import NoArgsCommand, CommandError
+from django.db import connection, transaction
+from django.template.defaultfilters import filesizeformat
+from optparse import make_option
+
+from scipy_central.pagehit import models, recorder
+from scipy_central.utils import ensuredir
+
+import os
+import gzip
+import json
+import datetime
+
+# The fields written to the archive: the same as in the spool of hits (see
+# ``recorder.py``), plus the hit's primary key
+FIELDS = ('id', 'datetime', 'ip_address', 'user_agent__ua_string', 'item',
+          'item_pk', 'extra_info')
+
+
+class Command(NoArgsCommand):
+    help = ('Moves the raw page hits older than SPC["pagehit_retention_days"] '
+            'days out of the database, into gzip\'d JSON lines files (one per '
+            'month) in SPC["pagehit_archive_dir"]. The daily counts of page '
+            'views are kept. Run it regularly, e.g. daily from cron.')
+
+    option_list = NoArgsCommand.option_list + (
+        make_option('--days', type='int', dest='days',
+                    default=settings.SPC.get('pagehit_retention_days', 365),
+                    help=('Keep the hits of the last DAYS days (today '
+                          'included) in the database')),
+        make_option('--batch-size', type='int', dest='batch_size',
+                    default=5000,
+                    help='Number of hits archived (and deleted) at a time'),
+    )
+
+    def handle_noargs(self, **options):
+        archive_dir = settings.SPC.get('pagehit_archive_dir', '')
+        if not archive_dir:
+            raise CommandError('SPC["pagehit_archive_dir"] is not set')
+        if options['days'] < settings.SPC['hit_horizon']:
+            raise CommandError('The hits of the last %d days (the hit '
+                               'horizon) must be kept'
+                               % settings.SPC['hit_horizon'])
+        ensuredir(archive_dir)
+        before = datetime.datetime.combine(datetime.date.today()
+                        - datetime.timedelta(days=options['days'] - 1),
+                        datetime.time())
+
+        verbose = int(options['verbosity']) > 0
+        free_space = self.free_space() if verbose else None
+        archived = data_size = 0
+        files = set()
+        last_pk = 0
+        while True:
+            hits = list(models.PageHit.objects.filter(datetime__lt=before,
+                                                      pk__gt=last_pk)
+                                              .order_by('pk')
+                                              .values(*FIELDS)
+                                              [:options['batch_size']])
+            if not hits:
+                break
+
+            # The hits are only deleted once they are safely on disk: if the
+            # command is interrupted in between, they are archived twice
+            data_size += self.write(archive_dir, hits, files)
+            self.delete(last_pk, hits[-1]['id'], before)
+            archived += len(hits)
+            last_pk = hits[-1]['id']
+
+        if verbose:
+            archive_size = sum(os.path.getsize(fname) for fname in files)
+            if free_space is not None:
+                reclaimed = self.free_space() - free_space
+            else:
+                # Roughly the size of the rows deleted
+                reclaimed = data_size
+            self.stdout.write('Archived %d page hits older than %s into %d '
+                              'files (%s); reclaimed %s in the database\n'
+                              % (archived, before.date(), len(files),
+                                 filesizeformat(archive_size),
+                                 filesizeformat(reclaimed)))
+
+    def write(self, archive_dir, hits, files):
+        """
+        Appends ``hits`` to the archive file of their month, and returns the
+        (uncompressed) number of bytes written. ``files`` collects the names
+        of the archive files written to.
+        """
+        months = {}
+        for hit in hits:
+            hit['ua_string'] = hit.pop('user_agent__ua_string') or ''
+            fname = os.path.join(archive_dir, hit['datetime'].strftime(
+                                                'pagehits-%Y-%m.jsonl.gz'))
+            hit['datetime'] = hit['datetime'].strftime(
+                                                recorder.DATETIME_FORMAT)
+            months.setdefault(fname, []).append(json.dumps(hit) + '\n')
+
+        size = 0
+        for fname, lines in months.iteritems():
+            # Every batch adds a gzip member to the file: gzip (and Python's
+            # gzip module) reads them back as a single stream
+            archive_file = open(fname, 'ab')
+            try:
+                gzip_file = gzip.GzipFile(fileobj=archive_file, mode='ab')
+                gzip_file.writelines(lines)
+                gzip_file.close()
+                archive_file.flush()
+                os.fsync(archive_file.fileno())
+            finally:
+                archive_file.close()
+            files.add(fname)
+            size += sum(len(line) for line in lines)
+        return size
+
+    @transaction.commit_on_success
+    def delete(self, after_pk, last_pk, before):
+        """ Deletes the hits older than ``before`` in the given range of
+        primary keys (the hits just archived).
+        """
+        qn = connection.ops.quote_name
+        cursor = connection.cursor()
+        cursor.execute('DELETE FROM %s WHERE %s > %%s AND %s <= %%s '
+                       'AND %s < %%s' % (qn(models.PageHit._meta.db_table),
+                                          qn('id'), qn('id'), qn('datetime')),
+                       [after_pk, last_pk, before])
+        transaction.set_dirty()
+
+    def free_space(self):
+        """
+        Returns the free space in the database file, in bytes, if the
+        database can tell (SQLite), or None.
+
+        SQLite commits the current transaction before a PRAGMA: only call
+        this outside of one.
+        """
+        if connection.vendor != 'sqlite':
+            return None
+        cursor = connection.cursor()
+        cursor.execute('PRAGMA page_size')
+        page_size = cursor.fetchone()[0]
+        cursor.execute('PRAGMA freelist_count')
+        return page_size * cursor.fetchone()[0]
@@ -0,0 +1,13 @@
+from django.core.management.base import NoArgsCommand
+
+from scipy_central.pagehit import recorder
+
+class Command(NoArgsCommand):
+    help = ('Writes the page hits waiting in the spool (SPC["pagehit_spool_'
+            'dir"]) to the database. Run it regularly, e.g. from cron, so that '
+            'hits do not wait in the spool on a quiet site.')
+
+    def handle_noargs(self, **options):
+        count = recorder.spool.flush()
+        if int(options['verbosity']) > 0:
+            self.stdout.write('Flushed %d page hits\n' % count)
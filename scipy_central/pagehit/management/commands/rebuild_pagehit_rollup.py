@@ -0,0 +1,57 @@
+from django.core.management.base import NoArgsCommand
+from django.db import transaction
+from optparse import make_option
+
+from scipy_central.pagehit import models
+
+import datetime
+
+class Command(NoArgsCommand):
+    help = ('Recounts the daily page hits (PageHitDaily) from the raw PageHit '
+            'records, e.g. to fill in the counts after an upgrade. The counts '
+            'of days whose hits were archived (see archive_pagehits) are '
+            'kept.')
+
+    option_list = NoArgsCommand.option_list + (
+        make_option('--days', type='int', dest='days', default=0,
+                    help=('Only recount the last DAYS days (today included); '
+                          'all the days with raw hits are recounted by '
+                          'default')),
+    )
+
+    @transaction.commit_on_success
+    def handle_noargs(self, **options):
+        # The raw hits of earlier days have been archived: their counts
+        # cannot be recounted (archive_pagehits keeps whole days)
+        first_hit = models.PageHit.objects.aggregate(
+                            first=models.models.Min('datetime'))['first']
+        if first_hit is None:
+            if int(options['verbosity']) > 0:
+                self.stdout.write('No page hits to count\n')
+            return
+        since = first_hit.date()
+        if options['days'] > 0:
+            since = max(since, datetime.date.today() - datetime.timedelta(
+                                                    days=options['days'] - 1))
+        models.PageHitDaily.objects.filter(day__gte=since).delete()
+        page_hits = models.PageHit.objects.filter(extra_info=None,
+                                                  datetime__gte=since)
+
+        # DATE() is understood by SQLite, PostgreSQL and MySQL
+        counts = page_hits.extra(select={'day': 'DATE(datetime)'})\
+                          .values('item', 'item_pk', 'day')\
+                          .annotate(hits=models.models.Count('id'))\
+                          .order_by()
+        rollup = []
+        for row in counts:
+            day = row['day']
+            if isinstance(day, basestring):
+                day = datetime.datetime.strptime(day, '%Y-%m-%d').date()
+            rollup.append(models.PageHitDaily(item=row['item'],
+                                              item_pk=row['item_pk'],
+                                              day=day, hits=row['hits']))
+        models.PageHitDaily.objects.bulk_create(rollup)
+
+        if int(options['verbosity']) > 0:
+            self.stdout.write('Counted %d page hits into %d daily counts\n'
+                              % (sum(obj.hits for obj in rollup), len(rollup)))
@@ -0,0 +1,54 @@
+# -*- coding: utf-8 -*-
+import datetime
+from south.db import db
+from south.v2 import SchemaMigration
+from django.db import models
+
+
+class Migration(SchemaMigration):
+
+    def forwards(self, orm):
+        # Adding model 'PageHitDaily'
+        db.create_table('pagehit_pagehitdaily', (
+            ('id', self.gf('django.db.models.fields.AutoField')(primary_key=True)),
+            ('item', self.gf('django.db.models.fields.CharField')(max_length=50)),
+            ('item_pk', self.gf('django.db.models.fields.IntegerField')()),
+            ('day', self.gf('django.db.models.fields.DateField')()),
+            ('hits', self.gf('django.db.models.fields.PositiveIntegerField')(default=0)),
+        ))
+        db.send_create_signal('pagehit', ['PageHitDaily'])
+
+        # Adding unique constraint on 'PageHitDaily', fields ['item', 'item_pk', 'day']
+        db.create_unique('pagehit_pagehitdaily', ['item', 'item_pk', 'day'])
+
+
+    def backwards(self, orm):
+        # Removing unique constraint on 'PageHitDaily', fields ['item', 'item_pk', 'day']
+        db.delete_unique('pagehit_pagehitdaily', ['item', 'item_pk', 'day'])
+
+        # Deleting model 'PageHitDaily'
+        db.delete_table('pagehit_pagehitdaily')
+
+
+    models = {
+        'pagehit.pagehit': {
+            'Meta': {'object_name': 'PageHit'},
+            'datetime': ('django.db.models.fields.DateTimeField', [], {'auto_now': 'True', 'blank': 'True'}),
+            'extra_info': ('django.db.models.fields.CharField', [], {'max_length': '2083', 'null': 'True', 'blank': 'True'}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'ip_address': ('django.db.models.fields.IPAddressField', [], {'max_length': '15'}),
+            'item': ('django.db.models.fields.CharField', [], {'max_length': '50'}),
+            'item_pk': ('django.db.models.fields.IntegerField', [], {}),
+            'ua_string': ('django.db.models.fields.CharField', [], {'max_length': '255'})
+        },
+        'pagehit.pagehitdaily': {
+            'Meta': {'unique_together': "(('item', 'item_pk', 'day'),)", 'object_name': 'PageHitDaily'},
+            'day': ('django.db.models.fields.DateField', [], {}),
+            'hits': ('django.db.models.fields.PositiveIntegerField', [], {'default': '0'}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'item': ('django.db.models.fields.CharField', [], {'max_length': '50'}),
+            'item_pk': ('django.db.models.fields.IntegerField', [], {})
+        }
+    }
+
+    complete_apps = ['pagehit']
\ No newline at end of file
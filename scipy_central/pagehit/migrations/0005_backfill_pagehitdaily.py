@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+import datetime
+from south.db import db
+from south.v2 import DataMigration
+from django.db import models
+
+class Migration(DataMigration):
+
+    def forwards(self, orm):
+        "Counts the existing page views per item and day"
+        counts = orm.PageHit.objects.filter(extra_info=None)\
+                            .extra(select={'day': 'DATE(datetime)'})\
+                            .values('item', 'item_pk', 'day')\
+                            .annotate(hits=models.Count('id'))\
+                            .order_by()
+        for row in counts:
+            day = row['day']
+            if isinstance(day, basestring):
+                day = datetime.datetime.strptime(day, '%Y-%m-%d').date()
+            orm.PageHitDaily.objects.create(item=row['item'],
+                                            item_pk=row['item_pk'],
+                                            day=day, hits=row['hits'])
+
+    def backwards(self, orm):
+        "Nothing to do: the table is dropped by the previous migration"
+        pass
+
+    models = {
+        'pagehit.pagehit': {
+            'Meta': {'object_name': 'PageHit'},
+            'datetime': ('django.db.models.fields.DateTimeField', [], {'auto_now': 'True', 'blank': 'True'}),
+            'extra_info': ('django.db.models.fields.CharField', [], {'max_length': '2083', 'null': 'True', 'blank': 'True'}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'ip_address': ('django.db.models.fields.IPAddressField', [], {'max_length': '15'}),
+            'item': ('django.db.models.fields.CharField', [], {'max_length': '50'}),
+            'item_pk': ('django.db.models.fields.IntegerField', [], {}),
+            'ua_string': ('django.db.models.fields.CharField', [], {'max_length': '255'})
+        },
+        'pagehit.pagehitdaily': {
+            'Meta': {'unique_together': "(('item', 'item_pk', 'day'),)", 'object_name': 'PageHitDaily'},
+            'day': ('django.db.models.fields.DateField', [], {}),
+            'hits': ('django.db.models.fields.PositiveIntegerField', [], {'default': '0'}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'item': ('django.db.models.fields.CharField', [], {'max_length': '50'}),
+            'item_pk': ('django.db.models.fields.IntegerField', [], {})
+        }
+    }
+
+    complete_apps = ['pagehit']
+    symmetrical = True
@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+import datetime
+from south.db import db
+from south.v2 import SchemaMigration
+from django.db import models
+
+
+class Migration(SchemaMigration):
+
+    def forwards(self, orm):
+        # 'PageHit.datetime' is now set when the hit is recorded, rather than
+        # when it is saved (auto_now): the column itself does not change
+        pass
+
+    def backwards(self, orm):
+        pass
+
+    models = {
+        'pagehit.pagehit': {
+            'Meta': {'object_name': 'PageHit'},
+            'datetime': ('django.db.models.fields.DateTimeField', [], {'default': 'datetime.datetime.now'}),
+            'extra_info': ('django.db.models.fields.CharField', [], {'max_length': '2083', 'null': 'True', 'blank': 'True'}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'ip_address': ('django.db.models.fields.IPAddressField', [], {'max_length': '15'}),
+            'item': ('django.db.models.fields.CharField', [], {'max_length': '50'}),
+            'item_pk': ('django.db.models.fields.IntegerField', [], {}),
+            'ua_string': ('django.db.models.fields.CharField', [], {'max_length': '255'})
+        },
+        'pagehit.pagehitdaily': {
+            'Meta': {'unique_together': "(('item', 'item_pk', 'day'),)", 'object_name': 'PageHitDaily'},
+            'day': ('django.db.models.fields.DateField', [], {}),
+            'hits': ('django.db.models.fields.PositiveIntegerField', [], {'default': '0'}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'item': ('django.db.models.fields.CharField', [], {'max_length': '50'}),
+            'item_pk': ('django.db.models.fields.IntegerField', [], {})
+        }
+    }
+
+    complete_apps = ['pagehit']
\ No newline at end of file
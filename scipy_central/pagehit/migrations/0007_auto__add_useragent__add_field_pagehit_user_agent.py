@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+import datetime
+from south.db import db
+from south.v2 import SchemaMigration
+from django.db import models
+
+
+class Migration(SchemaMigration):
+
+    def forwards(self, orm):
+        # Adding model 'UserAgent'
+        db.create_table('pagehit_useragent', (
+            ('id', self.gf('django.db.models.fields.AutoField')(primary_key=True)),
+            ('ua_string', self.gf('django.db.models.fields.CharField')(unique=True, max_length=255)),
+        ))
+        db.send_create_signal('pagehit', ['UserAgent'])
+
+        # Adding field 'PageHit.user_agent'
+        db.add_column('pagehit_pagehit', 'user_agent',
+                      self.gf('django.db.models.fields.related.ForeignKey')(to=orm['pagehit.UserAgent'], null=True),
+                      keep_default=False)
+
+
+    def backwards(self, orm):
+        # Deleting model 'UserAgent'
+        db.delete_table('pagehit_useragent')
+
+        # Deleting field 'PageHit.user_agent'
+        db.delete_column('pagehit_pagehit', 'user_agent_id')
+
+
+    models = {
+        'pagehit.pagehit': {
+            'Meta': {'object_name': 'PageHit'},
+            'datetime': ('django.db.models.fields.DateTimeField', [], {'default': 'datetime.datetime.now'}),
+            'extra_info': ('django.db.models.fields.CharField', [], {'max_length': '2083', 'null': 'True', 'blank': 'True'}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'ip_address': ('django.db.models.fields.IPAddressField', [], {'max_length': '15'}),
+            'item': ('django.db.models.fields.CharField', [], {'max_length': '50'}),
+            'item_pk': ('django.db.models.fields.IntegerField', [], {}),
+            'ua_string': ('django.db.models.fields.CharField', [], {'max_length': '255'}),
+            'user_agent': ('django.db.models.fields.related.ForeignKey', [], {'to': "orm['pagehit.UserAgent']", 'null': 'True'})
+        },
+        'pagehit.pagehitdaily': {
+            'Meta': {'unique_together': "(('item', 'item_pk', 'day'),)", 'object_name': 'PageHitDaily'},
+            'day': ('django.db.models.fields.DateField', [], {}),
+            'hits': ('django.db.models.fields.PositiveIntegerField', [], {'default': '0'}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'item': ('django.db.models.fields.CharField', [], {'max_length': '50'}),
+            'item_pk': ('django.db.models.fields.IntegerField', [], {})
+        },
+        'pagehit.useragent': {
+            'Meta': {'object_name': 'UserAgent'},
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'ua_string': ('django.db.models.fields.CharField', [], {'unique': 'True', 'max_length': '255'})
+        }
+    }
+
+    complete_apps = ['pagehit']
\ No newline at end of file
@@ -0,0 +1,53 @@
+# -*- coding: utf-8 -*-
+import datetime
+from south.db import db
+from south.v2 import DataMigration
+from django.db import models
+
+class Migration(DataMigration):
+
+    def forwards(self, orm):
+        "Moves the user agent strings of the page hits to the UserAgent table"
+        ua_strings = orm.PageHit.objects.values_list('ua_string', flat=True)\
+                                        .distinct().order_by()
+        for ua_string in ua_strings:
+            user_agent, created = orm.UserAgent.objects.get_or_create(
+                                                ua_string=ua_string[:255])
+            orm.PageHit.objects.filter(ua_string=ua_string)\
+                               .update(user_agent=user_agent)
+
+    def backwards(self, orm):
+        "Copies the user agent strings back to the page hits"
+        for user_agent in orm.UserAgent.objects.all():
+            orm.PageHit.objects.filter(user_agent=user_agent)\
+                               .update(ua_string=user_agent.ua_string)
+
+    models = {
+        'pagehit.pagehit': {
+            'Meta': {'object_name': 'PageHit'},
+            'datetime': ('django.db.models.fields.DateTimeField', [], {'default': 'datetime.datetime.now'}),
+            'extra_info': ('django.db.models.fields.CharField', [], {'max_length': '2083', 'null': 'True', 'blank': 'True'}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'ip_address': ('django.db.models.fields.IPAddressField', [], {'max_length': '15'}),
+            'item': ('django.db.models.fields.CharField', [], {'max_length': '50'}),
+            'item_pk': ('django.db.models.fields.IntegerField', [], {}),
+            'ua_string': ('django.db.models.fields.CharField', [], {'max_length': '255'}),
+            'user_agent': ('django.db.models.fields.related.ForeignKey', [], {'to': "orm['pagehit.UserAgent']", 'null': 'True'})
+        },
+        'pagehit.pagehitdaily': {
+            'Meta': {'unique_together': "(('item', 'item_pk', 'day'),)", 'object_name': 'PageHitDaily'},
+            'day': ('django.db.models.fields.DateField', [], {}),
+            'hits': ('django.db.models.fields.PositiveIntegerField', [], {'default': '0'}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'item': ('django.db.models.fields.CharField', [], {'max_length': '50'}),
+            'item_pk': ('django.db.models.fields.IntegerField', [], {})
+        },
+        'pagehit.useragent': {
+            'Meta': {'object_name': 'UserAgent'},
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'ua_string': ('django.db.models.fields.CharField', [], {'unique': 'True', 'max_length': '255'})
+        }
+    }
+
+    complete_apps = ['pagehit']
+    symmetrical = True
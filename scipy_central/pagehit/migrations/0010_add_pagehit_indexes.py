@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+import datetime
+from south.db import db
+from south.v2 import SchemaMigration
+from django.db import models
+
+
+class Migration(SchemaMigration):
+
+    def forwards(self, orm):
+        # Adding index on 'PageHit', fields ['item', 'datetime']
+        db.create_index('pagehit_pagehit', ['item', 'datetime'])
+
+        # Adding index on 'PageHit', fields ['item', 'item_pk', 'datetime']
+        db.create_index('pagehit_pagehit', ['item', 'item_pk', 'datetime'])
+
+
+    def backwards(self, orm):
+        # Removing index on 'PageHit', fields ['item', 'item_pk', 'datetime']
+        db.delete_index('pagehit_pagehit', ['item', 'item_pk', 'datetime'])
+
+        # Removing index on 'PageHit', fields ['item', 'datetime']
+        db.delete_index('pagehit_pagehit', ['item', 'datetime'])
+
+
+    models = {
+        'pagehit.pagehit': {
+            'Meta': {'object_name': 'PageHit'},
+            'datetime': ('django.db.models.fields.DateTimeField', [], {'default': 'datetime.datetime.now'}),
+            'extra_info': ('django.db.models.fields.CharField', [], {'max_length': '2083', 'null': 'True', 'blank': 'True'}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'ip_address': ('django.db.models.fields.IPAddressField', [], {'max_length': '15'}),
+            'item': ('django.db.models.fields.CharField', [], {'max_length': '50'}),
+            'item_pk': ('django.db.models.fields.IntegerField', [], {}),
+            'user_agent': ('django.db.models.fields.related.ForeignKey', [], {'to': "orm['pagehit.UserAgent']", 'null': 'True'})
+        },
+        'pagehit.pagehitdaily': {
+            'Meta': {'unique_together': "(('item', 'item_pk', 'day'),)", 'object_name': 'PageHitDaily'},
+            'day': ('django.db.models.fields.DateField', [], {}),
+            'hits': ('django.db.models.fields.PositiveIntegerField', [], {'default': '0'}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'item': ('django.db.models.fields.CharField', [], {'max_length': '50'}),
+            'item_pk': ('django.db.models.fields.IntegerField', [], {})
+        },
+        'pagehit.useragent': {
+            'Meta': {'object_name': 'UserAgent'},
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'ua_string': ('django.db.models.fields.CharField', [], {'unique': 'True', 'max_length': '255'})
+        }
+    }
+
+    complete_apps = ['pagehit']
\ No newline at end of file
@@ -0,0 +1,65 @@
+# -*- coding: utf-8 -*-
+import datetime
+from south.db import db
+from south.v2 import SchemaMigration
+from django.db import models
+
+
+class Migration(SchemaMigration):
+
+    def forwards(self, orm):
+        # Adding model 'PageViewTotal'
+        db.create_table('pagehit_pageviewtotal', (
+            ('id', self.gf('django.db.models.fields.AutoField')(primary_key=True)),
+            ('item', self.gf('django.db.models.fields.CharField')(max_length=50)),
+            ('item_pk', self.gf('django.db.models.fields.IntegerField')()),
+            ('hits', self.gf('django.db.models.fields.PositiveIntegerField')(default=0)),
+        ))
+        db.send_create_signal('pagehit', ['PageViewTotal'])
+
+        # Adding unique constraint on 'PageViewTotal', fields ['item', 'item_pk']
+        db.create_unique('pagehit_pageviewtotal', ['item', 'item_pk'])
+
+
+    def backwards(self, orm):
+        # Removing unique constraint on 'PageViewTotal', fields ['item', 'item_pk']
+        db.delete_unique('pagehit_pageviewtotal', ['item', 'item_pk'])
+
+        # Deleting model 'PageViewTotal'
+        db.delete_table('pagehit_pageviewtotal')
+
+
+    models = {
+        'pagehit.pagehit': {
+            'Meta': {'object_name': 'PageHit'},
+            'datetime': ('django.db.models.fields.DateTimeField', [], {'default': 'datetime.datetime.now'}),
+            'extra_info': ('django.db.models.fields.CharField', [], {'max_length': '2083', 'null': 'True', 'blank': 'True'}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'ip_address': ('django.db.models.fields.IPAddressField', [], {'max_length': '15'}),
+            'item': ('django.db.models.fields.CharField', [], {'max_length': '50'}),
+            'item_pk': ('django.db.models.fields.IntegerField', [], {}),
+            'user_agent': ('django.db.models.fields.related.ForeignKey', [], {'to': "orm['pagehit.UserAgent']", 'null': 'True'})
+        },
+        'pagehit.pagehitdaily': {
+            'Meta': {'unique_together': "(('item', 'item_pk', 'day'),)", 'object_name': 'PageHitDaily'},
+            'day': ('django.db.models.fields.DateField', [], {}),
+            'hits': ('django.db.models.fields.PositiveIntegerField', [], {'default': '0'}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'item': ('django.db.models.fields.CharField', [], {'max_length': '50'}),
+            'item_pk': ('django.db.models.fields.IntegerField', [], {})
+        },
+        'pagehit.pageviewtotal': {
+            'Meta': {'unique_together': "(('item', 'item_pk'),)", 'object_name': 'PageViewTotal'},
+            'hits': ('django.db.models.fields.PositiveIntegerField', [], {'default': '0'}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'item': ('django.db.models.fields.CharField', [], {'max_length': '50'}),
+            'item_pk': ('django.db.models.fields.IntegerField', [], {})
+        },
+        'pagehit.useragent': {
+            'Meta': {'object_name': 'UserAgent'},
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'ua_string': ('django.db.models.fields.CharField', [], {'unique': 'True', 'max_length': '255'})
+        }
+    }
+
+    complete_apps = ['pagehit']
\ No newline at end of file
@@ -1,4 +1,6 @@
-from django.db import models
+from django.db import models, transaction, IntegrityError
+
+import datetime
 
 
 class PageHitManager(models.Manager):
@@ -11,16 +13,53 @@ class PageHitManager(models.Manager):
             #annotatecore=models.Count(field))\
                                                #.order_by('-score', 'username')
 
+class UserAgentManager(models.Manager):
+    def intern(self, ua_strings):
+        """
+        Returns a dictionary mapping each of the ``ua_strings`` to the primary
+        key of its ``UserAgent``, which is created if needed.
+        """
+        ua_strings = set(ua_strings)
+        found = dict(self.filter(ua_string__in=ua_strings)
+                         .values_list('ua_string', 'pk'))
+        for ua_string in ua_strings - set(found):
+            sid = transaction.savepoint()
+            try:
+                found[ua_string] = self.create(ua_string=ua_string).pk
+                transaction.savepoint_commit(sid)
+            except IntegrityError:
+                # Created by another process in the mean time
+                transaction.savepoint_rollback(sid)
+                found[ua_string] = self.get(ua_string=ua_string).pk
+        return found
+
+
+class UserAgent(models.Model):
+    """ A browser's user agent string: stored once, for all the hits from
+    browsers that send it.
+    """
+    objects = UserAgentManager()
+    ua_string = models.CharField(max_length=255, unique=True)
+
+    def __unicode__(self):
+        return self.ua_string
+
+
 class PageHit(models.Model):
     """ Records each hit (page view) of an item: whether the item is a link,
     code snippet or library, tag, person's profile, etc.
 
     The only requirement is that the item must have an integer primary key.
+
+    Hits are archived, and deleted, once they are older than
+    ``pagehit_retention_days`` (see the ``archive_pagehits`` command).
     """
+    # The table is indexed on (item, datetime) and (item, item_pk, datetime),
+    # by a migration: this version of Django cannot declare those indexes
     objects = PageHitManager()
-    ua_string = models.CharField(max_length=255) # browser's user agent
+    user_agent = models.ForeignKey(UserAgent, null=True) # browser's user agent
     ip_address = models.IPAddressField()
-    datetime = models.DateTimeField(auto_now=True)
+    datetime = models.DateTimeField(default=datetime.datetime.now)
     item = models.CharField(max_length=50)
     item_pk = models.IntegerField()
 
@@ -46,3 +85,81 @@ class PageHit(models.Model):
         return PageHit.objects.filter(item=field)\
                             .annotate(score=models.Count('revision'))\
                             .order_by('-score', 'username')
+
+
+class PageHitDailyManager(models.Manager):
+    def add_hits(self, item, item_pk, day, hits=1):
+        """ Adds ``hits`` to the count of ``item`` on ``day``. """
+        counts = self.filter(item=item, item_pk=item_pk, day=day)
+        if counts.update(hits=models.F('hits') + hits):
+            return
+
+        sid = transaction.savepoint()
+        try:
+            self.create(item=item, item_pk=item_pk, day=day, hits=hits)
+            transaction.savepoint_commit(sid)
+        except IntegrityError:
+            # Created by another request in the mean time
+            transaction.savepoint_rollback(sid)
+            counts.update(hits=models.F('hits') + hits)
+
+
+class PageHitDaily(models.Model):
+    """ The number of hits (page views) of an item per day, rolled up from
+    the ``PageHit`` records, so that counting the hits of an item over a
+    period reads one row per day.
+
+    As in ``get_pagehits``, only plain page views are counted: hits that
+    record ``extra_info`` (downloads, searches, referrers) are not.
+    """
+    objects = PageHitDailyManager()
+    item = models.CharField(max_length=50)
+    item_pk = models.IntegerField()
+    day = models.DateField()
+    hits = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        unique_together = (('item', 'item_pk', 'day'),)
+
+    def __unicode__(self):
+        return '%s [%d] on %s: %d' % (self.item, self.item_pk, self.day,
+                                      self.hits)
+
+
+class PageViewTotalManager(models.Manager):
+    def refresh(self, item, start_date):
+        """ Recounts the page views of every ``item`` since ``start_date``
+        from the daily counts.
+        """
+        counts = PageHitDaily.objects.filter(item=item, day__gte=start_date)\
+                                     .values('item_pk')\
+                                     .annotate(total=models.Sum('hits'))\
+                                     .order_by()
+        totals = [PageViewTotal(item=item, item_pk=row['item_pk'],
+                                hits=row['total']) for row in counts]
+        sid = transaction.savepoint()
+        try:
+            self.filter(item=item).delete()
+            self.bulk_create(totals)
+            transaction.savepoint_commit(sid)
+        except IntegrityError:
+            # Recounted by another request in the mean time
+            transaction.savepoint_rollback(sid)
+
+
+class PageViewTotal(models.Model):
+    """ The number of page views of an item over the hit horizon: the ranking
+    of the most viewed items, recounted from ``PageHitDaily`` every so often
+    (see ``views.order_by_pagehits``), so that ordering items by their views
+    is a single query.
+    """
+    objects = PageViewTotalManager()
+    item = models.CharField(max_length=50)
+    item_pk = models.IntegerField()
+    hits = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        unique_together = (('item', 'item_pk'),)
+
+    def __unicode__(self):
+        return '%s [%d]: %d' % (self.item, self.item_pk, self.hits)
@@ -0,0 +1,284 @@
+"""
+Records page hits in batches, rather than with an INSERT per page view.
+
+Hits are appended, one JSON line each, to a spool file that all the (web
+server) processes on the machine share. Once a process has recorded
+``pagehit_flush_size`` hits, or ``pagehit_flush_interval`` seconds have
+passed, the spool is flushed to the database with ``bulk_create`` after the
+response has been sent. The spool is also flushed when a process exits, and
+by the ``flush_pagehits`` management command.
+
+Hits in the spool survive a crash of the process that recorded them. A spool
+that was being flushed when its process died is flushed again by the next
+flush, so a crash at the wrong moment can count those hits twice; a hit
+left half-written by a crash is skipped (and logged) when it is flushed. New
+hits are dropped (and logged) once the spool reaches ``pagehit_spool_max_size``
+bytes, e.g. while the database is unavailable.
+
+The spool is disabled if ``pagehit_spool_dir`` is empty: every hit is then
+written straight away.
+"""
+from django.conf import settings
+from django.core.signals import request_finished
+from django.db import transaction
+
+from scipy_central.utils import ensuredir
+
+import os
+import json
+import time
+import glob
+import fcntl
+import atexit
+import logging
+import datetime
+import threading
+import collections
+
+import models
+
+logger = logging.getLogger('scipycentral')
+
+DATETIME_FORMAT = '%Y-%m-%d %H:%M:%S.%f'
+
+
+def save_hits(hits):
+    """
+    Writes ``hits`` (dictionaries of ``PageHit`` fields, with the browser's
+    ``ua_string`` rather than its ``user_agent``) to the database with a
+    single ``bulk_create``, and adds the page views among them to the daily
+    counts.
+    """
+    user_agents = models.UserAgent.objects.intern(
+                                    [hit['ua_string'] for hit in hits])
+    page_hits = []
+    daily_hits = collections.defaultdict(int)
+    for hit in hits:
+        hit = dict(hit)
+        hit['user_agent_id'] = user_agents[hit.pop('ua_string')]
+        page_hit = models.PageHit(**hit)
+        if isinstance(page_hit.datetime, basestring):
+            page_hit.datetime = datetime.datetime.strptime(page_hit.datetime,
+                                                           DATETIME_FORMAT)
+        page_hits.append(page_hit)
+        if page_hit.extra_info is None:
+            daily_hits[(page_hit.item, page_hit.item_pk,
+                        page_hit.datetime.date())] += 1
+
+    models.PageHit.objects.bulk_create(page_hits)
+    for (item, item_pk, day), count in daily_hits.iteritems():
+        models.PageHitDaily.objects.add_hits(item, item_pk, day, count)
+
+
+class HitSpool(object):
+    """
+    The spool file of hits waiting to be written to the database, in
+    ``spool_dir``.
+    """
+    def __init__(self, spool_dir, flush_size=100, flush_interval=30,
+                 max_size=64 * 1024 * 1024):
+        self.spool_dir = spool_dir
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self.max_size = max_size
+        self.lock = threading.Lock()
+        self.flush_lock = threading.Lock()
+        self.recorded = 0
+        self.dropped = 0
+        self.last_flush = time.time()
+
+    @property
+    def enabled(self):
+        return bool(self.spool_dir)
+
+    def _path(self, name):
+        return os.path.join(self.spool_dir, name)
+
+    def _lock(self, operation):
+        """
+        Locks the spool: writers share the lock while appending a hit, and a
+        flush holds it on its own while it takes the spool file away.
+        """
+        ensuredir(self.spool_dir)
+        lock_file = open(self._path('hits.lock'), 'a')
+        fcntl.flock(lock_file.fileno(), operation)
+        return lock_file
+
+    def append(self, hit):
+        """ Adds ``hit`` (a dictionary of ``PageHit`` fields) to the spool. """
+        hit = dict(hit)
+        if isinstance(hit.get('datetime'), datetime.datetime):
+            hit['datetime'] = hit['datetime'].strftime(DATETIME_FORMAT)
+        line = json.dumps(hit) + '\n'
+
+        lock_file = self._lock(fcntl.LOCK_SH)
+        try:
+            # Other processes append to the spool at the same time: each line
+            # is written with a single ``write`` (rather than through a
+            # buffered file), so that lines are never interleaved
+            spool_fd = os.open(self._path('hits.jsonl'),
+                               os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0644)
+            try:
+                if os.fstat(spool_fd).st_size + len(line) > self.max_size:
+                    with self.lock:
+                        self.dropped += 1
+                        dropped = self.dropped
+                    if dropped == 1 or dropped % 1000 == 0:
+                        logger.warning('Page hit spool is full: dropped %d '
+                                       'hits' % dropped)
+                    return
+                os.write(spool_fd, line)
+            finally:
+                os.close(spool_fd)
+        finally:
+            lock_file.close()
+
+        with self.lock:
+            self.recorded += 1
+
+    def needs_flush(self):
+        """ Has the flush size, or the flush interval, been reached? """
+        with self.lock:
+            return self.recorded >= self.flush_size or (self.recorded and
+                       time.time() - self.last_flush >= self.flush_interval)
+
+    def flush(self):
+        """
+        Writes all the hits in the spool (recorded by any process) to the
+        database. Returns the number of hits written.
+        """
+        if not self.enabled or not self.flush_lock.acquire(False):
+            # Disabled, or being flushed by another thread
+            return 0
+        try:
+            with self.lock:
+                self.recorded = 0
+                self.last_flush = time.time()
+
+            # Spools left behind by failed flushes go first: while they
+            # cannot be written, the spool is left to fill up
+            pid = os.getpid()
+            count = self._flush_taken(pid)
+
+            # Takes the spool away from the writers
+            lock_file = self._lock(fcntl.LOCK_EX)
+            try:
+                if os.path.exists(self._path('hits.jsonl')):
+                    os.rename(self._path('hits.jsonl'),
+                              self._path('hits-%d-%d.flushing'
+                                         % (pid, time.time() * 1000)))
+            finally:
+                lock_file.close()
+            count += self._flush_taken(pid)
+        finally:
+            self.flush_lock.release()
+
+        if count:
+            logger.debug('Flushed %d page hits from the spool' % count)
+        return count
+
+    def _flush_taken(self, pid):
+        """
+        Writes the spools taken away for flushing by this process, or by
+        processes that have died since, to the database.
+        """
+        count = 0
+        for fname in sorted(glob.glob(self._path('hits-*.flushing'))):
+            owner, stamp = os.path.basename(fname).split('-')[1:3]
+            if int(owner) != pid:
+                if _is_running(int(owner)):
+                    # Being flushed by that process
+                    continue
+                claimed = self._path('hits-%d-%s' % (pid, stamp))
+                try:
+                    os.rename(fname, claimed)
+                except OSError:
+                    # Claimed by another process
+                    continue
+                fname = claimed
+
+            try:
+                hits = self._read(fname)
+            except IOError, e:
+                # Set aside, rather than blocking every later flush
+                logger.error('Could not read the page hit spool %s: %s'
+                             % (fname, e))
+                os.rename(fname, fname[:-len('.flushing')] + '.unreadable')
+                continue
+            self._save(hits)
+            os.remove(fname)
+            count += len(hits)
+        return count
+
+    def _read(self, fname):
+        """
+        Returns the hits in the spool ``fname``. Lines that are not valid
+        hits, e.g. left by a process that died while writing a hit, are
+        logged and skipped.
+        """
+        hits = []
+        bad_lines = 0
+        spool_file = open(fname, 'r')
+        try:
+            for line in spool_file:
+                if not line.endswith('\n'):
+                    # Still being written when the spool was taken away
+                    continue
+                try:
+                    hits.append(json.loads(line))
+                except ValueError:
+                    bad_lines += 1
+        finally:
+            spool_file.close()
+        if bad_lines:
+            logger.warning('Skipped %d invalid lines in the page hit spool %s'
+                           % (bad_lines, fname))
+        return hits
+
+    @transaction.commit_on_success
+    def _save(self, hits):
+        save_hits(hits)
+
+
+def _is_running(pid):
+    try:
+        os.kill(pid, 0)
+    except OSError:
+        return False
+    return True
+
+
+spool = HitSpool(settings.SPC.get('pagehit_spool_dir', ''),
+                 flush_size=settings.SPC.get('pagehit_flush_size', 100),
+                 flush_interval=settings.SPC.get('pagehit_flush_interval', 30),
+                 max_size=settings.SPC.get('pagehit_spool_max_size',
+                                           64 * 1024 * 1024))
+
+
+def record_hit(hit):
+    """
+    Records ``hit`` (a dictionary of ``PageHit`` fields): in the spool if it
+    is enabled, otherwise straight in the database.
+    """
+    if spool.enabled:
+        spool.append(hit)
+    else:
+        save_hits([hit])
+
+
+def flush_hits():
+    """ Writes the spooled hits to the database. """
+    try:
+        return spool.flush()
+    except Exception, e:
+        logger.error('Could not flush the page hit spool: %s' % e)
+        return 0
+
+
+def flush_if_needed(sender, **kwargs):
+    """ Flushes the spool after a response, once it has grown enough. """
+    if spool.enabled and spool.needs_flush():
+        flush_hits()
+
+request_finished.connect(flush_if_needed)
+atexit.register(flush_hits)
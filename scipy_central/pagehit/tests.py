@@ -1,5 +1,260 @@
+from django.conf import settings
 from django.test import TestCase
+from django.test.client import RequestFactory
+from django.core.management import call_command
+from django.core.management.base import CommandError
 
-#class SimpleTest(TestCase):
-    #def test_basic_addition(self):
-        #self.assertEqual(1 + 1, 2)
+from scipy_central.pagehit import models, recorder, filters
+from scipy_central.pagehit.views import create_hit, get_pagehits
+from scipy_central.pagehit.management.commands import archive_pagehits
+
+import os
+import gzip
+import json
+import shutil
+import datetime
+import tempfile
+
+
+class PageHitDailyTest(TestCase):
+    def setUp(self):
+        filters.recent_hits.hits.clear()
+        self.visitors = 0
+
+    def hit(self, item, extra_info=None):
+        # A different visitor every time, so that no hit is a repeat
+        self.visitors += 1
+        request = RequestFactory().get('/',
+                                REMOTE_ADDR='127.0.0.%d' % self.visitors,
+                                HTTP_USER_AGENT='Mozilla/5.0')
+        create_hit(request, item, extra_info=extra_info)
+
+    def test_daily_counts(self):
+        """ Page views are counted per item and day as they are recorded. """
+        for n in range(3):
+            self.hit('spc-main-page')
+        self.hit('spc-about-page')
+        self.hit('haystack_search', extra_info='query')
+
+        self.assertEqual(models.PageHitDaily.objects.get(
+                                item='spc-main-page').hits, 3)
+        self.assertEqual(get_pagehits('spc-main-page', item_pk=1), 3)
+        self.assertEqual(get_pagehits('spc-main-page', item_pk=2), 0)
+        self.assertEqual(get_pagehits('haystack_search', item_pk=5), 0)
+
+        yesterday = datetime.datetime.now() - datetime.timedelta(days=1)
+        models.PageHitDaily.objects.add_hits('spc-main-page', 1,
+                                             yesterday.date(), 2)
+        self.assertEqual(get_pagehits('spc-main-page'), [(5, 1)])
+        self.assertEqual(get_pagehits('spc-main-page',
+                             start_date=datetime.datetime.now()), [(3, 1)])
+
+    def test_rebuild(self):
+        """ The daily counts can be recounted from the raw hits. """
+        for n in range(2):
+            self.hit('spc-main-page')
+        self.hit('spc-about-page', extra_info='download')
+        models.PageHitDaily.objects.all().delete()
+        # The count of a day whose hits were archived
+        last_year = datetime.date.today() - datetime.timedelta(days=365)
+        models.PageHitDaily.objects.create(item='spc-main-page', item_pk=1,
+                                           day=last_year, hits=5)
+
+        call_command('rebuild_pagehit_rollup', verbosity=0)
+        self.assertEqual(list(models.PageHitDaily.objects.order_by('day')
+                              .values_list('item', 'item_pk', 'day', 'hits')),
+                         [('spc-main-page', 1, last_year, 5),
+                          ('spc-main-page', 1, datetime.date.today(), 2)])
+
+
+class HitFilterTest(TestCase):
+    def setUp(self):
+        filters.recent_hits.hits.clear()
+
+    def hit(self, ua_string, ip_address='127.0.0.1', item='spc-main-page'):
+        request = RequestFactory().get('/', REMOTE_ADDR=ip_address,
+                                       HTTP_USER_AGENT=ua_string)
+        create_hit(request, item)
+
+    def test_bots(self):
+        """ Hits from crawlers and scripts are not recorded. """
+        self.assertTrue(filters.is_bot('Mozilla/5.0 (compatible; '
+                            'Googlebot/2.1; +http://www.google.com/bot.html)'))
+        self.assertTrue(filters.is_bot('python-requests/2.0.1'))
+        self.assertTrue(filters.is_bot(' '))
+        self.assertTrue(filters.is_bot('Mozilla/5.0 (X11; Linux x86_64) '
+                            'AppleWebKit/537.36 (KHTML, like Gecko) '
+                            'HeadlessChrome/60.0.3112.50 Safari/537.36'))
+        self.assertFalse(filters.is_bot('Mozilla/5.0 (X11; Linux x86_64; '
+                                        'rv:24.0) Gecko/20100101 Firefox/24.0'))
+        self.assertTrue(filters.is_bot('Googlebot-Image/1.0'))
+        self.assertTrue(filters.is_bot('Java/1.8.0_151'))
+        self.assertFalse(filters.is_bot('Mozilla/5.0 (Linux; Android 8.1.0; '
+                            'CUBOT KING KONG Build/O11019) AppleWebKit/537.36 '
+                            '(KHTML, like Gecko) Chrome/70.0.3538.110 Mobile '
+                            'Safari/537.36'))
+        self.assertFalse(filters.is_bot('MyApp/2.0 (Linux; Android 9) '
+                                        'okhttp/3.12 java/1.8'))
+        # Browsers whose user agent happens to contain a word bots use
+        self.assertFalse(filters.is_bot('Mozilla/5.0 (Windows NT 10.0; '
+                            'Win64; x64; Monitor) Gecko/20100101 '
+                            'Firefox/60.0 Preview'))
+        self.hit('Wget/1.14 (linux-gnu)')
+        self.hit('')
+        self.assertEqual(models.PageHit.objects.count(), 0)
+
+    def test_repeated_hits(self):
+        """ A visitor is counted once per item and dedupe window. """
+        for n in range(3):
+            self.hit('Mozilla/5.0')
+        self.hit('Mozilla/5.0', item='spc-about-page')
+        self.hit('Mozilla/5.0', ip_address='127.0.0.2')
+        self.hit('Opera/9.80')
+        self.assertEqual(models.PageHit.objects.count(), 4)
+        self.assertEqual(get_pagehits('spc-main-page', item_pk=1), 3)
+        self.assertEqual(get_pagehits('spc-about-page', item_pk=2), 1)
+
+        recent = filters.RecentHits(max_size=2, window=60)
+        self.assertFalse(recent.seen('a', now=0))
+        self.assertTrue(recent.seen('a', now=30))
+        self.assertTrue(recent.seen('a', now=59))
+        self.assertFalse(recent.seen('a', now=61))
+        self.assertFalse(recent.seen('b', now=62))
+        self.assertFalse(recent.seen('c', now=63))
+        # 'a', the least recently seen, was evicted
+        self.assertFalse(recent.seen('a', now=64))
+
+    def test_user_agents(self):
+        """ Every user agent string is stored once. """
+        for n in range(3):
+            self.hit('Mozilla/5.0', ip_address='127.0.0.%d' % n)
+        self.hit('Opera/9.80')
+        self.assertEqual(models.PageHit.objects.count(), 4)
+        self.assertEqual(sorted(models.UserAgent.objects.values_list(
+                                'ua_string', flat=True)),
+                         ['Mozilla/5.0', 'Opera/9.80'])
+        self.assertEqual(models.PageHit.objects.filter(
+                            user_agent__ua_string='Mozilla/5.0').count(), 3)
+        self.assertEqual(models.UserAgent.objects.intern(['Opera/9.80']),
+            {'Opera/9.80': models.UserAgent.objects.get(ua_string='Opera/9.80').pk})
+
+
+class HitSpoolTest(TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.spool = recorder.HitSpool(self.tempdir, flush_size=2,
+                                       flush_interval=3600, max_size=1000)
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def hit(self, item_pk, extra_info=None):
+        return {'ip_address': '127.0.0.1', 'ua_string': 'Mozilla/5.0',
+                'item': 'submission', 'item_pk': item_pk,
+                'extra_info': extra_info, 'datetime': datetime.datetime.now()}
+
+    def test_flush(self):
+        """ Spooled hits are written in a batch once enough are recorded. """
+        self.spool.append(self.hit(1))
+        self.assertFalse(self.spool.needs_flush())
+        self.spool.append(self.hit(1, extra_info='download'))
+        self.assertTrue(self.spool.needs_flush())
+        self.assertEqual(models.PageHit.objects.count(), 0)
+
+        # Left behind by a process that died while flushing
+        left = open(os.path.join(self.tempdir, 'hits-4194305-1.flushing'), 'w')
+        hit = self.hit(2)
+        hit['datetime'] = hit['datetime'].strftime(recorder.DATETIME_FORMAT)
+        left.write(json.dumps(hit) + '\n')
+        left.close()
+
+        self.assertEqual(self.spool.flush(), 3)
+        self.assertFalse(self.spool.needs_flush())
+        self.assertEqual(models.PageHit.objects.count(), 3)
+        self.assertEqual(get_pagehits('submission'), [(1, 1), (1, 2)])
+        self.assertEqual(os.listdir(self.tempdir), ['hits.lock'])
+        self.assertEqual(self.spool.flush(), 0)
+
+    def test_invalid_lines(self):
+        """ A line left half-written by a crash does not hold up the
+        flushes. """
+        self.spool.append(self.hit(1))
+        spool_file = open(os.path.join(self.tempdir, 'hits.jsonl'), 'a')
+        spool_file.write('{"ip_address": "127.0.0.1", "ua_str\n')
+        spool_file.close()
+        self.spool.append(self.hit(2))
+
+        self.assertEqual(self.spool.flush(), 2)
+        self.assertEqual(get_pagehits('submission'), [(1, 1), (1, 2)])
+        self.assertEqual(os.listdir(self.tempdir), ['hits.lock'])
+
+    def test_spool_full(self):
+        """ Hits are dropped once the spool is full. """
+        for n in range(20):
+            self.spool.append(self.hit(n))
+        recorded = self.spool.recorded
+        self.assertTrue(0 < recorded < 20)
+        self.assertEqual(self.spool.dropped, 20 - recorded)
+        self.assertEqual(self.spool.flush(), recorded)
+
+
+class ArchiveTest(TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.spc = settings.SPC.copy()
+        settings.SPC['pagehit_archive_dir'] = self.tempdir
+
+    def tearDown(self):
+        settings.SPC.clear()
+        settings.SPC.update(self.spc)
+        shutil.rmtree(self.tempdir)
+
+    def hit(self, days_ago, item_pk=1):
+        return {'ip_address': '127.0.0.1', 'ua_string': 'Mozilla/5.0',
+                'item': 'submission', 'item_pk': item_pk, 'extra_info': None,
+                'datetime': datetime.datetime.now()
+                            - datetime.timedelta(days=days_ago)}
+
+    def read_archive(self):
+        hits = []
+        for fname in sorted(os.listdir(self.tempdir)):
+            hits.extend(json.loads(line) for line in
+                        gzip.open(os.path.join(self.tempdir, fname)))
+        return hits
+
+    def test_archive(self):
+        """ Old hits are moved to monthly archive files. """
+        horizon = settings.SPC['hit_horizon']
+        old = [self.hit(horizon + 100), self.hit(horizon + 100, item_pk=2),
+               self.hit(horizon + 1)]
+        recorder.save_hits(old + [self.hit(0), self.hit(horizon - 2)])
+        daily_hits = models.PageHitDaily.objects.count()
+
+        call_command('archive_pagehits', days=horizon, batch_size=2,
+                     verbosity=0)
+        self.assertEqual(models.PageHit.objects.count(), 2)
+        self.assertEqual(models.PageHitDaily.objects.count(), daily_hits)
+        names = sorted(os.listdir(self.tempdir))
+        self.assertEqual(names[0], old[0]['datetime'].strftime(
+                                            'pagehits-%Y-%m.jsonl.gz'))
+        self.assertEqual(names[-1], old[2]['datetime'].strftime(
+                                            'pagehits-%Y-%m.jsonl.gz'))
+        archived = self.read_archive()
+        self.assertEqual([(hit['item_pk'], hit['ua_string'])
+                          for hit in archived],
+                         [(1, 'Mozilla/5.0'), (2, 'Mozilla/5.0'),
+                          (1, 'Mozilla/5.0')])
+
+        # Later runs append to the files
+        recorder.save_hits([self.hit(horizon + 100, item_pk=3)])
+        call_command('archive_pagehits', days=horizon, verbosity=0)
+        self.assertEqual([hit['item_pk'] for hit in self.read_archive()],
+                         [1, 2, 3, 1])
+        self.assertEqual(models.PageHit.objects.count(), 2)
+
+    def test_horizon(self):
+        """ The hits within the hit horizon are never archived. """
+        command = archive_pagehits.Command()
+        self.assertRaises(CommandError, command.handle_noargs,
+                          days=settings.SPC['hit_horizon'] - 1,
+                          batch_size=100, verbosity=0)
@@ -1,11 +1,18 @@
 # Built-in imports
-from datetime import date
-from collections import defaultdict
+from datetime import date, datetime, timedelta
+
+# Django imports
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection
+from django.db.models import Sum
 
 # Imports from other SPC apps
 from scipy_central.utils import get_IP_address
 
 import models
+import filters
+import recorder
 
 static_items = {'spc-main-page': 1,
                 'spc-about-page': 2,
@@ -16,7 +23,9 @@ static_items = {'spc-main-page': 1,
 
 def create_hit(request, item, extra_info=None):
     """
-    Given a Django ``request`` object, create an entry in the DB for the hit.
+    Given a Django ``request`` object, record the hit: it is written to the
+    DB in a batch with other hits (see ``recorder.py``). Hits from bots, and
+    repeated hits from the same visitor, are dropped (see ``filters.py``).
 
     If the ``item`` is a string, then we assume it is a static item and use
     the dictionary above to look up its "primary key".
@@ -26,17 +35,24 @@ def create_hit(request, item, extra_info=None):
     if extra_info is None:
         extra_info = request.META.get('HTTP_REFERER', None)
     try:
-        page_hit = models.PageHit(ip_address=ip_address, ua_string=ua_string,
-                                 item=item._meta.module_name, item_pk=item.pk,
-                                 extra_info=extra_info)
+        item_name, item_pk = item._meta.module_name, item.pk
     except AttributeError:
-        page_hit = models.PageHit(ip_address=ip_address, ua_string=ua_string,
-                                 item=item, item_pk=static_items.get(item, 0),
-                                 extra_info=extra_info)
+        item_name, item_pk = item, static_items.get(item, 0)
+
+    # Hits are not saved one at a time: truncate long fields here
+    if isinstance(extra_info, basestring):
+        extra_info = extra_info[:models.PageHit.extra_info_len]
+    hit = {'ip_address': ip_address,
+           'ua_string': ua_string[:255],
+           'item': item_name,
+           'item_pk': item_pk,
+           'extra_info': extra_info,
+           'datetime': datetime.now()}
 
-    page_hit.save()
+    # Hits from bots, and repeated hits, are not recorded
+    if filters.is_counted(hit):
+        recorder.record_hit(hit)
 
-# TODO(KGD): cache this result for NN hours
 def get_pagehits(item, start_date=None, end_date=None, item_pk=None):
     """
     Returns a list of tuples of the form:  [(n_hits, Submission.pk), ....]
@@ -49,33 +65,55 @@ def get_pagehits(item, start_date=None, end_date=None, item_pk=None):
 
     However, if ``item_pk`` is provided, then it simply returns the total
     number of page views for that item, as an integer.
+
+    Hits are counted per day (see ``models.PageHitDaily``): the days of
+    ``start_date`` and ``end_date`` are counted in full.
     """
     if start_date is None:
         start_date = date.min
     if end_date is None:
         end_date = date.max
+    if isinstance(start_date, datetime):
+        start_date = start_date.date()
+    if isinstance(end_date, datetime):
+        end_date = end_date.date()
+
+    daily_hits = models.PageHitDaily.objects.filter(item=item).\
+                                       filter(day__gte=start_date).\
+                                       filter(day__lte=end_date)
+    if item_pk is not None:
+        total = daily_hits.filter(item_pk=item_pk).aggregate(Sum('hits'))
+        return total['hits__sum'] or 0
+
+    hit_counts = daily_hits.values('item_pk').annotate(total=Sum('hits'))
+    return [(row['total'], row['item_pk']) for row in hit_counts]
+
+def order_by_pagehits(queryset, item, item_pk_field='id'):
+    """
+    Orders ``queryset`` by the number of page views of the ``item`` given by
+    its ``item_pk_field`` (e.g. the ``entry`` of revisions, ordered by the
+    views of their submission) over the hit horizon, most viewed first. Each
+    object gets the number as its ``pageviews`` attribute.
+
+    The numbers are read from ``models.PageViewTotal`` in the same query: they
+    are recounted at most every ``pagehit_ranking_interval`` seconds.
+    """
+    # ``cache.add`` only succeeds once per interval (in every process that
+    # shares the cache)
+    if cache.add('pagehit-ranking-%s' % item, True,
+                 settings.SPC.get('pagehit_ranking_interval', 600)):
+        start_date = date.today() - timedelta(
+                                        days=settings.SPC['hit_horizon'])
+        models.PageViewTotal.objects.refresh(item, start_date)
 
-    # extra_info=None to avoid counting download hits
-    if item_pk is None:
-        page_hits = models.PageHit.objects.filter(item=item).\
-                                       filter(datetime__gte=start_date).\
-                                       filter(datetime__lte=end_date).\
-                                       filter(extra_info=None)
-    else:
-        page_hits = models.PageHit.objects.filter(item=item).\
-                                       filter(datetime__gte=start_date).\
-                                       filter(datetime__lte=end_date).\
-                                       filter(item_pk=item_pk).\
-                                       filter(extra_info=None)
-
-        return len(page_hits)
-
-    hits_by_pk = defaultdict(int)
-    for hit in page_hits:
-        hits_by_pk[hit.item_pk] += 1
-
-    hit_counts = []
-    for key, val in hits_by_pk.iteritems():
-        hit_counts.append((val, key))
-
-    return hit_counts
+    qn = connection.ops.quote_name
+    opts = queryset.model._meta
+    column = opts.get_field(item_pk_field).column
+    pageviews = ('COALESCE((SELECT hits FROM %s WHERE item = %%s '
+                 'AND item_pk = %s.%s), 0)'
+                 % (qn(models.PageViewTotal._meta.db_table),
+                    qn(opts.db_table), qn(column)))
+    return queryset.extra(select={'pageviews': pageviews},
+                          select_params=[item],
+                          order_by=['-pageviews',
+                                    '-%s.%s' % (opts.db_table, column)])
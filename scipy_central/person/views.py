@@ -146,7 +146,8 @@ def profile_page(request, slug=None, user_id=None):
     # Items created by this user. Use the ``all()`` function first, to prevent
     # unvalidated submissions from showing
     all_revs = Revision.objects.all().filter(created_by=the_user)\
-                                                    .order_by('-date_created')
+                                     .select_related('entry', 'created_by')\
+                                     .order_by('-date_created')
 
     if the_user == request.user:
         no_entries = 'You have not submitted any entries to SciPy Central.'
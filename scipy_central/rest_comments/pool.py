@@ -0,0 +1,173 @@
+"""
+Compiles ReST in a pool of worker processes, so that a snippet that takes
+long to compile holds up a worker, and not the web server.
+
+Each worker sets up Sphinx (see ``renderer.py``) when it starts, and then
+compiles the snippets it is sent one after the other. A worker that takes more
+than ``rest_compile_timeout`` seconds on a snippet is killed and replaced.
+Besides the snippets being compiled, at most ``rest_compile_queue_size`` wait
+for a worker: once that many are waiting, previews are refused (with
+``CompilerBusy``), and other snippets wait for room in the queue.
+
+The pool is disabled if ``rest_compile_workers`` is 0: snippets are then
+compiled in the web server process.
+"""
+from django.conf import settings
+from django.db import connections
+from sphinx.application import SphinxError
+
+import Queue
+import signal
+import threading
+import multiprocessing
+
+from renderer import renderer
+
+
+class CompilerBusy(Exception):
+    """ All the workers are busy, and the queue is full. """
+    pass
+
+
+class CompileTimeout(SphinxError):
+    category = 'Compile timeout'
+
+
+# The database connections of the web server process, left open in workers
+_inherited = []
+
+def work(conn):
+    """ The main loop of a worker: compiles the ReST received on ``conn``. """
+    # The connections are shared with the web server process: closing them
+    # here would close them there too
+    for connection in connections.all():
+        _inherited.append(connection.connection)
+        connection.connection = None
+    # Interrupting the web server (in development) stops the workers
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+    renderer.start()
+    while True:
+        try:
+            rest = conn.recv()
+        except EOFError:
+            # The web server process is gone
+            break
+        try:
+            conn.send((True, renderer.render(rest)))
+        except SphinxError as error:
+            conn.send((False, (error.category, str(error))))
+        except Exception as error:
+            conn.send((False, ('Compile error', '%s: %s' % (
+                                            error.__class__.__name__, error))))
+
+
+class Worker(object):
+    """ A worker process, and the pipe to talk to it. """
+    def __init__(self):
+        self.conn, child_conn = multiprocessing.Pipe()
+        self.process = multiprocessing.Process(target=work,
+                                               args=(child_conn,))
+        self.process.daemon = True
+        self.process.start()
+        child_conn.close()
+
+    def compile(self, rest, timeout):
+        """ Returns the HTML of ``rest``, compiled in at most ``timeout``
+        seconds.
+        """
+        self.conn.send(rest)
+        if not self.conn.poll(timeout):
+            self.stop()
+            raise CompileTimeout('Compiling took more than %s seconds'
+                                 % timeout)
+        try:
+            success, result = self.conn.recv()
+        except EOFError:
+            self.stop()
+            raise SphinxError('The compiler worker died')
+        if not success:
+            category, message = result
+            error = SphinxError(message)
+            error.category = category
+            raise error
+        return result
+
+    @property
+    def alive(self):
+        return self.process.is_alive()
+
+    def stop(self):
+        if self.process.is_alive():
+            self.process.terminate()
+        self.process.join()
+        self.conn.close()
+
+
+class CompilerPool(object):
+    """ ``size`` workers, started when the first snippet is compiled. """
+    def __init__(self, size, timeout=10, queue_size=8):
+        self.size = size
+        self.timeout = timeout
+        self.lock = threading.Lock()
+        # The snippets being compiled, or waiting for a worker
+        self.slots = threading.Semaphore(size + queue_size)
+        self.idle = Queue.Queue()
+        self.workers = []
+
+    @property
+    def enabled(self):
+        return self.size > 0
+
+    def start(self):
+        with self.lock:
+            while len(self.workers) < self.size:
+                worker = Worker()
+                self.workers.append(worker)
+                self.idle.put(worker)
+
+    def compile(self, rest, wait=True):
+        """
+        Returns the HTML (unicode) of ``rest``, a utf-8 encoded string.
+
+        If the queue is full, waits for room in it, or raises ``CompilerBusy``
+        if ``wait`` is False. Raises ``SphinxError`` (``CompileTimeout`` if
+        the worker had to be killed) if the snippet could not be compiled.
+        """
+        if not self.slots.acquire(wait):
+            raise CompilerBusy()
+        try:
+            self.start()
+            worker = self.idle.get()
+            if not worker.alive:
+                worker = self.replace(worker)
+            try:
+                return worker.compile(rest, self.timeout)
+            finally:
+                if not worker.alive:
+                    worker = self.replace(worker)
+                self.idle.put(worker)
+        finally:
+            self.slots.release()
+
+    def replace(self, worker):
+        """ Starts a worker in place of ``worker``, which has stopped. """
+        worker.stop()
+        new_worker = Worker()
+        with self.lock:
+            if worker in self.workers:
+                self.workers[self.workers.index(worker)] = new_worker
+        return new_worker
+
+    def stop(self):
+        """ Stops the workers. """
+        with self.lock:
+            workers, self.workers = self.workers, []
+            self.idle = Queue.Queue()
+        for worker in workers:
+            worker.stop()
+
+
+pool = CompilerPool(settings.SPC.get('rest_compile_workers', 0),
+                    timeout=settings.SPC.get('rest_compile_timeout', 10),
+                    queue_size=settings.SPC.get('rest_compile_queue_size', 8))
@@ -0,0 +1,292 @@
+"""
+Renders reStructuredText to HTML in memory.
+
+A Sphinx application, set up once per process with the comments'
+``conf.py`` (the same extensions, the ``:image:`` role and math), parses each
+ReST snippet with docutils and writes the document tree straight to an HTML
+fragment: the same HTML as a full ``pickle`` build of the snippet, without
+creating the application again, or writing and reading files, every time.
+
+This relies on Sphinx 1.3's internals (see ``requirements.txt``): if they are
+not what is expected, the snippet is compiled with a full build instead.
+"""
+import os
+import pickle
+import shutil
+import codecs
+import tempfile
+import threading
+from StringIO import StringIO
+import logging
+logger = logging.getLogger('scipycentral')
+
+from docutils.io import StringInput, NullOutput
+from docutils.core import Publisher
+from docutils.parsers.rst import roles
+from sphinx.application import Sphinx, SphinxError
+from sphinx.io import SphinxStandaloneReader, SphinxDummyWriter
+from sphinx.util.osutil import relative_uri
+
+from django.conf import settings
+from django import template
+
+from scipy_central.utils import ensuredir
+from scipy_central.screenshot.models import Screenshot
+
+# Every snippet is rendered as this (only) document
+DOCNAME = 'index'
+
+
+def render_conf():
+    """
+    Returns the Sphinx ``conf.py`` file for the comments: the ``sphinx-conf.py``
+    template in the current directory, rendered with the site's settings.
+    """
+    conf_template_file = os.path.join(os.path.dirname(__file__),
+                                      'sphinx-conf.py')
+    with file(conf_template_file, 'r') as f:
+        conf_template = template.Template(f.read())
+
+    return conf_template.render(template.Context({'FULL_MEDIA_URL': settings.MEDIA_URL}))
+
+def setup_compile_dir(compile_dir):
+    """
+    Setup a directory for Sphinx compilation.
+
+    We need certain files in place to compile the comments Copy the
+    settings, image extension, and an __init__.py to the appropriate
+    places. The original copy of the ``conf.py`` file, found in the
+    current directory (copy it to comment destination)
+    """
+    module_dir = os.path.dirname(__file__)
+
+    ext_dir = os.path.abspath(os.path.join(compile_dir, 'ext'))
+    ensuredir(compile_dir)
+    ensuredir(ext_dir)
+
+    conf_file = os.path.join(compile_dir, 'conf.py')
+    with file(conf_file, 'w') as f:
+        f.write(render_conf())
+
+    fn = os.path.join(module_dir, 'images.py')
+    shutil.copyfile(fn, os.path.join(compile_dir, 'ext', 'images.py'))
+
+    fn = os.path.join(module_dir, '__init__.py')
+    shutil.copyfile(fn, os.path.join(compile_dir, 'ext', '__init__.py'))
+
+
+def build(rest):
+    """
+    Compiles ``rest``, a utf-8 encoded string, with a full Sphinx build in a
+    temporary directory, and returns its HTML fragment (unicode).
+    """
+    ensuredir(settings.SPC['comment_compile_dir'])
+    compile_dir = tempfile.mkdtemp(dir=settings.SPC['comment_compile_dir'])
+    try:
+        setup_compile_dir(compile_dir)
+        with open(os.path.join(compile_dir, 'index.rst'), 'w') as fh:
+            fh.write(rest)
+
+        build_dir = os.path.join(compile_dir, '_build')
+        warning = StringIO()
+        try:
+            app = Sphinx(srcdir=compile_dir, confdir=compile_dir,
+                         outdir=os.path.join(build_dir, 'pickle'),
+                         doctreedir=os.path.join(build_dir, 'doctrees'),
+                         buildername='pickle',
+                         status=None,
+                         warning=warning,
+                         freshenv=True,
+                         warningiserror=False,
+                         tags=[])
+
+            # We need to access some settings while inside Sphinx
+            # This is the easiest way to get them there
+            app.env.config.SPC = settings.SPC
+            app.env.config.SPC['__Screenshot__'] = Screenshot
+
+            # Call the ``pickle`` builder
+            app.build(force_all=True)
+        except SphinxError:
+            for line in warning.getvalue().splitlines():
+                logger.warn('COMMENT: ' + line)
+            raise
+
+        if app.statuscode != 0:
+            logger.error("Non-zero status code when compiling.")
+
+        pickle_f = os.path.join(build_dir, 'pickle', 'index.fpickle')
+        with open(pickle_f, 'rb') as fhand:
+            return pickle.load(fhand)['body']
+    finally:
+        shutil.rmtree(compile_dir)
+
+
+class SnippetInput(StringInput):
+    """
+    A ReST snippet given as a string, read like Sphinx reads a source file
+    (see ``sphinx.io.SphinxFileInput``).
+    """
+    def __init__(self, app, env, *args, **kwargs):
+        self.app = app
+        self.env = env
+        kwargs['error_handler'] = 'sphinx'
+        StringInput.__init__(self, *args, **kwargs)
+
+    def read(self):
+        data = self.decode(self.source)
+        arg = [data]
+        self.app.emit('source-read', DOCNAME, arg)
+        data = arg[0]
+        if self.env.config.rst_epilog:
+            data = data + '\n' + self.env.config.rst_epilog + '\n'
+        if self.env.config.rst_prolog:
+            data = self.env.config.rst_prolog + '\n' + data
+        return data
+
+
+class Renderer(object):
+    """
+    Renders ReST snippets to HTML with a Sphinx application that is set up
+    when the first snippet is rendered.
+
+    Sphinx keeps the state of the document being read in its environment:
+    snippets are rendered one at a time.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.app = None
+        self.warning = StringIO()
+
+    def start(self):
+        """ Sets up the Sphinx application, and its HTML writer. """
+        ensuredir(settings.SPC['comment_compile_dir'])
+        conf_dir = tempfile.mkdtemp(dir=settings.SPC['comment_compile_dir'])
+        try:
+            setup_compile_dir(conf_dir)
+            app = Sphinx(srcdir=conf_dir, confdir=conf_dir,
+                         outdir=os.path.join(conf_dir, '_build', 'pickle'),
+                         doctreedir=os.path.join(conf_dir, '_build',
+                                                 'doctrees'),
+                         buildername='pickle',
+                         status=None,
+                         warning=self.warning,
+                         freshenv=True,
+                         warningiserror=False,
+                         tags=[])
+        finally:
+            # Nothing is read from, or written to, the directory any more
+            shutil.rmtree(conf_dir)
+
+        # We need to access some settings while inside Sphinx
+        # This is the easiest way to get them there
+        app.env.config.SPC = settings.SPC
+        app.env.config.SPC['__Screenshot__'] = Screenshot
+
+        app.env.app = app
+        app.env.found_docs = set([DOCNAME])
+        app.builder.search = False
+        app.builder.prepare_writing([DOCNAME])
+        self.app = app
+
+    def render(self, rest):
+        """
+        Returns the HTML fragment (unicode) of ``rest``, a utf-8 encoded
+        string. Sphinx's warnings are logged if it fails. Falls back on a
+        full build if Sphinx's internals are not the expected ones.
+        """
+        with self.lock:
+            try:
+                if self.app is None:
+                    self.start()
+                return self.write(self.read(rest))
+            except (AttributeError, TypeError) as error:
+                # Most likely, not the Sphinx version this was written for
+                logger.error('Could not render ReST in memory (%s: %s): '
+                             'compiling it with a full Sphinx build'
+                             % (error.__class__.__name__, error))
+            except SphinxError:
+                for line in self.warning.getvalue().splitlines():
+                    logger.warn('COMMENT: ' + line)
+                raise
+            finally:
+                self.warning.seek(0)
+                self.warning.truncate()
+        return build(rest)
+
+    def read(self, rest):
+        """ Parses ``rest`` into a document tree, like ``env.read_doc``. """
+        app, env = self.app, self.app.env
+        # Forgets the previous snippet
+        env.clear_doc(DOCNAME)
+
+        env.temp_data['docname'] = DOCNAME
+        env.temp_data['default_domain'] = \
+            env.domains.get(env.config.primary_domain)
+        env.settings['input_encoding'] = env.config.source_encoding
+        env.settings['trim_footnote_reference_space'] = \
+            env.config.trim_footnote_reference_space
+        env.settings['gettext_compact'] = env.config.gettext_compact
+        env.patch_lookup_functions()
+        codecs.register_error('sphinx', env.warn_and_replace)
+        try:
+            pub = Publisher(reader=SphinxStandaloneReader(
+                                        parsers=env.config.source_parsers),
+                            writer=SphinxDummyWriter(),
+                            destination_class=NullOutput)
+            pub.set_components(None, 'restructuredtext', None)
+            pub.process_programmatic_settings(None, env.settings, None)
+            src_path = env.doc2path(DOCNAME)
+            pub.source = SnippetInput(app, env, source=rest,
+                                      source_path=src_path,
+                                      encoding=env.config.source_encoding)
+            pub.settings._source = src_path
+            pub.set_destination(None, None)
+            pub.publish()
+            doctree = pub.document
+
+            env.filter_messages(doctree)
+            env.process_dependencies(DOCNAME, doctree)
+            env.process_images(DOCNAME, doctree)
+            env.process_downloads(DOCNAME, doctree)
+            env.process_metadata(DOCNAME, doctree)
+            env.process_refonly_bullet_lists(DOCNAME, doctree)
+            env.create_title_from(DOCNAME, doctree)
+            env.note_indexentries_from(DOCNAME, doctree)
+            env.note_citations_from(DOCNAME, doctree)
+            env.build_toc_from(DOCNAME, doctree)
+            for domain in env.domains.itervalues():
+                domain.process_doc(env, DOCNAME, doctree)
+            app.emit('doctree-read', doctree)
+            env.all_docs[DOCNAME] = 0
+        finally:
+            env.temp_data.clear()
+            env.ref_context.clear()
+            roles._roles.pop('', None)
+        return doctree
+
+    def write(self, doctree):
+        """ Resolves the references in ``doctree``, and writes it to HTML. """
+        env, builder = self.app.env, self.app.builder
+        doctree.settings.env = env
+        doctree = env.get_and_resolve_doctree(DOCNAME, builder, doctree)
+
+        builder.imgpath = relative_uri(builder.get_target_uri(DOCNAME),
+                                       builder.imagedir)
+        builder.post_process_images(doctree)
+
+        doctree.settings = builder.docsettings
+        builder.secnumbers = env.toc_secnumbers.get(DOCNAME, {})
+        builder.fignumbers = env.toc_fignumbers.get(DOCNAME, {})
+        builder.imgpath = relative_uri(builder.get_target_uri(DOCNAME),
+                                       '_images')
+        builder.dlpath = relative_uri(builder.get_target_uri(DOCNAME),
+                                      '_downloads')
+        builder.current_docname = DOCNAME
+        # The output is not used: the fragment is taken from the parts
+        builder.docwriter.write(doctree, NullOutput())
+        builder.docwriter.assemble_parts()
+        return builder.docwriter.parts['fragment']
+
+
+renderer = Renderer()
@@ -3,6 +3,13 @@ from django.test.client import Client
 
 from django.contrib.auth.models import User
 from django.core.urlresolvers import reverse
+from django.core.cache import cache
+from django.conf import settings
+
+from scipy_central.rest_comments import views, renderer, pool
+
+import time
+import threading
 
 class SimpleTest(TestCase):
     def setUp(self):
@@ -81,4 +88,119 @@ class SimpleTest(TestCase):
         self.assertEqual(response.content,
                         ('{"html_text": "<p>The:</p><br><div class=\\"highlight-python\\">'
                          '<div class=\\"highlight\\"><pre>   long<br>   cat<br><br>is<br>'
-                         '</pre></div><br></div><br>", "success": true}'))
\ No newline at end of file
+                         '</pre></div><br></div><br>", "success": true}'))
+
+    def test_busy(self):
+        """ Previews are refused while the compilers are busy. """
+        class BusyPool(object):
+            enabled = True
+            def compile(self, rest, wait=True):
+                raise pool.CompilerBusy()
+
+        compilers = views.pool
+        views.pool = BusyPool()
+        try:
+            response = self.client.get(reverse('spc-rest-convert'),
+                                       {'rest_text': 'The busy cat walked by.',
+                                        'source': 'simpletest'},
+                                       HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+        finally:
+            views.pool = compilers
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response.content, '{"success": false}')
+
+class CompileCacheTest(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_cached_html(self):
+        """ The same ReST is only compiled by Sphinx once. """
+        html = views.compile_rest_to_html(u'The long *cat* walked by.')
+        self.assertEqual(html, '<p>The long <em>cat</em> walked by.</p>\n')
+
+        def no_sphinx(*args, **kwargs):
+            raise AssertionError('Sphinx was called')
+        views.renderer.render = no_sphinx
+        try:
+            self.assertEqual(views.compile_rest_to_html(
+                                    u'The long *cat* walked by.'), html)
+            self.assertRaises(AssertionError, views.compile_rest_to_html,
+                              u'The long **cat** walked by.')
+            # Sizes of screenshots are read from the database
+            self.assertRaises(AssertionError, views.compile_rest_to_html,
+                              u'A :image:`cat.png`')
+        finally:
+            del views.renderer.render
+
+class RendererTest(TestCase):
+    def test_render(self):
+        """ Snippets rendered one after the other don't share any state. """
+        html = renderer.renderer.render('Title\n=====\n\nSee [1]_.\n\n'
+                                        '.. [1] The note.\n')
+        self.assertTrue('<h1>Title</h1>' in html)
+        self.assertTrue('The note.' in html)
+
+        self.assertEqual(renderer.renderer.render('No notes :math:`a^2`.'),
+                         u'<p>No notes <span class="math">\\(a^2\\)</span>'
+                         u'.</p>\n')
+        self.assertEqual(renderer.renderer.render('A :image:`cat.png`'),
+                         u'<p>A <img alt="%simages/cat.png" src="%simages/'
+                         u'cat.png" /></p>\n' % ((settings.MEDIA_URL,) * 2))
+
+    def test_fallback(self):
+        """ A full Sphinx build is used if the in-memory rendering breaks. """
+        rest = 'The long *cat* walked by :math:`a^2`.'
+        html = renderer.renderer.render(rest)
+
+        def other_sphinx(*args, **kwargs):
+            raise TypeError('__init__() takes exactly 3 arguments (2 given)')
+        renderer.renderer.read = other_sphinx
+        try:
+            self.assertEqual(renderer.renderer.render(rest), html)
+        finally:
+            del renderer.renderer.read
+        self.assertEqual(renderer.renderer.render(rest), html)
+
+class CompilerPoolTest(TestCase):
+    def test_compile(self):
+        """ Snippets are compiled by the workers, with a time limit. """
+        def slow_render(rest):
+            time.sleep(float(rest))
+            return u''
+
+        # The worker is started with the slow renderer; the one that replaces
+        # it gets the real one
+        renderer.renderer.render = slow_render
+        compilers = pool.CompilerPool(1, timeout=0.5, queue_size=0)
+        try:
+            compilers.start()
+        finally:
+            del renderer.renderer.render
+
+        try:
+            self.assertEqual(compilers.compile('0'), u'')
+            worker = compilers.workers[0]
+
+            errors = []
+            def compile_slowly():
+                try:
+                    compilers.compile('5')
+                except Exception, e:
+                    errors.append(e)
+            thread = threading.Thread(target=compile_slowly)
+            thread.start()
+            while not compilers.idle.empty():
+                time.sleep(0.01)
+            # The worker is busy, and there is no room in the queue
+            self.assertRaises(pool.CompilerBusy, compilers.compile, '0',
+                              wait=False)
+            thread.join()
+
+            self.assertEqual(len(errors), 1)
+            self.assertTrue(isinstance(errors[0], pool.CompileTimeout))
+            self.assertFalse(worker.alive)
+            self.assertNotEqual(compilers.workers[0], worker)
+            self.assertEqual(compilers.compile('The long *cat* walked by.'),
+                             u'<p>The long <em>cat</em> walked by.</p>\n')
+        finally:
+            compilers.stop()
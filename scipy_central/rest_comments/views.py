@@ -2,69 +2,62 @@
 Converts user's reStructuredText input to HTML.
 """
 # Standard library imports
-import os, pickle, time, shutil, re, tempfile
-from StringIO import StringIO
+import os, time, re, hashlib
 import logging
 logger = logging.getLogger('scipycentral')
 
 # 3rd party (non-Django) imports
-from sphinx.application import Sphinx, SphinxError
+import sphinx
+from sphinx.application import SphinxError
 import simplejson
 
 # Django import
 from django.contrib.auth.decorators import login_required
-from django.contrib.sites.models import Site
+from django.core.cache import cache
 from django.http import HttpResponse, Http404
 from django.conf import settings
-from django import template
 
 # Internal import
-from scipy_central.utils import ensuredir
-from scipy_central.screenshot.models import Screenshot
+from scipy_central.rest_comments.renderer import renderer, render_conf
+from scipy_central.rest_comments.pool import pool, CompilerBusy
 
 
-def setup_compile_dir(compile_dir):
-    """
-    Setup a directory for Sphinx compilation.
+_conf_version = None
 
-    We need certain files in place to compile the comments Copy the
-    settings, image extension, and an __init__.py to the appropriate
-    places. The original copy of the ``conf.py`` file, found in the
-    current directory (copy it to comment destination)
+def conf_version():
     """
-
-    if Site._meta.installed:
-        site = Site.objects.get_current().domain
-    else:
-        site = ''
-
-    module_dir = os.path.dirname(__file__)
-
-    ext_dir = os.path.abspath(os.path.join(compile_dir, 'ext'))
-    ensuredir(compile_dir)
-    ensuredir(ext_dir)
-
-    conf_template_file = os.path.join(module_dir, 'sphinx-conf.py')
-    conf_file = os.path.join(compile_dir, 'conf.py')
-
-    with file(conf_template_file, 'r') as f:
-        conf_template = template.Template(f.read())
-
-    conf = conf_template.render(template.Context({'FULL_MEDIA_URL': settings.MEDIA_URL}))
-
-    with file(conf_file, 'w') as f:
-        f.write(conf)
-
-    fn = os.path.join(module_dir, 'images.py')
-    shutil.copyfile(fn, os.path.join(compile_dir, 'ext', 'images.py'))
-
-    fn = os.path.join(module_dir, '__init__.py')
-    shutil.copyfile(fn, os.path.join(compile_dir, 'ext', '__init__.py'))
-
-def compile_rest_to_html(raw_rest):
+    Returns a hash of everything besides the ReST that the HTML depends on:
+    the Sphinx version, the ``conf.py`` file and the image extension.
+    """
+    global _conf_version
+    if _conf_version is None:
+        version = hashlib.sha1(sphinx.__version__)
+        version.update(render_conf().encode('utf-8'))
+        with open(os.path.join(os.path.dirname(__file__), 'images.py')) as f:
+            version.update(f.read())
+        _conf_version = version.hexdigest()
+    return _conf_version
+
+def html_cache_key(rest):
+    """
+    Returns the cache key of the HTML compiled from the (sanitized) ``rest``,
+    or None if that HTML is not cached.
+    """
+    if not settings.SPC.get('rest_html_cache_timeout', 0):
+        return None
+    # The image role reads the sizes of screenshots from the database
+    if ':image:' in rest:
+        return None
+    return 'rest-html-' + hashlib.sha1(conf_version() + rest).hexdigest()
+
+def compile_rest_to_html(raw_rest, wait=True):
     """ Compiles the RST string, ``raw_RST`, to HTML.  Performs no
     further checking on the RST string.
 
+    The RST is compiled by the pool of compiler processes, if enabled: if
+    they are all busy, and ``wait`` is False, ``CompilerBusy`` is raised
+    rather than waiting for a turn.
+
     If it is a comment, then we don't modify the HTML with extra class info.
     But we do filter comments to disable hyperlinks.
 
@@ -171,72 +164,31 @@ def compile_rest_to_html(raw_rest):
 
         return '\r\n'.join(raw_rest)
 
-    def call_sphinx_to_compile(working_dir):
-        """
-        Changes to the ``working_dir`` directory and compiles the RST files to
-        pickle files, according to settings in the conf.py file.
+    # The same ReST always compiles to the same HTML: Sphinx only runs for
+    # ReST that has not been compiled recently
+    modified_rest = sanitize_raw_rest(raw_rest)
+    cache_key = html_cache_key(modified_rest)
+    if cache_key:
+        html = cache.get(cache_key)
+        if html is not None:
+            return html
 
-        Returns nothing, but logs if an error occurred.
-        """
-        working_dir = os.path.abspath(working_dir)
-        build_dir = os.path.join(working_dir, '_build')
-        ensuredir(build_dir)
-
-        status = StringIO()
-        warning = StringIO()
-        try:
-            app = Sphinx(srcdir=working_dir, confdir=working_dir,
-                         outdir = os.path.join(build_dir, 'pickle'),
-                         doctreedir = os.path.join(build_dir, 'doctrees'),
-                         buildername = 'pickle',
-                         status = status,
-                         warning = warning,
-                         freshenv = True,
-                         warningiserror = False,
-                         tags = [])
-
-            # We need to access some settings while inside Sphinx
-            # This is the easiest way to get them there
-            app.env.config.SPC = settings.SPC
-            app.env.config.SPC['__Screenshot__'] = Screenshot
-
-            # Call the ``pickle`` builder
-            app.build(force_all=True)
-
-        except SphinxError as error:
-            if warning.tell():
-                warning.seek(0)
-                for line in warning.readlines():
-                    logger.warn('COMMENT: ' + line)
-
-            msg = (('Sphinx error occurred when compiling comment '
-                    '(error type = %s): %s'  % (error.category, str(error))))
-            logger.error(msg)
-            raise SphinxError(msg)
-
-        if app.statuscode != 0:
-            logger.error("Non-zero status code when compiling.")
-
-    # Create a directory where Sphinx will compile the ReST
-    ensuredir(settings.SPC['comment_compile_dir'])
-    compile_dir = tempfile.mkdtemp(dir=settings.SPC['comment_compile_dir'])
+    logger.debug('SPHINX: ' + raw_rest)
     try:
-        setup_compile_dir(compile_dir)
-        logger.debug('SPHINX: ' + raw_rest)
-        modified_rest = sanitize_raw_rest(raw_rest)
-        with open(os.path.join(compile_dir, 'index.rst'), 'w') as fh:
-            fh.write(modified_rest)
-
-        # Compile the comment
-        call_sphinx_to_compile(compile_dir)
-
-        pickle_f = os.path.join(compile_dir, '_build', 'pickle', 'index.fpickle')
-        with open(pickle_f, 'rb') as fhand:
-            obj = pickle.load(fhand)
-    finally:
-        shutil.rmtree(compile_dir)
-
-    return obj['body'].encode('utf-8')
+        if pool.enabled:
+            html = pool.compile(modified_rest, wait=wait)
+        else:
+            html = renderer.render(modified_rest)
+    except SphinxError as error:
+        msg = (('Sphinx error occurred when compiling comment '
+                '(error type = %s): %s'  % (error.category, str(error))))
+        logger.error(msg)
+        raise SphinxError(msg)
+
+    html = html.encode('utf-8')
+    if cache_key:
+        cache.set(cache_key, html, settings.SPC['rest_html_cache_timeout'])
+    return html
 
 @login_required
 def rest_to_html_ajax(request):
@@ -253,9 +205,13 @@ def rest_to_html_ajax(request):
         raise Http404
     start_time = time.time()
     try:
-        html_text = compile_rest_to_html(rest_text).replace('\n', '<br>')
+        html_text = compile_rest_to_html(rest_text, wait=False).replace('\n', '<br>')
         data['html_text'] = html_text
         data['success'] = True
+    except CompilerBusy:
+        logger.warning("Comment compilers busy: preview refused:: %s" % source)
+        return HttpResponse(simplejson.dumps(data), status=503,
+                            mimetype='application/json')
     except SphinxError:
         logger.warning("Unable to compile comment:: Sphinx compile error::\
             %s" % source)
@@ -1,5 +1,5 @@
 from django.contrib import admin
-from models import License, Submission, Revision, TagCreation
+from models import License, Submission, Revision, TagCreation, StorageJob
 
 class LicenseAdmin(admin.ModelAdmin):
     list_display = ('name', 'description')
@@ -19,7 +19,14 @@ class RevisionAdmin(admin.ModelAdmin):
 class TagCreationAdmin(admin.ModelAdmin):
     list_display = ('date_created', 'tag', 'created_by', 'revision')
 
+class StorageJobAdmin(admin.ModelAdmin):
+    list_display = ('pk', 'revision', 'status', 'attempts', 'date_created',
+                    'date_updated')
+    list_filter = ('status',)
+    ordering = ['-id']
+
 admin.site.register(License, LicenseAdmin)
 admin.site.register(Submission, SubmissionAdmin)
 admin.site.register(Revision, RevisionAdmin)
 admin.site.register(TagCreation, TagCreationAdmin)
+admin.site.register(StorageJob, StorageJobAdmin)
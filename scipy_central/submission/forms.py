@@ -13,11 +13,6 @@ from scipy_central.submission import models
 import random
 import zipfile
 
-try:
-    from cStringIO import StringIO
-except ImportError:
-    from StringIO import StringIO
-
 
 def get_validation_hash(value):
     """
@@ -138,6 +133,10 @@ class PackageForm(BaseSubmissionForm):
         """
         Validate uploaded package file
 
+        Only the ZIP file's directory is read here: the CRC-32 of each file
+        is checked once, as the file is extracted to the repo (if that is done
+        by the storage worker, the submitter is emailed if the check fails).
+
         `package_file` memory is not freed if validated.
         It has to be done once it is stored.
         """
@@ -148,27 +147,17 @@ class PackageForm(BaseSubmissionForm):
             package_file.close()
             raise forms.ValidationError('ZIP file too large')
 
-        # Buf to be used if uploaded file is small & in memory
-        package_buf = StringIO()
-
-        # If file stored in temporary dir & large size
-        if package_file.multiple_chunks():
-            file_path = package_file.temporary_file_path()
-            if not zipfile.is_zipfile(file_path):
-                package_buf.close()
-                package_file.close()
-                raise forms.ValidationError('Upload a valid ZIP file. It was not valid')
-            zip_obj = zipfile.ZipFile(file_path)
-
-        # or file stored in memory & small size
-        else: 
-            package_buf.write(package_file.read())
-            if not zipfile.is_zipfile(package_buf):
-                package_buf.close()
-                package_file.close()
-                raise forms.ValidationError('Upload a valid ZIP file. It was not valid')
-            zip_obj = zipfile.ZipFile(package_buf)
+        # The ZIP file is read straight from the upload: in memory if small,
+        # or from the temporary file Django stored it in, if large
+        if not zipfile.is_zipfile(package_file):
+            package_file.close()
+            raise forms.ValidationError('Upload a valid ZIP file. It was not valid')
+        try:
             package_file.seek(0)
+            zip_obj = zipfile.ZipFile(package_file)
+        except zipfile.BadZipfile:
+            package_file.close()
+            raise forms.ValidationError('Upload a valid ZIP file. It was not valid')
 
         package_size = 0 # size of uncompressed ZIP file
         for each_file in zip_obj.infolist():
@@ -180,37 +169,21 @@ class PackageForm(BaseSubmissionForm):
             for idx, entry in enumerate(file_name):
                 if entry.startswith('..') or (idx == 0 and entry == ''):
                     zip_obj.close()
-                    package_buf.close()
                     package_file.close()
                     raise forms.ValidationError('Please upload a valid ZIP file'
                                                 'File contains invalid file name %s'
                                                 % each_file.filename)
 
-            # check the CRC 
-            # implementation taken from zipfile.ZipFile.testzip (Python 2.7.2)
-            chunk_size = 2 ** 20
-            try:
-                f_obj = zip_obj.open(each_file.filename, 'r')
-                while f_obj.read(chunk_size): # check CRC-32
-                    pass
-            except zipfile.BadZipfile:
-                zip_obj.close()
-                package_buf.close()
-                package_file.close()
-                raise forms.ValidationError('Upload a valid ZIP file. %s failed '
-                                            'CRC-32 checks' % each_file.filename)
-
             # check size of uncompressed ZIP file
             # Some ZIP files could be highly compressed, when extracted
             # would flood filesystem
             package_size += each_file.file_size
             if package_size > settings.SPC['library_max_size']:
                 zip_obj.close()
-                package_buf.close()
                 package_file.close()
                 raise forms.ValidationError('ZIP file too large')
 
         zip_obj.close()
-        package_buf.close()
+        package_file.seek(0)
         
         return self.cleaned_data['package_file']
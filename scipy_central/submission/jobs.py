@@ -0,0 +1,303 @@
+# django imports
+from django.conf import settings
+from django.core.files import File
+from django.contrib.sites.models import Site
+from django.template.loader import render_to_string
+
+# SciPy Central imports
+from scipy_central.utils import send_email, ensuredir
+from scipy_central.filestorage.locking import LockTimeout
+from scipy_central.submission import models, storage
+
+# python imports
+import datetime
+import logging
+import shutil
+import uuid
+import os
+import zipfile
+
+logger = logging.getLogger('scipycentral')
+logger.debug('Initializing submission::jobs.py')
+
+# Failures that may not happen again if the job is retried (e.g. the repo
+# was locked for too long, or the disk was full). Other failures, such as a
+# corrupt package, fail the job straight away.
+TRANSIENT_ERRORS = (LockTimeout, EnvironmentError)
+
+def email_after_submission(instance):
+    """
+    Send email notifications to created user and admin
+    for new/ edited submissions
+    """
+    if not isinstance(instance, models.Revision):
+        raise TypeError('Revision object should be passed as argument')
+
+    email_context = {
+        'user': instance.created_by,
+        'item': instance,
+        'site': Site.objects.get_current()
+    }
+
+    # signed in users
+    if instance.is_displayed:
+        message = render_to_string('submission/email_user_thanks.txt',
+                                   email_context)
+    else:
+        # if user registered but not signed in
+        if instance.created_by.profile.is_validated:
+            message = render_to_string(
+                'submission/email_validated_user_unvalidated_submission.txt',
+                email_context)
+
+        # unknown users
+        else:
+            message = render_to_string(
+                'submission/email_unvalidated_user_unvalidated_submission.txt',
+                email_context)
+
+    # email submitted user
+    send_email((instance.created_by.email,), ('Thank you for your contribution to '
+                                              'SciPy Central'), message=message)
+
+    # email admin
+    message = render_to_string('submission/email_website_admin.txt')
+    send_email((settings.SERVER_EMAIL,), ('A new/edited submission '
+                                          'was made on SciPy Central'),
+               message=message)
+
+def spool_package(package_file):
+    """
+    Copies the uploaded `package_file` to the spool directory, where the
+    worker picks it up. Returns the location of the copy.
+    """
+    spool_dir = os.path.join(settings.SPC['storage_spool_dir'],
+                             uuid.uuid4().hex)
+    ensuredir(spool_dir)
+    dst = os.path.join(spool_dir, os.path.basename(package_file.name))
+    storage.copy_package_file(package_file, dst)
+    return dst
+
+def remove_spooled_package(job):
+    """
+    Removes the spooled package file (if any) of `job`
+    """
+    if job.package_path:
+        shutil.rmtree(os.path.dirname(job.package_path), ignore_errors=True)
+
+def queue_storage(revision, is_new, package_file=None):
+    """
+    Creates the job that stores `revision` in the repo and then sends the
+    notification emails.
+
+    If `SPC['storage_async']` is set, the (uploaded) `package_file` is spooled
+    to disk and the job is left for the worker; otherwise the job is run
+    straight away, without retries. Returns the job.
+    """
+    job = models.StorageJob(revision=revision, submission=revision.entry,
+                            is_new=is_new)
+    if settings.SPC['storage_async']:
+        if package_file is not None:
+            job.package_path = spool_package(package_file)
+        job.save()
+        logger.info('Queued storage job %d for rev.id=%d' % (job.pk,
+                                                             revision.pk))
+        return job
+
+    job.save()
+    # The submitter is told about a failure in the response
+    run_job(job, package_file=package_file, max_attempts=1, notify=False)
+    return job
+
+def claim_next_job(exclude=()):
+    """
+    Claims the oldest job that is ready to run (other than the jobs whose
+    primary keys are in `exclude`), and returns it (or None). A job is never
+    claimed while an earlier job for the same submission is still to be
+    completed, so that revisions are stored in order.
+    """
+    now = datetime.datetime.now()
+    ready = models.StorageJob.objects.filter(status='pending',
+                                             run_after__lte=now)\
+                                     .exclude(pk__in=exclude)
+    for job in ready[:50]:
+        if job.submission_id and models.StorageJob.objects.filter(
+                                 submission=job.submission_id, pk__lt=job.pk,
+                                 status__in=('pending', 'running')).exists():
+            continue
+
+        # Another worker may have claimed the job in the mean time
+        if models.StorageJob.objects.filter(pk=job.pk, status='pending')\
+                                          .update(status='running'):
+            return models.StorageJob.objects.get(pk=job.pk)
+    return None
+
+def requeue_stale_jobs(max_age):
+    """
+    Returns jobs that have been running for more than `max_age` seconds (the
+    worker was, presumably, stopped) to the queue.
+    """
+    since = datetime.datetime.now() - datetime.timedelta(seconds=max_age)
+    return models.StorageJob.objects.filter(status='running',
+                                      date_updated__lt=since)\
+                                     .update(status='pending')
+
+def run_pending_jobs(limit=None):
+    """
+    Runs jobs until none are ready to run, or `limit` jobs have been run.
+    Each job is run (at most) once: failed jobs are left for the next call.
+    Returns the number of jobs run.
+    """
+    done = []
+    while limit is None or len(done) < limit:
+        job = claim_next_job(exclude=done)
+        if job is None:
+            break
+        run_job(job)
+        done.append(job.pk)
+    return len(done)
+
+def run_job(job, package_file=None, max_attempts=None, notify=True):
+    """
+    Runs the storage `job`. The repo is locked while the revision is stored;
+    if storing fails, the repo is reverted (see `SubmissionStorage.revert`)
+    before the lock is released.
+
+    Jobs that failed with one of the `TRANSIENT_ERRORS` are retried (up to
+    `max_attempts` attempts in total) after a delay. Once a job has failed for
+    good, the submitter is emailed (if `notify` is True), and its revision is
+    deleted, along with the submission if it is a new one, like the
+    submission views did when storage failed during the request.
+
+    Returns True if the revision was stored. The exception raised by the last
+    failed attempt, if any, is left in ``job.exception``.
+    """
+    if max_attempts is None:
+        max_attempts = settings.SPC['storage_job_max_attempts']
+    job.exception = None
+    job.status = 'running'
+    job.attempts += 1
+    job.save()
+
+    revision = job.revision
+    if revision is None:
+        job.status = 'failed'
+        job.last_error = 'The revision was deleted before it was stored'
+        job.save()
+        remove_spooled_package(job)
+        return False
+
+    spooled_file = None
+    if package_file is None and job.package_path:
+        spooled_file = package_file = File(open(job.package_path, 'rb'),
+                                   name=os.path.basename(job.package_path))
+    if package_file is not None:
+        revision.package_file = package_file
+
+    fileset = revision.entry.fileset
+    rev_storage = storage.SubmissionStorage(revision, is_new=job.is_new)
+    try:
+        with fileset.write_lock():
+            previous_hash_id = None if job.is_new else fileset.get_hash()
+            try:
+                hash_id = rev_storage.store()
+            except Exception:
+                if job.is_new:
+                    rev_storage.revert()
+                else:
+                    rev_storage.revert(hash_id=previous_hash_id)
+                raise
+    except Exception, e:
+        job.exception = e
+        job.last_error = '%s: %s' % (e.__class__.__name__, e)
+        logger.error('Storage job %d for rev.id=%d failed (attempt %d of %d):'
+                     ' %s' % (job.pk, revision.pk, job.attempts, max_attempts,
+                              job.last_error))
+        if job.attempts < max_attempts and isinstance(e, TRANSIENT_ERRORS):
+            job.status = 'pending'
+            job.run_after = datetime.datetime.now() + datetime.timedelta(
+                seconds=settings.SPC['storage_job_retry_delay'] * job.attempts)
+            job.save()
+        else:
+            fail_job(job, notify=notify)
+        return False
+    finally:
+        if spooled_file is not None:
+            spooled_file.close()
+
+    # Only the hash is written: the revision may have been changed (e.g.
+    # validated) since the job was queued
+    revision.hash_id = hash_id
+    models.Revision.objects.filter(pk=revision.pk).update(hash_id=hash_id)
+    job.status = 'done'
+    job.last_error = ''
+    job.save()
+    remove_spooled_package(job)
+    logger.info('Storage job %d stored rev.id=%d as %s' % (job.pk, revision.pk,
+                                                           hash_id))
+
+    if revision.entry.sub_type == 'package':
+        # Downloads of the new revision are served from the archive cache
+        try:
+            fileset.cache_archive(hash_id)
+        except Exception, e:
+            logger.error('Could not cache the ZIP file of rev.id=%d: %s'
+                         % (revision.pk, e))
+
+    try:
+        email_after_submission(revision)
+    except Exception, e:
+        logger.error('Could not send emails for rev.id=%d: %s' % (revision.pk,
+                                                                  e))
+    return True
+
+def email_after_failure(revision, reason=''):
+    """
+    Tells the submitter of `revision` that it could not be stored (because
+    of `reason`, if given), and so was removed.
+    """
+    email_context = {
+        'user': revision.created_by,
+        'item': revision,
+        'reason': reason,
+        'site': Site.objects.get_current()
+    }
+    message = render_to_string('submission/email_storage_failed.txt',
+                               email_context)
+    send_email((revision.created_by.email,), ('Your contribution to SciPy '
+                                              'Central could not be saved'),
+               message=message)
+
+def fail_job(job, notify=True):
+    """
+    Marks `job` as failed, emails the submitter (if `notify` is True), and
+    deletes its revision (and, for a new submission, the submission and its
+    fileset).
+    """
+    job.status = 'failed'
+    job.save()
+    remove_spooled_package(job)
+
+    revision = job.revision
+    if notify:
+        reason = ''
+        # the CRC-32 of the files in a package is only checked as they are
+        # extracted to the repo, long after the form was validated
+        if isinstance(job.exception, zipfile.BadZipfile):
+            reason = 'The ZIP file was corrupted: %s' % job.exception
+        try:
+            email_after_failure(revision, reason)
+        except Exception, e:
+            logger.error('Could not send the failure email for rev.id=%d: %s'
+                         % (revision.pk, e))
+    if job.is_new:
+        submission = revision.entry
+        fileset = submission.fileset
+        revision.delete()
+        submission.delete()
+        if fileset is not None:
+            fileset.delete()
+    else:
+        revision.delete()
+    logger.error('Storage job %d failed for good: removed the revision'
+                 % job.pk)
@@ -0,0 +1,125 @@
+from django.core.management.base import NoArgsCommand
+from django.db import connection, transaction
+from optparse import make_option
+
+from scipy_central.submission import models
+
+import datetime
+import random
+import time
+
+# The query ``RevisionManager.most_recent()`` used to run: a correlated
+# subquery for every row of the revision table
+LEGACY_WHERE = ("submission_revision.id = "
+    "     (SELECT id FROM submission_revision AS __sr_2 "
+    "      WHERE (__sr_2.entry_id = submission_revision.entry_id "
+    "             AND __sr_2.is_displayed = {0}) "
+    "      ORDER BY __sr_2.date_created DESC LIMIT 1)")
+
+# SQLite allows at most this many parameters in a query: Django 1.4's
+# ``bulk_create`` does not split its INSERT into batches
+MAX_QUERY_PARAMS = 999
+
+
+class Command(NoArgsCommand):
+    help = ('Times RevisionManager.most_recent() against the correlated '
+            'subquery it replaced, on a synthetic dataset in a (temporary) '
+            'test database, and shows the query plans.')
+
+    option_list = NoArgsCommand.option_list + (
+        make_option('--revisions', type='int', dest='revisions',
+                    default=100000, help='Number of revisions to create'),
+        make_option('--per-submission', type='int', dest='per_submission',
+                    default=5, help='Average number of revisions per submission'),
+        make_option('--repeat', type='int', dest='repeat', default=3,
+                    help='Number of times each query is run'),
+    )
+
+    def handle_noargs(self, **options):
+        # Migrations create the indexes the queries rely on
+        from south.management.commands import patch_for_test_db_setup
+        patch_for_test_db_setup()
+        old_name = connection.settings_dict['NAME']
+        connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        try:
+            self.fill(options['revisions'], options['per_submission'])
+            self.compare(options['repeat'])
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+
+    def fill(self, num_revisions, per_submission):
+        """ Creates ``num_revisions`` revisions, most of them displayed. """
+        num_subs = max(num_revisions // per_submission, 1)
+        start = datetime.datetime(2011, 1, 1)
+        self.bulk_create(models.Submission,
+                         [models.Submission(sub_type='snippet')
+                          for n in xrange(num_subs)])
+        # ``date_created`` is set to the current time when a row is inserted
+        models.Submission.objects.update(date_created=start)
+        sub_ids = list(models.Submission.objects.values_list('pk', flat=True))
+
+        rev_index = dict((pk, 0) for pk in sub_ids)
+        revisions = []
+        for n in xrange(num_revisions):
+            entry_id = random.choice(sub_ids)
+            revisions.append(models.Revision(entry_id=entry_id,
+                    title='Revision %d' % n, slug='revision-%d' % n,
+                    description='', description_html='',
+                    rev_index=rev_index[entry_id],
+                    is_displayed=random.random() < 0.9))
+            rev_index[entry_id] += 1
+        self.bulk_create(models.Revision, revisions)
+
+        # A minute between revisions, in the order they were created
+        cursor = connection.cursor()
+        rev_ids = models.Revision.objects.absolutely_all().order_by('pk')\
+                                         .values_list('pk', flat=True)
+        cursor.executemany(
+            'UPDATE submission_revision SET date_created = %s WHERE id = %s',
+            [(start + datetime.timedelta(minutes=n), pk)
+             for n, pk in enumerate(rev_ids)])
+
+        # What Revision.save() maintains for revisions saved one at a time
+        cursor.execute(
+            'UPDATE submission_submission SET latest_displayed_revision_id = '
+            '  (SELECT id FROM submission_revision AS r '
+            '   WHERE r.entry_id = submission_submission.id '
+            '         AND r.is_displayed = %s '
+            '   ORDER BY r.date_created DESC, r.id DESC LIMIT 1)', [True])
+        transaction.commit_unless_managed()
+        self.stdout.write('Created %d revisions of %d submissions\n'
+                          % (num_revisions, num_subs))
+
+    def bulk_create(self, model, objs):
+        """ Inserts ``objs`` with as few queries as the database allows. """
+        batch_size = MAX_QUERY_PARAMS // len(model._meta.local_fields)
+        for idx in xrange(0, len(objs), batch_size):
+            model.objects.bulk_create(objs[idx:idx + batch_size])
+
+    def compare(self, repeat):
+        is_displayed = 1 if connection.vendor == 'sqlite' else 'true'
+        legacy = models.Revision.objects.extra(
+                                where=[LEGACY_WHERE.format(is_displayed)])
+        for name, qs in (('correlated subquery', legacy),
+                         ('most_recent()', models.Revision.objects.most_recent())):
+            timings = []
+            for n in xrange(repeat):
+                start = time.time()
+                count = qs.count()
+                page = list(qs.order_by('-date_created')[:20])
+                timings.append(time.time() - start)
+            self.stdout.write('\n%s: %d revisions, best of %d: %.3f s\n'
+                              % (name, count, repeat, min(timings)))
+            for row in self.explain(qs.order_by('-date_created')[:20]):
+                self.stdout.write('    %s\n' % (row,))
+
+    def explain(self, qs):
+        """ Returns the database's query plan for ``qs``. """
+        sql, params = qs.query.sql_with_params()
+        if connection.vendor == 'sqlite':
+            sql = 'EXPLAIN QUERY PLAN ' + sql
+        else:
+            sql = 'EXPLAIN ' + sql
+        cursor = connection.cursor()
+        cursor.execute(sql, params)
+        return cursor.fetchall()
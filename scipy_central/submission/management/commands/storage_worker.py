@@ -0,0 +1,45 @@
+from django.core.management.base import NoArgsCommand
+from django.db import connection, transaction
+from optparse import make_option
+
+from scipy_central.submission import jobs
+
+import time
+import logging
+
+logger = logging.getLogger('scipycentral')
+
+class Command(NoArgsCommand):
+    help = ('Stores queued submissions in their repos, and sends the emails '
+            'about them. Used when SPC["storage_async"] is set.')
+
+    option_list = NoArgsCommand.option_list + (
+        make_option('--once', action='store_true', dest='once', default=False,
+                    help='Run the jobs that are ready, then exit'),
+        make_option('--interval', type='float', dest='interval', default=2.0,
+                    help='Seconds to wait before checking for new jobs'),
+        make_option('--stale-after', type='int', dest='stale_after',
+                    default=3600,
+                    help=('Seconds after which jobs still marked as running '
+                          'are queued again')),
+    )
+
+    def handle_noargs(self, **options):
+        requeued = jobs.requeue_stale_jobs(options['stale_after'])
+        if requeued:
+            logger.warning('Storage worker: queued %d stale jobs again'
+                           % requeued)
+
+        while True:
+            count = jobs.run_pending_jobs()
+            # Ends the transaction the polling queries started: otherwise the
+            # next poll would not see the jobs queued in the mean time (with
+            # MySQL's REPEATABLE READ), or the database would be left waiting
+            # on an idle transaction
+            transaction.commit_unless_managed()
+            if count and int(options['verbosity']) > 0:
+                self.stdout.write('Ran %d storage job(s)\n' % count)
+            if options['once']:
+                break
+            connection.close()
+            time.sleep(options['interval'])
@@ -1,10 +1,14 @@
-from django.db import models, connection
+from django.db import models, connection, transaction, IntegrityError
+from django.db.models import signals
 from django.core.urlresolvers import reverse
 from django.template.defaultfilters import slugify
 
 from scipy_central.person.models import User
+from scipy_central.tagging.models import Tag
 from scipy_central.utils import rest_help_extra
 
+import datetime
+
 rest_help = ('Let the community know what your submission does, how it solves '
              'the problem, and/or how it works. ') + rest_help_extra
 
@@ -99,16 +103,26 @@ class Submission(models.Model):
     # For future use:
     inspired_by = models.ManyToManyField('self', null=True, blank=True)
 
-    @property
-    def last_revision(self):
-        try:
-            return self.revisions.order_by('-date_created')[0]
-        except (KeyError, IndexError):
-            return None
+    # The most recent revision, and the number of revisions: kept up to date
+    # as revisions are saved and deleted
+    latest_revision = models.ForeignKey('Revision', null=True, blank=True,
+                                        related_name='+', editable=False,
+                                        on_delete=models.SET_NULL)
+    num_revisions = models.PositiveIntegerField(default=0, editable=False)
+
+    # Is the most recent revision displayed?
+    is_displayed = models.BooleanField(default=False, db_index=True,
+                                       editable=False)
+
+    # The most recent revision that is displayed (if any)
+    latest_displayed_revision = models.ForeignKey('Revision', null=True,
+                                        blank=True, related_name='+',
+                                        editable=False,
+                                        on_delete=models.SET_NULL)
 
     @property
-    def num_revisions(self):
-        return self.revisions.count()
+    def last_revision(self):
+        return self.latest_revision
 
     @property
     def slug(self):
@@ -125,7 +139,8 @@ class Submission(models.Model):
         functions to create this URL: do it manually, to match ``urls.py``
         """
         return reverse('spc-view-item', args=[0]).rstrip('0') + \
-                '%d/%d/%s' % (self.pk, self.last_revision.rev_id+1, self.slug)
+                '%d/%d/%s' % (self.pk, self.last_revision.rev_index+1,
+                              self.slug)
 
 
 class RevisionManager(models.Manager):
@@ -157,14 +172,10 @@ class RevisionManager(models.Manager):
         return super(RevisionManager, self).all()
 
     def most_recent(self):
-        """Most recent revisions only"""
-        is_displayed = 1 if connection.vendor == 'sqlite' else 'true'
-        return self.extra(where=[
-            "submission_revision.id = "
-            "     (SELECT id FROM submission_revision AS __sr_2 "
-            "      WHERE (__sr_2.entry_id = submission_revision.entry_id "
-            "             AND __sr_2.is_displayed = {0}) "
-            "      ORDER BY __sr_2.date_created DESC LIMIT 1)".format(is_displayed)])  
+        """Most recent revisions only: the latest displayed revision of each
+        submission, looked up through the pointer kept on the submission"""
+        latest = Submission.objects.values('latest_displayed_revision')
+        return self.filter(pk__in=latest)
 
     def top_authors(self):
         """ From BSD licensed code:
@@ -174,6 +185,10 @@ class RevisionManager(models.Manager):
                                                .order_by('-score', 'username')
 
 
+# How many times saving a new revision is tried, if other revisions of the
+# same submission are being saved at the same time
+REV_INDEX_ATTEMPTS = 5
+
 class Revision(models.Model):
 
     objects = RevisionManager()
@@ -252,8 +267,16 @@ class Revision(models.Model):
     # users can only comment if set to True
     enable_comments = models.BooleanField(default=True)
 
+    # Position of this revision in the submission's history (0 for the
+    # first revision): set when the revision is created
+    rev_index = models.PositiveIntegerField(default=0, editable=False)
+
     class Meta:
         ordering = ['date_created']
+        unique_together = (('entry', 'rev_index'),)
+        # Migration 0009 also indexes (entry, is_displayed, date_created), to
+        # find a submission's latest displayed revision: Django 1.4 cannot
+        # declare such an index here
 
     def __unicode__(self):
         return self.title[0:50] + '::' + str(self.created_by.username)
@@ -263,87 +286,75 @@ class Revision(models.Model):
         """ Determines which revision of the submission this is, given the
         ``revision`` object.
         """
-        return list(self.entry.revisions.absolutely_all()).index(self)
+        return self.rev_index
 
     @property
     def rev_id_human(self):
-        return self.rev_id + 1
+        return self.rev_index + 1
 
     @property
     def previous_submission(self):
-        n = 1
-        sub = Submission.objects.all().filter(pk=self.entry.pk-n)
+        sub = Submission.objects.filter(pk__lt=self.entry_id,
+                                        is_displayed=True)\
+                                .select_related('latest_revision')\
+                                .order_by('-pk')[:1]
         if len(sub):
-            while sub[0].last_revision.is_displayed==False:
-                n += 1
-                sub = Submission.objects.all().filter(pk=self.entry.pk-n)
-                if len(sub):
-                    continue
-                else:
-                    return None
             return sub[0].get_absolute_url()
         else:
             return None
 
     @property
     def next_submission(self):
-        n = 1
-        sub = Submission.objects.all().filter(pk=self.entry.pk+n)
+        sub = Submission.objects.filter(pk__gt=self.entry_id,
+                                        is_displayed=True)\
+                                .select_related('latest_revision')\
+                                .order_by('pk')[:1]
         if len(sub):
-            while sub[0].last_revision.is_displayed==False:
-                n += 1
-                sub = Submission.objects.all().filter(pk=self.entry.pk+n)
-                if len(sub):
-                    continue
-                else:
-                    return None
             return sub[0].get_absolute_url()
         else:
             return None
 
-    @property
-    def previous_revision(self):
-        all_revs = list(self.entry.revisions.absolutely_all())
-        try:
-            if all_revs.index(self)-1 >= 0:
-                return all_revs[all_revs.index(self)-1]
-            else:
-                return None
-        except ValueError:
+    def _sibling_revision(self, rev_index):
+        """ Returns the revision of the same submission at ``rev_index``, or
+        None.
+        """
+        if self.pk is None or rev_index < 0:
             # Happens when previewing a submission before submitting it
             return None
+        try:
+            return Revision.objects.absolutely_all().get(
+                                                    entry=self.entry_id,
+                                                    rev_index=rev_index)
+        except Revision.DoesNotExist:
+            return None
+
+    @property
+    def previous_revision(self):
+        return self._sibling_revision(self.rev_index - 1)
 
     @property
     def next_revision(self):
-        all_revs = list(self.entry.revisions.absolutely_all())
-        try:
-            if all_revs.index(self)+1 >= len(all_revs):
-                return None
-            else:
-                return all_revs[all_revs.index(self)+1]
-        except ValueError:
-            # Happens when previewing a submission before submitting it
-            # (the template calls on self.next_revision)
+        if self.rev_index + 1 >= self.entry.num_revisions:
             return None
+        return self._sibling_revision(self.rev_index + 1)
+
     @property
     def human_revision_string(self):
         """ Returns the revision information in a helpful way
         """
-        try:
-            return 'Revision %d of %d' % (self.rev_id+1,
-                                         self.entry.num_revisions)
-        except ValueError:
-            # self.rev_id is not available when entering a new submission
+        if self.pk is None:
             return 'Revision information not available yet'
+        return 'Revision %d of %d' % (self.rev_index+1,
+                                      self.entry.num_revisions)
 
     @property
     def short_human_revision_string(self):
         """ Returns the revision information in a helpful way
         """
-        if self.rev_id == 0:
+        if self.rev_index == 0:
             return ''
         else:
-            return 'revision&nbsp;%d' % (self.rev_id+1)
+            return 'revision&nbsp;%d' % (self.rev_index+1)
 
     def save(self, *args, **kwargs):
         """ Override the model's saving function to create the slug """
@@ -351,8 +362,48 @@ class Revision(models.Model):
                                           #overriding-predefined-model-methods
         self.slug = slugify(self.title)
 
-        # Call the "real" save() method.
-        super(Revision, self).save(*args, **kwargs)
+        # New revisions go to the end of the submission's history
+        is_new = self.pk is None
+        if is_new:
+            for attempt in xrange(REV_INDEX_ATTEMPTS):
+                self.rev_index = Revision.objects.absolutely_all().filter(
+                                                   entry=self.entry_id).count()
+                sid = transaction.savepoint()
+                try:
+                    # Call the "real" save() method.
+                    super(Revision, self).save(*args, **kwargs)
+                    transaction.savepoint_commit(sid)
+                    break
+                except IntegrityError:
+                    # Another revision of the submission was saved in the
+                    # mean time, with the same ``rev_index``
+                    transaction.savepoint_rollback(sid)
+                    if not connection.features.uses_savepoints:
+                        # The failed INSERT may have broken the transaction:
+                        # it cannot be retried
+                        raise IntegrityError('Revision %d of submission %s '
+                            'was saved by another request at the same time '
+                            '(the database does not use savepoints, so '
+                            'saving is not retried)'
+                            % (self.rev_index + 1, self.entry_id))
+                    if attempt == REV_INDEX_ATTEMPTS - 1:
+                        raise
+        else:
+            # Call the "real" save() method.
+            super(Revision, self).save(*args, **kwargs)
+
+        if is_new or self.entry.latest_revision_id == self.pk:
+            Submission.objects.filter(pk=self.entry_id).update(
+                latest_revision=self, num_revisions=self.rev_index + 1,
+                is_displayed=self.is_displayed)
+            self.entry.latest_revision = self
+            self.entry.num_revisions = self.rev_index + 1
+            self.entry.is_displayed = self.is_displayed
+
+        # Revisions are displayed once validated, and may be hidden again
+        if self.is_displayed or \
+                self.entry.latest_displayed_revision_id == self.pk:
+            update_latest_displayed_revision(self.entry)
 
 
     def get_absolute_url(self):
@@ -360,13 +411,69 @@ class Revision(models.Model):
         functions to create this URL: do it manually, to match ``urls.py``
         """
         return reverse('spc-view-item', args=[0]).rstrip('0') + \
-                        '%d/%d/%s' % (self.entry.pk, self.rev_id+1, self.slug)
+                        '%d/%d/%s' % (self.entry_id, self.rev_index+1, self.slug)
+
+
+def update_latest_displayed_revision(submission):
+    """
+    Points ``submission`` at its most recent displayed revision.
+    """
+    latest = Revision.objects.filter(entry=submission.pk, is_displayed=True)\
+                             .order_by('-date_created', '-id')\
+                             .values_list('pk', flat=True)[:1]
+    submission.latest_displayed_revision_id = latest[0] if latest else None
+    Submission.objects.filter(pk=submission.pk).update(
+              latest_displayed_revision=submission.latest_displayed_revision_id)
+
+
+def revision_deleted(sender, instance, **kwargs):
+    """
+    Closes the gap a deleted revision leaves in its submission's history, and
+    updates the submission's latest (displayed) revision, whether it is
+    displayed, and its number of revisions.
+    """
+    revisions = Revision.objects.absolutely_all().filter(
+                                                    entry=instance.entry_id)
+    remaining = list(revisions.order_by('rev_index', 'date_created')
+                              .values_list('pk', 'rev_index', 'is_displayed'))
+    for rev_index, (pk, old_index, _) in enumerate(remaining):
+        if rev_index != old_index:
+            revisions.filter(pk=pk).update(rev_index=rev_index)
+    displayed = [pk for pk, _, is_displayed in remaining if is_displayed]
+    Submission.objects.filter(pk=instance.entry_id).update(
+        latest_revision=remaining[-1][0] if remaining else None,
+        is_displayed=remaining[-1][2] if remaining else False,
+        latest_displayed_revision=displayed[-1] if displayed else None,
+        num_revisions=len(remaining))
+
+signals.post_delete.connect(revision_deleted, sender=Revision)
+
+
+class TagCreationManager(models.Manager):
+    def add_tags(self, revision, tags, created_by):
+        """
+        Adds ``tags`` to ``revision`` with a single INSERT, and counts the
+        submission as a new use of the tags its other revisions do not have
+        (``bulk_create`` does not send the signals that recount tag uses).
+        """
+        if not tags:
+            return
+        tag_ids = set(tag.pk for tag in tags)
+        used = set(self.filter(revision__entry=revision.entry_id,
+                               tag__in=tag_ids)
+                       .values_list('tag', flat=True))
+        self.bulk_create([TagCreation(created_by=created_by,
+                                      revision=revision, tag=tag)
+                          for tag in tags])
+        Tag.objects.filter(pk__in=tag_ids - used).update(
+                            submission_count=models.F('submission_count') + 1)
 
 
 class TagCreation(models.Model):
     """
     Tracks by whom and when tags were created
     """
+    objects = TagCreationManager()
     created_by = models.ForeignKey(User)
     revision = models.ForeignKey(Revision)
     tag = models.ForeignKey('tagging.Tag')
@@ -374,3 +481,100 @@ class TagCreation(models.Model):
 
     def __unicode__(self):
         return self.tag.name
+
+
+def update_tag_counts(tag_ids):
+    """
+    Recounts the submissions that use each of the tags in ``tag_ids``. Call
+    it after adding or removing ``TagCreation`` objects without saving or
+    deleting them one at a time (``TagCreation.objects.add_tags`` keeps the
+    counts up to date itself).
+    """
+    for tag_id in set(tag_ids):
+        count = TagCreation.objects.filter(tag=tag_id)\
+                                   .values('revision__entry')\
+                                   .distinct().count()
+        Tag.objects.filter(pk=tag_id).update(submission_count=count)
+
+
+def tag_use_saving(sender, instance, **kwargs):
+    """
+    Remembers the tag and revision of a ``TagCreation`` that is saved again,
+    to tell in ``tag_use_saved`` whether they changed.
+    """
+    instance._saved_use = None
+    if instance.pk is not None:
+        saved = TagCreation.objects.filter(pk=instance.pk)\
+                                   .values_list('tag', 'revision')[:1]
+        if saved:
+            instance._saved_use = tuple(saved[0])
+
+
+def tag_use_saved(sender, instance, created, **kwargs):
+    """
+    Updates the number of submissions that use a tag, when the tag is added
+    to a revision, or a ``TagCreation`` is moved to another tag or revision.
+    """
+    saved_use = getattr(instance, '_saved_use', None)
+    if created:
+        update_tag_counts([instance.tag_id])
+    elif saved_use and saved_use != (instance.tag_id, instance.revision_id):
+        update_tag_counts([saved_use[0], instance.tag_id])
+
+
+def tag_use_deleted(sender, instance, **kwargs):
+    """
+    Updates the number of submissions that use a tag, when the tag is
+    removed from a revision.
+    """
+    update_tag_counts([instance.tag_id])
+
+signals.pre_save.connect(tag_use_saving, sender=TagCreation)
+signals.post_save.connect(tag_use_saved, sender=TagCreation)
+signals.post_delete.connect(tag_use_deleted, sender=TagCreation)
+
+
+class StorageJob(models.Model):
+    """
+    Stores a revision's files in the repo, then emails the submitter and the
+    site admin. Jobs are run by the ``storage_worker`` management command if
+    ``SPC['storage_async']`` is set, otherwise during the request.
+    """
+    STATUS = (
+        ('pending', 'Waiting to run'),
+        ('running', 'Running'),
+        ('done',    'Done'),
+        ('failed',  'Failed'),
+    )
+    # The revision (and its submission) to store: both are deleted if the
+    # job fails for good
+    revision = models.ForeignKey(Revision, null=True, blank=True,
+                                 related_name='storage_jobs',
+                                 on_delete=models.SET_NULL)
+    submission = models.ForeignKey(Submission, null=True, blank=True,
+                                   related_name='storage_jobs',
+                                   on_delete=models.SET_NULL)
+
+    # Is this the first revision of the submission?
+    is_new = models.BooleanField(default=False)
+
+    # Location of the uploaded ZIP file (for packages), spooled to disk
+    package_path = models.CharField(max_length=500, blank=True)
+
+    status = models.CharField(max_length=10, choices=STATUS,
+                              default='pending', db_index=True)
+    attempts = models.PositiveIntegerField(default=0)
+    last_error = models.TextField(blank=True)
+
+    # Failed attempts are retried, after a delay, from this time onwards
+    run_after = models.DateTimeField(default=datetime.datetime.now)
+
+    date_created = models.DateTimeField(auto_now_add=True, editable=False)
+    date_updated = models.DateTimeField(auto_now=True, editable=False)
+
+    class Meta:
+        ordering = ['pk']
+
+    def __unicode__(self):
+        return 'Storage of rev.id=%s [%s]' % (self.revision_id, self.status)
+
@@ -12,6 +12,7 @@ from scipy_central.submission import models
 # python imports
 import logging
 import zipfile
+import zlib
 import datetime
 import shutil
 import os
@@ -51,6 +52,42 @@ def copy_package_file(package_file, dst):
     destination.close()
 
 
+def get_member_path(name):
+    """
+    Returns the path, relative to the extraction directory and using '/'
+    as separator, that ``zipfile.ZipFile.extract`` writes the member `name`
+    to. Returns an empty string for members that are not extracted to a
+    path (e.g. '/' or '..').
+    """
+    if isinstance(name, unicode):
+        name = name.encode('utf-8')
+    parts = name.split('/')
+    return '/'.join(part for part in parts
+                    if part not in ('', os.path.curdir, os.path.pardir))
+
+def is_member_changed(fname, info):
+    """
+    Returns True if the file `fname` differs from the ZIP member `info`:
+    it does not exist, or its size or CRC-32 are different.
+    """
+    if not os.path.isfile(fname) or os.path.islink(fname):
+        return True
+    if os.path.getsize(fname) != info.file_size:
+        return True
+
+    crc = 0
+    f = open(fname, 'rb')
+    try:
+        while True:
+            data = f.read(64 * 1024)
+            if not data:
+                break
+            crc = zlib.crc32(data, crc)
+    finally:
+        f.close()
+    return (crc & 0xffffffff) != info.CRC
+
+
 class SubmissionStorage(object):
     """
     Class used to handle storage of submissions in file system.
@@ -66,18 +103,16 @@ class SubmissionStorage(object):
         If is_new is True, creates a new repository or else commit new
         changes in the exisiting repository.
         """
-        if self.is_new:
-            return self.__create_new_submission()
-        else: 
-            return self.__create_revision()
+        with self.object.entry.fileset.write_lock():
+            if self.is_new:
+                return self.__create_new_submission()
+            else: 
+                return self.__create_revision()
         
     def __create_revision(self):
         """
         Creates revision to an existing submission
         """
-        # get or create repo
-        repo = self.object.entry.fileset.get_repo()
-
         # commit revision
         if self.object.entry.sub_type == 'snippet':
             snippet_name = self.object.slug.replace('-', '_') + '.py'
@@ -92,29 +127,12 @@ class SubmissionStorage(object):
             if not hasattr(self.object, 'package_file'):
                 raise AttributeError('Uploaded file not passed to revision object')
 
-            repo_path = self.object.entry.fileset.repo_path
-            full_repo_path = os.path.join(settings.SPC['storage_dir'], repo_path)
-
-            # if not new - has an exisiting repo from previous revision
-            # delete all data except revision backend dir
-            revision_backend_dir = '.' + settings.SPC['revisioning_backend']
-            for path, dirs, files in os.walk(full_repo_path):
-                # ignore dir
-                if revision_backend_dir in dirs:
-                    dirs.remove(revision_backend_dir)
-                # remove files in path
-                for name in files:
-                    os.remove(os.path.join(path, name))
-                # remove dirs in path
-                for name in dirs:
-                    shutil.rmtree(os.path.join(path, name))
-            
-            # remove deleted files from repo
-            repo.remove(['--after'])
-
             commit_msg = 'Update files from web-uploaded ZIP file, DESCRIPTION.txt'
 
-            return self.__commit_package(self.object.package_file, commit_msg)
+            # only the files that differ from the previous revision are
+            # written to the repo
+            return self.__commit_package(self.object.package_file, commit_msg,
+                                         update=True)
             
         else:
             raise TypeError('Unknown submission type')
@@ -141,77 +159,92 @@ class SubmissionStorage(object):
         else:
             raise TypeError('Unknown submission type')
 
-    def __commit_package(self, package_file, commit_msg):
+    def __commit_package(self, package_file, commit_msg, update=False):
         """
         Adds files in `package_file` to the repository
 
-        1. The `package_file` object is copied to repo path
-        2. All files except repo dirs (.hg, .git, .svn etc) are extracted
-        3. DESCRIPTION.txt, LICENSE.txt files are added
-        4. Changes committed to repo
+        1. All files except repo dirs (.hg, .git, .svn etc) are extracted,
+           straight from the uploaded `package_file` (if `update` is True,
+           only the files that differ from the previous revision are
+           extracted, and files no longer in the package are removed)
+        2. DESCRIPTION.txt, LICENSE.txt files are added
+        3. All changes are written to the repo in a single commit
+
+        Each file is read (and its CRC-32 checked) only once, as it is
+        extracted: raises zipfile.BadZipfile if the check fails.
 
         raises DVCSError if new files contain no changes from the existing
         ones
         """
-        repo_path = self.object.entry.fileset.repo_path
+        fileset = self.object.entry.fileset
+        repo_path = fileset.repo_path
         full_repo_path = os.path.join(settings.SPC['storage_dir'], repo_path)
 
-        # copy package file to repo
-        dst = os.path.join(full_repo_path, package_file.name)
-        copy_package_file(package_file, dst)
-
-        # unzip package file
-        zip_obj = zipfile.ZipFile(dst, 'r')
-        for file_name in zip_obj.namelist():
-            # ignore revision backend dirs if present
-            # zipfile.ZipFile object ensures seperators are '/'
-            base_dir = file_name.split('/')[0]
-            if not base_dir in settings.SPC['common_rcs_dirs']:
-                zip_obj.extract(zip_obj.getinfo(file_name), full_repo_path)
-        zip_obj.close()
-
-        # delete zip file
-        os.remove(dst)
-
-        # commit package files
-        repo_obj = self.object.entry.fileset.get_repo()
-        for path, dirs, files in os.walk(full_repo_path):
-            # exclude revision backend dir
-            if os.path.split(path)[1] == '.' + settings.SPC['revisioning_backend']:
-                for entry in dirs[:]:
-                    dirs.remove(entry)
-                continue
-
-            all_files = []
-            for name in files:
-                all_files.append(os.path.join(path, name))
-
-            if all_files:
-                repo_obj.add(patterns=all_files, ignore_errors=True)
+        fileset.begin()
+        package_file.seek(0)
+        zip_obj = zipfile.ZipFile(package_file, 'r')
+        try:
+            self.__extract_package_files(zip_obj, fileset, full_repo_path,
+                                         update)
+        finally:
+            zip_obj.close()
 
-        # add `description.txt` file
-        description_name = os.path.join(full_repo_path, 'DESCRIPTION.txt')
-        description_file = file(description_name, 'wb')
-        description_file.write(self.object.description)
-        description_file.close()
+        # stage `description.txt` and license files
+        fileset.stage_bytes('DESCRIPTION.txt', self.object.description)
+        fileset.stage_bytes(settings.SPC['license_filename'],
+                            self.__get_license_text())
 
-        self.object.entry.fileset.add_file(description_name,
-                                           user=self.object.created_by.get_absolute_url(),
-                                           commit_msg=commit_msg)
-
-        # add license file
-        license_text = self.__get_license_text()
-        self.object.entry.fileset.add_file_from_string(settings.SPC['license_filename'],
-                                                       license_text, user='SciPy Central',
-                                                       commit_msg='SPC: add/update license file')
+        hash_id = fileset.commit(commit_msg,
+                                 user=self.object.created_by.get_absolute_url())
 
         # log info
         logger.info('SubmissionStorage:: Commit package to the repo: '
                     'Repo [dir=%s] Revision [pk=%d] User [pk=%d]' 
                     % (repo_path, self.object.pk, self.object.created_by.pk))
 
-        # hash id 
-        return self.object.entry.fileset.get_hash()
+        return hash_id
+
+    def __extract_package_files(self, zip_obj, fileset, full_repo_path,
+                                update):
+        """
+        Extracts and stages the files in `zip_obj`. If `update` is True, the
+        working copy is brought in line with the files in `zip_obj`: only
+        files that are new, or differ (in size or CRC-32) from the previous
+        revision, are extracted and staged, and files that are no longer in
+        the package are removed. Unchanged files are not touched.
+        """
+        # files written for every revision, from the revision's fields
+        generated = set(['DESCRIPTION.txt', settings.SPC['license_filename']])
+        tracked = set(fileset.list_files('.')) if update else set()
+
+        members = {}
+        for info in zip_obj.infolist():
+            path = get_member_path(info.filename)
+            # ignore directories and revision backend dirs if present
+            if not path or info.filename.endswith('/'):
+                continue
+            if path.split('/')[0] in settings.SPC['common_rcs_dirs']:
+                continue
+            members[path] = info
+
+        removed = sorted(tracked - set(members) - generated)
+        for path in removed:
+            fileset.stage_removal(path)
+
+        changed = 0
+        for path, info in sorted(members.items()):
+            fname = os.path.join(full_repo_path, *path.split('/'))
+            if path in tracked and not is_member_changed(fname, info):
+                continue
+            zip_obj.extract(info, full_repo_path)
+            fileset.stage_file(fname)
+            changed += 1
+
+        if update:
+            logger.info('SubmissionStorage:: Update package in the repo: '
+                        '%d of %d files changed, %d removed [dir=%s]'
+                        % (changed, len(members), len(removed),
+                           fileset.repo_path))
 
     def __commit_snippet(self, snippet_name, snippet_text, commit_msg):
         """
@@ -219,27 +252,23 @@ class SubmissionStorage(object):
 
         1. Create a file named `snippet_name` with `snippet_text` in it
         2. Add LICENSE.txt to the repo
-        3. Commit changes to the repo
+        3. Commit both files to the repo in a single commit
         """
-        self.object.entry.fileset.add_file_from_string(snippet_name, snippet_text,
-                                                       user=self.object.created_by.get_absolute_url(),
-                                                       commit_msg=commit_msg)
-
-        # commit license file
-        license_text = self.__get_license_text()
-        self.object.entry.fileset.add_file_from_string(settings.SPC['license_filename'],
-                                                       license_text, user='SciPy Central',
-                                                       commit_msg='SPC: add/update license file')
+        fileset = self.object.entry.fileset
+        fileset.begin()
+        fileset.stage_bytes(snippet_name, snippet_text)
+        fileset.stage_bytes(settings.SPC['license_filename'],
+                            self.__get_license_text())
+        hash_id = fileset.commit(commit_msg,
+                                 user=self.object.created_by.get_absolute_url())
 
-        
         # log info
         logger.info('SubmissionStorage:: Commit snippet to the repo: '
                     'Repo [dir=%s] Revision [pk=%d] User [pk=%d]' 
-                    % (self.object.entry.fileset.repo_path, self.object.pk, 
+                    % (fileset.repo_path, self.object.pk,
                        self.object.created_by.pk))
 
-        # hash id
-        return self.object.entry.fileset.get_hash()
+        return hash_id
 
     def __create_repo(self):
         """
@@ -264,11 +293,17 @@ class SubmissionStorage(object):
         `False` if not due to any errors.
         """
         fileset = self.object.entry.fileset
+        with fileset.write_lock():
+            return self.__revert(fileset, hash_id)
 
+    def __revert(self, fileset, hash_id):
         is_reverted = True
         if self.is_new:
             full_repo_path = os.path.join(settings.SPC['storage_dir'], fileset.repo_path)
 
+            # Drop the cached repo handle and any command server for the repo
+            fileset.forget_repo()
+
             # Delete repo path if exists
             if os.path.exists(full_repo_path):
                 try:
@@ -5,10 +5,9 @@ from django.db.models.query import QuerySet
 from django.db.models.fields import DateTimeField, DateField
 from django import template
 
-from scipy_central.pagehit.views import get_pagehits
+from scipy_central.pagehit.views import order_by_pagehits
 from scipy_central.submission.models import Revision, Submission
 from scipy_central.tagging.models import Tag
-from scipy_central.tagging.views import get_tag_uses
 
 from collections import namedtuple
 from math import log
@@ -37,28 +36,33 @@ def top_authors(field, num=5):
 @register.filter
 def most_viewed(field, num=5):
     """ Get the most viewed items from the Submission model """
-    top_items = get_pagehits(field)
-    top_items.sort(reverse=True)
+    top_items = order_by_pagehits(Submission.objects.filter(is_displayed=True)
+                                  .select_related('latest_revision__entry',
+                                                  'latest_revision__created_by'),
+                                  field)
     out = []
-    for score, pk in top_items[:num]:
-        try:
-            out.append(Submission.objects.get(pk=pk))
-            out[-1].score = score
-        except (Submission.DoesNotExist, IndexError):
-            pass
+    for item in top_items[:num]:
+        if item.pageviews:
+            item.score = item.pageviews
+            out.append(item)
     return out
 
+def most_used_tags(num):
+    """ The ``num`` tags (all of them if 0) used by the most submissions """
+    tags = Tag.objects.filter(submission_count__gt=0)\
+                      .order_by('-submission_count', '-id')
+    if num != 0:
+        tags = tags[:num]
+    return list(tags)
+
 @register.filter
 def cloud(model_or_obj, num=5):
     """ Get a tag cloud """
-    tag_uses = get_tag_uses()
-    if not(tag_uses):
+    tags = most_used_tags(num)
+    if not(tags):
         return []
-    tag_uses.sort(reverse=True)
-    if num != 0:
-        tag_uses = tag_uses[:num]
-    max_uses = max(tag_uses[0][0], 5)
-    min_uses = tag_uses[-1][0]
+    max_uses = max(tags[0].submission_count, 5)
+    min_uses = tags[-1].submission_count
     # Use a logarithmic scaling between 1.0 to 170% of baseline font size
     # We could consider a logarithmic scale
     min_font, max_font = 3, 6
@@ -67,8 +71,8 @@ def cloud(model_or_obj, num=5):
 
     out = []
     Item = namedtuple('Item', 'slug tag score')
-    for score, pk in tag_uses:
-        tag = Tag.objects.get(id=pk)
+    for tag in tags:
+        score = tag.submission_count
         out.append(Item(tag.slug, tag, int(log(slope*score + intercept)*100)-9))
 
     out.sort()
@@ -81,18 +85,10 @@ def top_tags(model_or_obj, num=10):
     cloud filer is quite similar to top_tags except
     logarithmic scaling. However, it has been left as it is for future use!
     """
-    tag_uses = get_tag_uses()
-    if not(tag_uses):
-        return []
-    tag_uses.sort(reverse=True)
-    if num != 0:
-        tag_uses = tag_uses[:num]
-
     out = []
     Item = namedtuple('Item', 'slug tag score')
-    for score, pk in tag_uses:
-        tag = Tag.objects.get(id=pk)
-        out.append(Item(tag.slug, tag, int(score)))
+    for tag in most_used_tags(num):
+        out.append(Item(tag.slug, tag, tag.submission_count))
 
     return out
 
@@ -115,9 +111,12 @@ def latest(model_or_obj, num=5):
         if isinstance(field, (DateTimeField, DateField)):
             field_name = field.name
             break
-    subs = manager.all().order_by('-%s' % field_name)
-    return [sub.last_revision for sub in subs \
-                                     if sub.last_revision.is_displayed][:num]
+    # only the first ``num`` submissions whose latest revision is displayed
+    subs = manager.filter(is_displayed=True)\
+                  .select_related('latest_revision__entry',
+                                  'latest_revision__created_by')\
+                  .order_by('-%s' % field_name)[:num]
+    return [sub.last_revision for sub in subs]
 
 @register.filter
 def call_manager(model_or_obj, method):
@@ -5,8 +5,31 @@ when you run "manage.py test".
 Replace this with more appropriate tests for your application.
 """
 
+from django.conf import settings
 from django.test import TestCase
+from django.test.client import RequestFactory
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core import mail
+from django.core.urlresolvers import reverse
+from django.db import connection, IntegrityError
+
+from scipy_central.filestorage import models as filestorage_models, locking, \
+                                      archive
+from scipy_central.pagehit.models import PageHitDaily
+from scipy_central.pagehit.views import order_by_pagehits
+from scipy_central.submission import models, jobs, storage
+from scipy_central.submission.templatetags.core_tags import most_viewed
+from scipy_central.utils import paginated_queryset
+
+import os
 import re
+import shutil
+import zipfile
+import datetime
+import tempfile
+from StringIO import StringIO
 
 class SimpleTest(TestCase):
     def test_url_matches(self):
@@ -33,3 +56,425 @@ class SimpleTest(TestCase):
             match = view_url.match(item[0]).groupdict()
             for key, val in match.iteritems():
                 self.assertEqual(val, item[1][key])
+
+
+class RevisionIndexTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('revs', 'revs@example.org', 'pw')
+        self.sub = models.Submission.objects.create(sub_type='snippet',
+                                                    created_by=self.user)
+
+    def new_revision(self, title):
+        rev = models.Revision(entry=self.sub, title=title,
+                              created_by=self.user, description='Test',
+                              item_code='print 1\n', is_displayed=True)
+        rev.save()
+        return rev
+
+    def test_revision_index(self):
+        """ Revisions are numbered, and the latest one tracked, as they are
+        saved and deleted. """
+        revs = [self.new_revision('Rev %d' % n) for n in range(3)]
+        sub = models.Submission.objects.get(pk=self.sub.pk)
+        self.assertEqual(sub.num_revisions, 3)
+        self.assertEqual(sub.last_revision, revs[2])
+        self.assertEqual([rev.rev_id for rev in revs], [0, 1, 2])
+        self.assertEqual(revs[1].human_revision_string, 'Revision 2 of 3')
+        self.assertEqual(revs[1].previous_revision, revs[0])
+        self.assertEqual(revs[1].next_revision, revs[2])
+        self.assertEqual(revs[2].next_revision, None)
+        self.assertTrue(sub.get_absolute_url().endswith('/%d/3/rev-2' %
+                                                        sub.pk))
+
+        revs[1].delete()
+        revs[2].delete()
+        sub = models.Submission.objects.get(pk=self.sub.pk)
+        self.assertEqual(sub.num_revisions, 1)
+        self.assertEqual(sub.last_revision, revs[0])
+        revs[1] = self.new_revision('Rev 3')
+        self.assertEqual(revs[1].rev_id, 1)
+        self.assertEqual(models.Submission.objects.get(pk=self.sub.pk)
+                                                  .last_revision, revs[1])
+
+    def test_concurrent_revisions(self):
+        """ A revision that counts the history before another revision is
+        saved retries with the next ``rev_index`` (if the database uses
+        savepoints). """
+        first = self.new_revision('Rev 0')
+        manager = models.Revision.objects
+        absolutely_all = manager.absolutely_all
+        def racing_absolutely_all():
+            del manager.absolutely_all
+            # Saved by another request after this one counted the history
+            other = models.Revision(entry=self.sub, title='Other',
+                                    created_by=self.user, description='Test',
+                                    item_code='print 2\n', rev_index=1)
+            manager.bulk_create([other])
+            return absolutely_all().exclude(title='Other')
+        manager.absolutely_all = racing_absolutely_all
+        try:
+            if not connection.features.uses_savepoints:
+                self.assertRaises(IntegrityError, self.new_revision, 'Rev 1')
+                return
+            second = self.new_revision('Rev 1')
+        finally:
+            manager.__dict__.pop('absolutely_all', None)
+        self.assertEqual([first.rev_id, second.rev_id], [0, 2])
+
+    def test_most_recent(self):
+        """ Only the latest displayed revision of a submission is listed. """
+        revs = [self.new_revision('Rev %d' % n) for n in range(3)]
+        revs[2].is_displayed = False
+        revs[2].save()
+        self.assertEqual(list(models.Revision.objects.most_recent()),
+                         [revs[1]])
+
+        revs[1].delete()
+        self.assertEqual(list(models.Revision.objects.most_recent()),
+                         [revs[0]])
+        revs[2].is_displayed = True
+        revs[2].save()
+        self.assertEqual(list(models.Revision.objects.most_recent()),
+                         [revs[2]])
+
+        # Revisions created at the same time are ordered by id, like in the
+        # migration that first set the latest displayed revisions
+        models.Revision.objects.filter(entry=self.sub).update(
+                                 date_created=revs[0].date_created)
+        models.update_latest_displayed_revision(self.sub)
+        self.assertEqual(list(models.Revision.objects.most_recent()),
+                         [revs[2]])
+
+    def test_submission_navigation(self):
+        """ Neighbouring submissions are found with a query each, skipping
+        those whose latest revision is not displayed. """
+        first = self.new_revision('First')
+        subs = [self.sub]
+        for n in range(3):
+            self.sub = models.Submission.objects.create(sub_type='snippet',
+                                                        created_by=self.user)
+            subs.append(self.sub)
+            last = self.new_revision('Sub %d' % n)
+        hidden = models.Revision(entry=subs[1], title='Hidden',
+                                 created_by=self.user, description='Test')
+        hidden.save()
+
+        with self.assertNumQueries(1):
+            self.assertEqual(last.previous_submission,
+                             subs[2].get_absolute_url())
+        self.assertEqual(subs[2].latest_revision.previous_submission,
+                         first.get_absolute_url())
+        self.assertEqual(first.next_submission, subs[2].get_absolute_url())
+        self.assertEqual(last.next_submission, None)
+
+    def test_paginated_listing(self):
+        """ Only the revisions on the requested page are fetched. """
+        for n in range(5):
+            self.new_revision('Rev %d' % n)
+        spc = settings.SPC.copy()
+        settings.SPC['entries_per_page'] = 2
+        try:
+            request = RequestFactory().get('/', {'page': '2'})
+            revs = models.Revision.objects.all().order_by('rev_index')
+            with self.assertNumQueries(2):
+                page = paginated_queryset(request, revs)
+                titles = [rev.title for rev in page.object_list]
+        finally:
+            settings.SPC.clear()
+            settings.SPC.update(spc)
+        self.assertEqual(titles, ['Rev 2', 'Rev 3'])
+        self.assertEqual(page.paginator.num_pages, 3)
+
+    def test_most_viewed(self):
+        """ Submissions are ranked by their views over the hit horizon, in
+        a single query. """
+        revs = [self.new_revision('Sub 0')]
+        for n in range(1, 3):
+            self.sub = models.Submission.objects.create(sub_type='snippet',
+                                                        created_by=self.user)
+            revs.append(self.new_revision('Sub %d' % n))
+        today = datetime.date.today()
+        old = today - datetime.timedelta(days=settings.SPC['hit_horizon'] + 1)
+        for rev, hits, day in ((revs[0], 2, today), (revs[1], 5, today),
+                               (revs[2], 10, old)):
+            PageHitDaily.objects.add_hits('submission', rev.entry_id, day,
+                                          hits)
+        cache.clear()
+
+        latest = models.Revision.objects.filter(pk__in=[rev.pk for rev in revs])
+        ranked = list(order_by_pagehits(latest, 'submission', 'entry'))
+        self.assertEqual(ranked, [revs[1], revs[0], revs[2]])
+        self.assertEqual([rev.pageviews for rev in ranked], [5, 2, 0])
+        with self.assertNumQueries(1):
+            list(order_by_pagehits(latest, 'submission', 'entry'))
+        self.assertEqual([(sub.latest_revision, sub.score)
+                          for sub in most_viewed('submission', 5)],
+                         [(revs[1], 5), (revs[0], 2)])
+
+    def test_unsaved_revision(self):
+        """ Previews of unsaved revisions have no revision information. """
+        self.new_revision('Rev 0')
+        rev = models.Revision(entry=self.sub, title='Preview')
+        self.assertEqual(rev.previous_revision, None)
+        self.assertEqual(rev.human_revision_string,
+                         'Revision information not available yet')
+
+
+class StorageTestCase(TestCase):
+    """ Stores submissions in a temporary directory. """
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.spc = settings.SPC.copy()
+        settings.SPC.update({'storage_dir': self.tempdir,
+                             'storage_spool_dir': os.path.join(self.tempdir,
+                                                               'spool'),
+                             'storage_async': True,
+                             'storage_job_max_attempts': 2,
+                             'storage_job_retry_delay': 0})
+        self.storage_dir = filestorage_models.storage_dir
+        filestorage_models.storage_dir = self.tempdir
+        self.lock_dir = locking.lock_dir
+        locking.lock_dir = os.path.join(self.tempdir, 'locks')
+        self.archive_cache = filestorage_models.archive_cache
+        filestorage_models.archive_cache = archive.ArchiveCache(
+                                  os.path.join(self.tempdir, 'cache'), 10**6)
+        self.server_email = settings.SERVER_EMAIL
+        settings.SERVER_EMAIL = 'spc@example.org'
+        self.user = User.objects.create_user('jobs', 'jobs@example.org', 'pw')
+        self.license = models.License.objects.create(name='CC0', slug='cc0',
+                                      description='CC0', text_template='CC0')
+
+    def tearDown(self):
+        settings.SPC.clear()
+        settings.SPC.update(self.spc)
+        filestorage_models.storage_dir = self.storage_dir
+        locking.lock_dir = self.lock_dir
+        filestorage_models.archive_cache = self.archive_cache
+        settings.SERVER_EMAIL = self.server_email
+        shutil.rmtree(self.tempdir)
+
+    def new_snippet(self, sub_license=True, sub_type='snippet'):
+        fileset = filestorage_models.FileSet(repo_path='2011/01/%06d'
+                            % (models.Submission.objects.count() + 1))
+        fileset.save()
+        sub = models.Submission(sub_type=sub_type, created_by=self.user,
+                                fileset=fileset)
+        sub.save()
+        rev = models.Revision(entry=sub, title='Job test',
+                              created_by=self.user, description='Test',
+                              item_code='print 1\n',
+                              sub_license=self.license if sub_license else None)
+        rev.save()
+        return rev
+
+
+class StorageJobTest(StorageTestCase):
+    def test_worker_stores_revision(self):
+        """ Queued revisions are stored, in order, by the worker. """
+        rev = self.new_snippet()
+        job = jobs.queue_storage(rev, is_new=True)
+        self.assertEqual(job.status, 'pending')
+        self.assertEqual(models.Revision.objects.absolutely_all()
+                                     .get(pk=rev.pk).hash_id, None)
+
+        rev_2 = models.Revision(entry=rev.entry, title='Job test',
+                                created_by=self.user, description='Test',
+                                item_code='print 2\n',
+                                sub_license=rev.sub_license)
+        rev_2.save()
+        job_2 = jobs.queue_storage(rev_2, is_new=False)
+
+        # The edit waits for the new submission to be stored
+        self.assertEqual(jobs.claim_next_job().pk, job.pk)
+        self.assertEqual(jobs.claim_next_job(), None)
+        self.assertTrue(jobs.run_job(models.StorageJob.objects.get(pk=job.pk)))
+        self.assertEqual(jobs.run_pending_jobs(), 1)
+
+        job_2 = models.StorageJob.objects.get(pk=job_2.pk)
+        self.assertEqual(job_2.status, 'done')
+        self.assertEqual(job_2.attempts, 1)
+        hash_id = models.Revision.objects.absolutely_all().get(
+                                                        pk=rev_2.pk).hash_id
+        self.assertEqual(hash_id, rev.entry.fileset.get_hash())
+
+    def test_failed_job(self):
+        """ Failed jobs remove their submission, and tell the submitter. """
+        rev = self.new_snippet(sub_license=False)
+        job = jobs.queue_storage(rev, is_new=True)
+        repo_dir = os.path.join(self.tempdir, rev.entry.fileset.repo_path)
+
+        # Retrying would not help
+        self.assertEqual(jobs.run_pending_jobs(), 1)
+        job = models.StorageJob.objects.get(pk=job.pk)
+        self.assertEqual((job.status, job.attempts), ('failed', 1))
+        self.assertTrue(job.last_error.startswith('AttributeError'))
+        self.assertEqual(job.revision, None)
+        self.assertEqual(models.Submission.objects.count(), 0)
+        self.assertFalse(os.path.exists(repo_dir))
+        self.assertEqual(jobs.run_pending_jobs(), 0)
+
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertEqual(mail.outbox[0].to, [self.user.email])
+        self.assertTrue('"Job test"' in mail.outbox[0].body)
+
+    def test_retried_job(self):
+        """ Jobs that failed for a passing reason are retried. """
+        rev = self.new_snippet()
+        job = jobs.queue_storage(rev, is_new=True)
+
+        def disk_full(*args, **kwargs):
+            raise IOError(28, 'No space left on device')
+        store = storage.SubmissionStorage.store
+        storage.SubmissionStorage.store = disk_full
+        try:
+            self.assertEqual(jobs.run_pending_jobs(), 1)
+        finally:
+            storage.SubmissionStorage.store = store
+        job = models.StorageJob.objects.get(pk=job.pk)
+        self.assertEqual((job.status, job.attempts), ('pending', 1))
+        self.assertEqual(len(mail.outbox), 0)
+
+        self.assertEqual(jobs.run_pending_jobs(), 1)
+        job = models.StorageJob.objects.get(pk=job.pk)
+        self.assertEqual((job.status, job.attempts), ('done', 2))
+
+
+class DownloadTest(StorageTestCase):
+    def download(self, rev, if_none_match=None):
+        url = reverse('spc-download-submission', args=(rev.entry.pk,
+                                                       rev.rev_id_human))
+        if if_none_match is None:
+            return self.client.get(url)
+        return self.client.get(url, HTTP_IF_NONE_MATCH=if_none_match)
+
+    def test_snippet_etag(self):
+        """ Snippets are only 'not modified' if their file is unchanged. """
+        settings.SPC['storage_async'] = False
+        rev = self.new_snippet()
+        rev.is_displayed = True
+        rev.save()
+        jobs.queue_storage(rev, is_new=True)
+        rev = models.Revision.objects.get(pk=rev.pk)
+
+        response = self.download(rev)
+        self.assertEqual(response.status_code, 200)
+        etag = response['ETag']
+        self.assertNotEqual(etag, '"%s"' % rev.hash_id)
+
+        self.assertEqual(self.download(rev, etag).status_code, 304)
+        self.assertEqual(self.download(rev, 'W/%s, "x"' % etag).status_code,
+                         304)
+        self.assertEqual(self.download(rev, '*').status_code, 304)
+        # Not a prefix of the ETag
+        self.assertEqual(self.download(rev, etag[:-5] + '"').status_code, 200)
+
+        # The file has the submission's URL, which changes with a new revision
+        rev_2 = models.Revision(entry=rev.entry, title='Job test 2',
+                                created_by=self.user, description='Test',
+                                item_code=rev.item_code, is_displayed=True,
+                                sub_license=rev.sub_license)
+        rev_2.save()
+        self.assertEqual(self.download(rev, etag).status_code, 200)
+
+
+class PackageStorageTest(StorageTestCase):
+    def zip_file(self, files):
+        buf = StringIO()
+        zip_obj = zipfile.ZipFile(buf, 'w', zipfile.ZIP_DEFLATED)
+        for name, data in files:
+            zip_obj.writestr(name, data)
+        zip_obj.close()
+        return SimpleUploadedFile('package.zip', buf.getvalue())
+
+    def test_package_update(self):
+        """ Package updates only write the files that changed. """
+        rev = self.new_snippet(sub_type='package')
+        rev.package_file = self.zip_file([('README', 'Read me\n'),
+                                          ('pkg/__init__.py', ''),
+                                          ('pkg/mod.py', 'x = 1\n'),
+                                          ('old/gone.py', 'y = 1\n'),
+                                          ('.hg/hgrc', '[ui]\n')])
+        storage.SubmissionStorage(rev, is_new=True).store()
+        fileset = rev.entry.fileset
+        repo_dir = os.path.join(self.tempdir, fileset.repo_path)
+        readme = os.path.join(repo_dir, 'README')
+        os.utime(readme, (0, 0))
+
+        rev_2 = models.Revision(entry=rev.entry, title='Job test',
+                                created_by=self.user, description='Test 2',
+                                sub_license=self.license)
+        rev_2.save()
+        rev_2.package_file = self.zip_file([('README', 'Read me\n'),
+                                            ('pkg/__init__.py', ''),
+                                            ('pkg/mod.py', 'x = 2\n'),
+                                            ('./new.py', 'z = 1\n')])
+        hash_id = storage.SubmissionStorage(rev_2, is_new=False).store()
+
+        self.assertEqual(fileset.list_files(hash_id),
+                         ['DESCRIPTION.txt', 'LICENSE.TXT', 'README',
+                          'new.py', 'pkg/__init__.py', 'pkg/mod.py'])
+        self.assertEqual(fileset.open_file(hash_id, 'pkg/mod.py').read(),
+                         'x = 2\n')
+        self.assertEqual(fileset.open_file(hash_id, 'DESCRIPTION.txt')
+                                                           .read(), 'Test 2')
+        # Unchanged files are left alone, and removed directories pruned
+        self.assertEqual(os.path.getmtime(readme), 0)
+        self.assertFalse(os.path.exists(os.path.join(repo_dir, 'old')))
+        self.assertEqual(fileset.get_repo().run_dvcs_command(['summary'])
+                         .count('commit: (clean)'), 1)
+
+    def test_package_cached(self):
+        """ The ZIP file of a stored package is cached for downloads. """
+        rev = self.new_snippet(sub_type='package')
+        package_file = self.zip_file([('README', 'Read me\n')])
+        job = jobs.queue_storage(rev, is_new=True, package_file=package_file)
+        self.assertEqual(jobs.run_pending_jobs(), 1)
+        rev = models.Revision.objects.absolutely_all().get(pk=rev.pk)
+        cached = rev.entry.fileset.cached_archive(rev.hash_id)
+        self.assertNotEqual(cached, None)
+        self.assertEqual(zipfile.ZipFile(cached).read('README'), 'Read me\n')
+
+    def test_package_corrupt(self):
+        """ A package that fails its CRC check is rejected when stored. """
+        rev = self.new_snippet(sub_type='package')
+        buf = StringIO()
+        zip_obj = zipfile.ZipFile(buf, 'w', zipfile.ZIP_STORED)
+        zip_obj.writestr('README', 'Read me\n')
+        zip_obj.close()
+        rev.package_file = SimpleUploadedFile('package.zip',
+                               buf.getvalue().replace('Read me', 'Read us'))
+        settings.SPC['storage_async'] = False
+        job = jobs.queue_storage(rev, is_new=True,
+                                 package_file=rev.package_file)
+
+        self.assertEqual(job.status, 'failed')
+        self.assertTrue(isinstance(job.exception, zipfile.BadZipfile))
+        self.assertFalse(models.Submission.objects.filter(
+                                                   pk=rev.entry_id).exists())
+        self.assertEqual(len(mail.outbox), 0)
+
+    def test_package_corrupt_async(self):
+        """ The submitter of a corrupt package is told by the worker. """
+        rev = self.new_snippet(sub_type='package')
+        buf = StringIO()
+        zip_obj = zipfile.ZipFile(buf, 'w', zipfile.ZIP_STORED)
+        zip_obj.writestr('README', 'Read me\n')
+        zip_obj.close()
+        package_file = SimpleUploadedFile('package.zip',
+                               buf.getvalue().replace('Read me', 'Read us'))
+        job = jobs.queue_storage(rev, is_new=True, package_file=package_file)
+        self.assertEqual(job.status, 'pending')
+        self.assertTrue(os.path.exists(job.package_path))
+
+        # Not retried
+        self.assertEqual(jobs.run_pending_jobs(), 1)
+        job = models.StorageJob.objects.get(pk=job.pk)
+        self.assertEqual((job.status, job.attempts), ('failed', 1))
+        self.assertTrue(job.last_error.startswith('BadZipfile'))
+        self.assertFalse(os.path.exists(job.package_path))
+        self.assertFalse(models.Submission.objects.filter(
+                                                   pk=rev.entry_id).exists())
+
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertEqual(mail.outbox[0].to, [self.user.email])
+        self.assertTrue('The ZIP file was corrupted' in mail.outbox[0].body)
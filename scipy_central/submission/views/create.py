@@ -2,10 +2,8 @@
 from django.conf import settings
 from django.http import Http404, HttpResponse
 from django.template import RequestContext
-from django.template.loader import render_to_string
 from django.utils.decorators import method_decorator
 from django.contrib.auth.decorators import login_required
-from django.contrib.sites.models import Site
 from django.forms.models import model_to_dict
 from django.views.generic.edit import FormView
 from django.views.decorators.csrf import csrf_protect
@@ -14,56 +12,17 @@ from django.shortcuts import get_object_or_404, render_to_response
 # scipy central imports
 from scipy_central.tagging.views import get_and_create_tags
 from scipy_central.filestorage.models import FileSet
-from scipy_central.utils import send_email
+from scipy_central.filestorage.locking import LockTimeout
 from scipy_central.submission import forms, models, storage
+from scipy_central.submission.jobs import queue_storage, email_after_submission
 
 # python imports
 import logging
+import zipfile
 
 logger = logging.getLogger('scipycentral')
 logger.debug('Initializing submission::views.create.py')
 
-def email_after_submission(instance):
-    """
-    Send email notifications to created user and admin
-    for new/ edited submissions
-    """
-    if not isinstance(instance, models.Revision):
-        raise TypeError('Revision object should be passed as argument')
-
-    email_context = {
-        'user': instance.created_by,
-        'item': instance,
-        'site': Site.objects.get_current()
-    }
-
-    # signed in users
-    if instance.is_displayed:
-        message = render_to_string('submission/email_user_thanks.txt',
-                                   email_context)
-    else:
-        # if user registered but not signed in
-        if instance.created_by.profile.is_validated:
-            message = render_to_string(
-                'submission/email_validated_user_unvalidated_submission.txt',
-                email_context)
-
-        # unknown users
-        else:
-            message = render_to_string(
-                'submission/email_unvalidated_user_unvalidated_submission.txt',
-                email_context)
-
-    # email submitted user
-    send_email((instance.created_by.email,), ('Thank you for your contribution to '
-                                              'SciPy Central'), message=message)
-
-    # email admin
-    message = render_to_string('submission/email_website_admin.txt')
-    send_email((settings.SERVER_EMAIL,), ('A new/edited submission '
-                                          'was made on SciPy Central'),
-               message=message)
-
 class BaseSubmission(FormView):
     """
     Base class for views creating/ editing submission
@@ -105,8 +64,7 @@ class NewSubmission(BaseSubmission):
         # save revison object
         instance.save()
 
-        # store data in repository
-        # create FileSet object
+        # create FileSet object, for submissions stored in a repository
         if sub_obj.sub_type == 'snippet' or sub_obj.sub_type == 'package':
             fileset_obj = FileSet(repo_path=storage.get_repo_path(instance))
             fileset_obj.save()
@@ -114,31 +72,11 @@ class NewSubmission(BaseSubmission):
             sub_obj.fileset = fileset_obj
             sub_obj.save()
 
-            # store obj in repo
-            rev_storage = storage.SubmissionStorage(instance, is_new=True)
-            try:
-                hash_id = rev_storage.store()
-            except Exception, e:
-                logger.error('SERVER ERROR: Submission storage error:: %s' % e)
-                instance.delete()
-                sub_obj.delete()
-                fileset_obj.delete()
-                rev_storage.revert()
-                if sub_obj.sub_type == 'package':
-                    instance.package_file.close()
-                return HttpResponse(status=500)
-
-            instance.hash_id = hash_id
-            if sub_obj.sub_type == 'package':
-                instance.package_file.close()
-
         # add tags
         tags_list = get_and_create_tags(form.cleaned_data['sub_tags'])
+        models.TagCreation.objects.add_tags(instance, tags_list,
+                                            instance.created_by)
         for tag in tags_list:
-            tag_intermediate = models.TagCreation(created_by=instance.created_by, 
-                                                  revision=instance, tag=tag)
-            tag_intermediate.save()
-
             # log the database action
             logger.info('User "%s" added tag "%s" to rev.id="%d"' 
                          % (instance.created_by.username, str(tag), instance.pk))
@@ -146,12 +84,31 @@ class NewSubmission(BaseSubmission):
         # save revision object
         instance.save()
 
+        # store obj in repo, then send the emails: now, or in the worker
+        if sub_obj.sub_type == 'snippet' or sub_obj.sub_type == 'package':
+            job = queue_storage(instance, is_new=True,
+                                package_file=getattr(instance, 'package_file',
+                                                     None))
+            if sub_obj.sub_type == 'package':
+                instance.package_file.close()
+            if job.status == 'failed':
+                # the CRC-32 of the files in a package is only checked as they
+                # are extracted to the repo
+                if isinstance(job.exception, zipfile.BadZipfile):
+                    form._errors['package_file'] = form.error_class([
+                        'Upload a valid ZIP file. It was corrupted: %s'
+                        % job.exception])
+                    return self.form_invalid(form)
+                return HttpResponse(status=503 if isinstance(job.exception,
+                                                             LockTimeout)
+                                    else 500)
+        else:
+            email_after_submission(instance)
+
         # log the new submission 
         logger.info('New %s: %s [id=%d] and revision id=%d' 
                      % (sub_obj.sub_type, instance.title, sub_obj.pk, instance.pk))
 
-        email_after_submission(instance)
-
         context = {
             'authenticated': self.request.user.is_authenticated(),
             'days_deleted_after': settings.SPC['unvalidated_subs_deleted_after'],
@@ -201,30 +158,11 @@ class EditSubmission(BaseSubmission):
         if self.sub_obj.sub_type == 'package':
             instance.package_file = form.cleaned_data['package_file']
 
-        # store data in repository
-        if self.sub_obj.sub_type == 'snippet' or self.sub_obj.sub_type == 'package':
-            rev_storage = storage.SubmissionStorage(instance, is_new=False)
-            try:
-                hash_id = rev_storage.store()
-            except Exception, e:
-                logger.error('Submission Storage Error: %s' % e)
-                instance.delete()
-                rev_storage.revert(hash_id=self.rev_obj.hash_id)
-                if self.sub_obj.sub_type == 'package':
-                    instance.package_file.close()
-                return HttpResponse(status=500)
-
-            instance.hash_id = hash_id
-            if self.sub_obj.sub_type == 'package':
-                instance.package_file.close()
-
         # add tags
         tags_list = get_and_create_tags(form.cleaned_data['sub_tags'])
+        models.TagCreation.objects.add_tags(instance, tags_list,
+                                            instance.created_by)
         for tag in tags_list:
-            tag_intermediate = models.TagCreation(created_by=instance.created_by, 
-                                                  revision=instance, tag=tag)
-            tag_intermediate.save()
-
             # log the database action
             logger.info('User "%s" added tag "%s" to rev.id="%d"' 
                          % (instance.created_by.username, str(tag), instance.pk))
@@ -232,12 +170,31 @@ class EditSubmission(BaseSubmission):
         # save revision object
         instance.save()
 
+        # store obj in repo, then send the emails: now, or in the worker
+        if self.sub_obj.sub_type == 'snippet' or self.sub_obj.sub_type == 'package':
+            job = queue_storage(instance, is_new=False,
+                                package_file=getattr(instance, 'package_file',
+                                                     None))
+            if self.sub_obj.sub_type == 'package':
+                instance.package_file.close()
+            if job.status == 'failed':
+                # the CRC-32 of the files in a package is only checked as they
+                # are extracted to the repo
+                if isinstance(job.exception, zipfile.BadZipfile):
+                    form._errors['package_file'] = form.error_class([
+                        'Upload a valid ZIP file. It was corrupted: %s'
+                        % job.exception])
+                    return self.form_invalid(form)
+                return HttpResponse(status=503 if isinstance(job.exception,
+                                                             LockTimeout)
+                                    else 500)
+        else:
+            email_after_submission(instance)
+
         # log the new submission 
         logger.info('New %s: %s [id=%d] and revision id=%d' 
                      % (self.sub_obj.sub_type, instance.title, self.sub_obj.pk, instance.pk))
 
-        email_after_submission(instance)
-
         context = {
             'authenticated': self.request.user.is_authenticated(),
             'days_deleted_after': settings.SPC['unvalidated_subs_deleted_after'],
@@ -1,30 +1,30 @@
 # django imports
 from django.conf import settings
 from django.shortcuts import render_to_response, redirect, HttpResponse
+from django.http import HttpResponseNotModified
+from django.core.servers.basehttp import FileWrapper
 from django.template import RequestContext
 from django.template.defaultfilters import slugify
 from django.contrib.sites.models import Site
 from django.contrib.auth.decorators import login_required
 from django.core.exceptions import ObjectDoesNotExist
+from django.utils.http import parse_etags, quote_etag
 
 # SciPy Central imports
 from scipy_central.utils import paginated_queryset, ensuredir
 from scipy_central.pages.views import page_404_error
-from scipy_central.pagehit.views import create_hit, get_pagehits
+from scipy_central.filestorage.dvcs_wrapper import DVCSError
+from scipy_central.pagehit.views import create_hit, get_pagehits, \
+                                        order_by_pagehits
 from scipy_central.submission.templatetags.core_tags import top_authors
 from scipy_central.submission import models
 
 # Python imports
 import logging
+import hashlib
 import re
 import os
 import datetime
-import zipfile
-
-try:
-    from cStringIO import StringIO
-except ImportError:
-    from StringIO import StringIO
 
 
 logger = logging.getLogger('scipycentral')
@@ -144,10 +144,9 @@ def view_item(request, submission, revision):
                         item_pk=submission.id)
 
     package_files = []
-    if submission.sub_type == 'package':
-        # Update the repo to the version required
-        submission.fileset.checkout_revision(revision.hash_id)
-        package_files = submission.fileset.list_iterator()
+    if submission.sub_type == 'package' and revision.hash_id:
+        # List the files in the required revision, straight from the repo
+        package_files = submission.fileset.list_iterator(revision.hash_id)
 
 
     return render_to_response('submission/item.html', {},
@@ -162,104 +161,93 @@ def view_item(request, submission, revision):
                                 }))
 
 
+def etag_matches(request, etag):
+    """
+    Returns True if ``etag`` (unquoted) is one of the entity tags in the
+    request's If-None-Match header, or if that header is ``*``.
+    """
+    if_none_match = request.META.get('HTTP_IF_NONE_MATCH')
+    if not etag or not if_none_match:
+        return False
+    etags = parse_etags(if_none_match)
+    return '*' in etags or etag in etags
+
+def not_modified(etag):
+    response = HttpResponseNotModified()
+    response['ETag'] = quote_etag(etag)
+    return response
+
 @get_items_or_404
 def download_submission(request, submission, revision):
 
     create_hit(request, submission, extra_info="download")
+
+    # Revisions never change once stored: their hash is a strong ETag
+    etag = revision.hash_id
+
     if submission.sub_type == 'snippet':
+        source = Site.objects.get_current().domain + \
+                                                 submission.get_absolute_url()
+        content = ('# Source: ' + source + '\n\n' + revision.item_code)\
+                                                          .encode('utf-8')
+        # The submission's URL, in the file, changes when a revision is added
+        if etag:
+            etag = hashlib.sha1(etag + content).hexdigest()
+        if etag_matches(request, etag):
+            return not_modified(etag)
+
         response = HttpResponse(mimetype="application/x-python")
         fname = submission.slug.replace('-', '_') + '.py'
         response["Content-Disposition"] = "attachment; filename=%s" % fname
-        source = Site.objects.get_current().domain + \
-                                                 submission.get_absolute_url()
-        response.write('# Source: ' + source + '\n\n' + revision.item_code)
+        response.write(content)
+        if etag:
+            response['ETag'] = quote_etag(etag)
         return response
 
+    if etag_matches(request, etag):
+        return not_modified(etag)
+
     if submission.sub_type == 'package':
-        # Checkout the repo to the revision version
-        checkout = submission.fileset.checkout_revision(revision.hash_id)
-        if not checkout:
-            logger.error('Could not checkout revision %s for rev.id %d' 
-                         % (revision.hash_id, revision.pk))
-            return page_404_error('Could not create ZIP file. This error has '
-                                  'been reported')
-        logger.info('Checkout revision %s for rev.id %d' % (revision.hash_id, revision.pk))
-
-        package_data = StringIO()
-        zipf = zipfile.ZipFile(package_data, 'w', zipfile.ZIP_DEFLATED)
-
-        full_repo_path = os.path.abspath(os.path.join(settings.SPC['storage_dir'],
-                                                      submission.fileset.repo_path))
-        for path, dirs, files in os.walk(full_repo_path):
-            # ignore revision backend dir
-            if os.path.split(path)[1] == '.' + settings.SPC['revisioning_backend']:
-                for entry in dirs[:]:
-                    dirs.remove(entry)
-                continue
-
-            for name in files:
-                full_name = os.path.abspath(os.path.join(path, name))
-                zipf.write(full_name, full_name.partition(full_repo_path)[2])
-
-        for name in zipf.filelist:
-            name.create_system = 0
-
-        zipf.close()
-
-        package_data.seek(0)
-
-        response = HttpResponse(mimetype='attachment; application/zip')
+        if not revision.hash_id:
+            return page_404_error(request, 'The files of this submission are '
+                                  'still being stored. Please try again in '
+                                  'a few minutes.')
+
+        fileset = submission.fileset
+        cached = fileset.cached_archive(revision.hash_id)
+        sendfile_header = settings.SPC.get('archive_sendfile_header', '')
+        if cached and sendfile_header:
+            # The web server sends the cached ZIP file
+            response = HttpResponse(mimetype='attachment; application/zip')
+            response[sendfile_header] = cached
+        elif cached:
+            response = HttpResponse(FileWrapper(open(cached, 'rb')),
+                                    mimetype='attachment; application/zip')
+            response['Content-Length'] = os.path.getsize(cached)
+        else:
+            # Read the files in the revision straight from the repo: the
+            # working copy is never checked out to serve a download
+            try:
+                package_data = fileset.iter_archive(revision.hash_id)
+            except DVCSError as e:
+                logger.error('Could not read revision %s for rev.id %d: %s'
+                             % (revision.hash_id, revision.pk, e))
+                return page_404_error(request, 'Could not create ZIP file. '
+                                               'This error has been reported')
+
+            # The ZIP file is created, a chunk at a time, as it is being sent
+            # (and written to the archive cache)
+            response = HttpResponse(package_data,
+                                    mimetype='attachment; application/zip')
+
         response['Content-Disposition'] = 'filename=%s-%d-%d.zip' \
                                           % (submission.slug, submission.pk, 
                                              revision.rev_id_human)
-        response.write(package_data.read())
-
-        package_data.close()
-
-        # checkout the repo to latest revision
-        last_revision = submission.last_revision
-        checkout = submission.fileset.checkout_revision(last_revision.hash_id)
-        if not checkout:
-            logger.error('Could not checkout out revision %s for  rev.id %d' 
-                         % (last_revision.hash_id, last_revision.pk))
-
+        if etag:
+            response['ETag'] = quote_etag(etag)
         return response
 
 
-def sort_items_by_page_views(all_items, item_module_name):
-    # TODO(KGD): Cache this reordering of ``items`` for a period of time
-
-    today = datetime.datetime.now()
-    start_date = today - datetime.timedelta(days=settings.SPC['hit_horizon'])
-    page_order = get_pagehits(item_module_name, start_date=start_date,
-                                                               end_date=today)
-    page_order.sort(reverse=True)
-
-    #``page_order`` is a list of tuples; the 2nd entry in each tuple is the
-    # primary key, that must exist in ``items_pk``.
-    all_items = list(all_items)
-    items_pk = [item.pk for item in all_items]
-    entry_order = []
-    count_list = []
-    for count, pk in page_order:
-        try:
-            idx = items_pk.index(pk)
-        except ValueError:
-            pass
-        else:
-            items_pk[idx] = None
-            entry_order.append(all_items[idx])
-            count_list.append(count)
-
-    # Items that have never been viewed get added to the bottom:
-    for idx, pk in enumerate(items_pk):
-        if pk is not None:
-            entry_order.append(all_items[idx])
-            count_list.append(0)
-
-    return entry_order, count_list
-
-
 def show_items(request, what_view='', extra_info=''):
     """ Show different views onto all **revision** items (not submissions)
     """
@@ -272,7 +260,7 @@ def show_items(request, what_view='', extra_info=''):
         all_revs = models.Revision.objects.most_recent().\
                                 filter(tags__slug=slugify(extra_info))
         page_title = 'All entries tagged'
-        entry_order = list(all_revs)
+        entry_order = all_revs.select_related('entry', 'created_by')
     elif what_view == 'show' and extra_info == 'all-tags':
         page_title = 'All tags'
         template_name = 'submission/show-tag-cloud.html'
@@ -281,20 +269,26 @@ def show_items(request, what_view='', extra_info=''):
         all_revs = models.Revision.objects.all().order_by('-date_created')
         page_title = 'All revisions'
         extra_info = ''
-        entry_order = list(all_revs)
+        entry_order = all_revs.select_related('entry', 'created_by')
     elif what_view == 'show' and extra_info == 'all-unique-revisions':
-        all_subs = models.Submission.objects.all().order_by('-date_created')
+        # The latest revision of each submission, if it is displayed
+        latest = models.Submission.objects.filter(is_displayed=True)\
+                                          .values('latest_revision')
         page_title = 'All submissions'
         extra_info = ' (only showing the latest revision)'
-        entry_order = [sub.last_revision for sub in all_subs if sub.last_revision.is_displayed]
+        entry_order = models.Revision.objects.filter(pk__in=latest)\
+                                     .select_related('entry', 'created_by')\
+                                     .order_by('-entry__date_created')
     elif what_view == 'sort' and extra_info == 'most-viewed':
         page_title = 'All submissions in order of most views'
         extra_info = ''
-        all_subs = set()
-        for rev in models.Revision.objects.all():
-            all_subs.add(rev.entry)
-        entry_order, _ = sort_items_by_page_views(all_subs, 'submission')
-        entry_order = [entry.last_revision for entry in entry_order]
+        # The latest revision of each submission, if it is displayed
+        latest = models.Submission.objects.filter(is_displayed=True)\
+                                          .values('latest_revision')
+        entry_order = order_by_pagehits(
+                            models.Revision.objects.filter(pk__in=latest)
+                                  .select_related('entry', 'created_by'),
+                            'submission', 'entry')
     elif what_view == 'show' and extra_info == 'top-contributors':
         page_title = 'Top contributors'
         extra_info = ''
@@ -0,0 +1,125 @@
+"""
+An in-memory index of the tag names, for the autocomplete of the tag fields:
+tags that start with the typed text are found with a binary search in the
+sorted names, and tags that contain it with an index of the names' n-grams
+(or, if a single character was typed, by checking every name).
+
+The index is built once per process, when it is first needed. Saving or
+deleting a tag invalidates it: in every process if they share the cache
+(each index checks a version number kept in the cache), otherwise in the
+other processes only once the index is ``tag_index_max_age`` seconds old.
+"""
+from django.conf import settings
+from django.core.cache import cache
+
+import time
+import bisect
+import threading
+
+import models
+
+# Substring matches are looked up by the n-grams (of at most this length) of
+# the typed text
+NGRAM_LENGTH = 3
+
+
+def ngrams(text, length):
+    """ Returns the set of substrings of ``text`` of the given ``length`` """
+    return set(text[idx:idx + length]
+               for idx in xrange(len(text) - length + 1))
+
+
+class TagIndex(object):
+    """ The names of all tags, indexed by prefix and by n-gram. """
+    def __init__(self, max_age=1800):
+        self.max_age = max_age
+        self.lock = threading.Lock()
+        self.built = None
+        self.version = None
+        # Empty until the first ``refresh``
+        self.index = ([], [], {})
+
+    def build(self):
+        """ Reads all the tag names, and indexes them. """
+        names = sorted((name.lower(), name) for name in
+                       models.Tag.objects.values_list('name', flat=True))
+        grams = {}
+        for idx, (lower_name, name) in enumerate(names):
+            for length in xrange(2, NGRAM_LENGTH + 1):
+                for gram in ngrams(lower_name, length):
+                    grams.setdefault(gram, []).append(idx)
+
+        # Assigned at once: lookups in other threads see the old index, or
+        # the new one, never a half-built one
+        self.index = (names, [key for key, name in names], grams)
+
+    def current_version(self):
+        """ The version of the tags, bumped whenever a tag is saved or
+        deleted (see ``models.tags_changed``).
+        """
+        version = cache.get(models.INDEX_VERSION_KEY)
+        if version is None:
+            # Never the same as a version that has expired
+            cache.add(models.INDEX_VERSION_KEY, int(time.time()),
+                      models.INDEX_VERSION_TIMEOUT)
+            version = cache.get(models.INDEX_VERSION_KEY)
+        return version
+
+    def is_current(self, version):
+        return (self.built is not None and version == self.version and
+                time.time() - self.built < self.max_age)
+
+    def refresh(self):
+        """ Builds the index, if it was never built or is out of date. """
+        version = self.current_version()
+        if self.is_current(version):
+            return
+        with self.lock:
+            if not self.is_current(version):
+                self.build()
+                self.built = time.time()
+                self.version = version
+
+    def search(self, text, limit=20):
+        """
+        Returns the names (at most ``limit``) of the tags that start with
+        ``text``, in alphabetical order, followed by those that only contain
+        it.
+        """
+        self.refresh()
+        names, keys, grams = self.index
+        text = text.lower()
+
+        start = bisect.bisect_left(keys, text)
+        found = []
+        for key, name in names[start:start + limit]:
+            if not key.startswith(text):
+                break
+            found.append(name)
+        if len(found) >= limit or not text:
+            return found
+
+        if len(text) < 2:
+            # There are no n-grams this short: every tag is checked
+            candidates = xrange(len(names))
+        else:
+            # The tags that contain all the n-grams of ``text``, starting
+            # with the rarest n-gram
+            length = min(len(text), NGRAM_LENGTH)
+            postings = sorted((grams.get(gram, []) for gram in
+                               ngrams(text, length)), key=len)
+            candidates = set(postings[0])
+            for posting in postings[1:]:
+                candidates.intersection_update(posting)
+            candidates = sorted(candidates)
+        for idx in candidates:
+            key, name = names[idx]
+            if text in key and not key.startswith(text):
+                found.append(name)
+                if len(found) >= limit:
+                    break
+        return found
+
+
+tag_index = TagIndex(settings.SPC.get('tag_index_max_age', 1800))
+
@@ -0,0 +1,46 @@
+# -*- coding: utf-8 -*-
+import datetime
+from south.db import db
+from south.v2 import SchemaMigration
+from django.db import models
+
+
+class Migration(SchemaMigration):
+
+    # The tag table was created by syncdb before the app had migrations: on
+    # such a database, run ``manage.py migrate tagging 0001 --fake`` first
+    needed_by = (
+        ('submission', '0001_initial'),
+    )
+
+    def forwards(self, orm):
+        # Adding model 'Tag'
+        db.create_table('tagging_tag', (
+            ('id', self.gf('django.db.models.fields.AutoField')(primary_key=True)),
+            ('slug', self.gf('django.db.models.fields.SlugField')(unique=True, max_length=50)),
+            ('name', self.gf('django.db.models.fields.TextField')(max_length=50)),
+            ('description', self.gf('django.db.models.fields.CharField')(max_length=255, null=True, blank=True)),
+            ('image', self.gf('django.db.models.fields.files.ImageField')(max_length=100, blank=True)),
+            ('tag_type', self.gf('django.db.models.fields.TextField')(default='regular', max_length=10)),
+        ))
+        db.send_create_signal('tagging', ['Tag'])
+
+
+    def backwards(self, orm):
+        # Deleting model 'Tag'
+        db.delete_table('tagging_tag')
+
+
+    models = {
+        'tagging.tag': {
+            'Meta': {'object_name': 'Tag'},
+            'description': ('django.db.models.fields.CharField', [], {'max_length': '255', 'null': 'True', 'blank': 'True'}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'image': ('django.db.models.fields.files.ImageField', [], {'max_length': '100', 'blank': 'True'}),
+            'name': ('django.db.models.fields.TextField', [], {'max_length': '50'}),
+            'slug': ('django.db.models.fields.SlugField', [], {'unique': 'True', 'max_length': '50'}),
+            'tag_type': ('django.db.models.fields.TextField', [], {'default': "'regular'", 'max_length': '10'})
+        }
+    }
+
+    complete_apps = ['tagging']
\ No newline at end of file
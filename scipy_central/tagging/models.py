@@ -1,4 +1,7 @@
 from django.db import models
+from django.db.models import signals
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
 from django.template.defaultfilters import slugify
 
 import logging
@@ -32,6 +35,11 @@ class Tag(models.Model):
     tag_type = models.TextField(max_length=10, choices=TAG_TYPES,
                                 default='regular')
 
+    # Number of (distinct) submissions with a revision that uses this tag:
+    # kept up to date as tags are added to, and removed from, revisions
+    submission_count = models.PositiveIntegerField(default=0, db_index=True,
+                                                   editable=False)
+
     def __unicode__(self):
         return self.name
 
@@ -52,3 +60,23 @@ class Tag(models.Model):
             self.slug = slug
             logger.info('TAGS: created a new tag: %s', slug)
             super(Tag, self).save(*args, **kwargs)
+
+
+# The version of the tags in the cache: the tag name indexes (see ``index.py``)
+# are rebuilt when it changes
+INDEX_VERSION_KEY = 'tag-index-version'
+INDEX_VERSION_TIMEOUT = 30 * 24 * 3600
+
+
+def tags_changed(sender, **kwargs):
+    """ Marks the tag name indexes out of date, in every process that shares
+    the cache.
+    """
+    try:
+        cache.incr(INDEX_VERSION_KEY)
+    except ValueError:
+        # Not in the cache: the indexes get a new version when they look
+        pass
+
+signals.post_save.connect(tags_changed, sender=Tag)
+signals.post_delete.connect(tags_changed, sender=Tag)
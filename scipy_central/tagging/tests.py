@@ -1,10 +1,20 @@
 # -*- coding: utf-8 -*-
 
 from django.test import TestCase
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.test.client import RequestFactory
 from models import Tag
-from views import parse_tags
+from views import parse_tags, get_tag_uses, tag_autocomplete, \
+                  get_and_create_tags
+from index import TagIndex
 from django.core.exceptions import ValidationError
 
+import json
+
+from scipy_central.submission.models import Submission, Revision, TagCreation
+from scipy_central.submission.templatetags.core_tags import cloud, top_tags
+
 class RepeatedTag(TestCase):
     def test_adding_repeated_tag(self):
         """
@@ -32,3 +42,117 @@ class TagParsing(TestCase):
 
         tags = parse_tags('my, "new tag"')
         self.assertEqual(tags, ['my', 'new tag'])
+
+
+class TagCounts(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('tags', 'tags@example.org', 'pw')
+        self.tags = [Tag.objects.get_or_create(name=name)[0]
+                     for name in ('numpy', 'scipy', 'plotting')]
+
+    def new_revision(self, sub, tags):
+        rev = Revision.objects.create(entry=sub, title='Rev',
+                                      created_by=self.user, description='Test',
+                                      item_code='print 1\n', is_displayed=True)
+        for tag in tags:
+            TagCreation.objects.create(created_by=self.user, revision=rev,
+                                       tag=tag)
+        return rev
+
+    def counts(self):
+        return [Tag.objects.get(pk=tag.pk).submission_count
+                for tag in self.tags]
+
+    def test_submission_count(self):
+        """ Tags count the submissions (not the revisions) that use them. """
+        numpy, scipy, plotting = self.tags
+        subs = [Submission.objects.create(sub_type='snippet',
+                                          created_by=self.user)
+                for n in range(2)]
+        self.new_revision(subs[0], [numpy, scipy])
+        rev = self.new_revision(subs[0], [numpy, plotting])
+        self.new_revision(subs[1], [numpy])
+        self.assertEqual(self.counts(), [2, 1, 1])
+        self.assertEqual(sorted(get_tag_uses()), [(1, scipy.pk),
+                                                  (1, plotting.pk),
+                                                  (2, numpy.pk)])
+
+        with self.assertNumQueries(1):
+            self.assertEqual([(item.slug, item.score)
+                              for item in top_tags(None, 2)],
+                             [('numpy', 2), ('plotting', 1)])
+        self.assertEqual([item.slug for item in cloud(None, 0)],
+                         ['numpy', 'plotting', 'scipy'])
+
+        rev.delete()
+        self.assertEqual(self.counts(), [2, 1, 0])
+        TagCreation.objects.filter(tag=numpy, revision__entry=subs[1])\
+                           .get().delete()
+        self.assertEqual(self.counts(), [1, 1, 0])
+
+        # A tag use moved to another tag counts for that tag instead
+        use = TagCreation.objects.get(tag=scipy)
+        use.tag = plotting
+        use.save()
+        self.assertEqual(self.counts(), [1, 0, 1])
+        use.save()
+        self.assertEqual(self.counts(), [1, 0, 1])
+
+    def test_bulk_tagging(self):
+        """ Tags are found, created and added to a revision with a constant
+        number of queries. """
+        numpy, scipy, plotting = self.tags
+        sub = Submission.objects.create(sub_type='snippet',
+                                        created_by=self.user)
+        self.new_revision(sub, [numpy])
+        rev = self.new_revision(sub, [])
+
+        with self.assertNumQueries(3):
+            tags = get_and_create_tags('NumPy, plotting, 2D, 2d, FFT, ')
+        self.assertEqual([tag.slug for tag in tags],
+                         ['2d', 'fft', 'numpy', 'plotting'])
+        self.assertTrue(all(tag.pk for tag in tags))
+        with self.assertNumQueries(1):
+            self.assertEqual(get_and_create_tags('fft, 2D, numpy'), tags[:3])
+
+        with self.assertNumQueries(3):
+            TagCreation.objects.add_tags(rev, tags, self.user)
+        self.assertEqual(self.counts(), [1, 0, 1])
+        self.assertEqual(Tag.objects.get(slug='fft').submission_count, 1)
+        self.assertEqual(rev.tags.count(), 4)
+
+
+class TagAutocomplete(TestCase):
+    def setUp(self):
+        cache.clear()
+        for name in ('Plotting', 'plot3d', 'scatter plot', 'optimization',
+                     'polynomial', 'Monte-Carlo'):
+            Tag.objects.get_or_create(name=name)
+
+    def test_search(self):
+        """ Tags that start with the text come first, then those that
+        contain it. """
+        index = TagIndex()
+        self.assertEqual(index.index, ([], [], {}))
+        self.assertEqual(index.search('plot'),
+                         ['plot3d', 'Plotting', 'scatter plot'])
+        with self.assertNumQueries(0):
+            self.assertEqual(index.search('PL', limit=2),
+                             ['plot3d', 'Plotting'])
+        self.assertEqual(index.search('o'),
+                         ['optimization', 'Monte-Carlo', 'plot3d',
+                          'Plotting', 'polynomial', 'scatter plot'])
+        self.assertEqual(index.search('3'), ['plot3d'])
+        self.assertEqual(index.search('arlo'), ['Monte-Carlo'])
+        self.assertEqual(index.search('tion'), ['optimization'])
+        self.assertEqual(index.search('xyz'), [])
+        self.assertEqual(len(index.search('')), 6)
+
+        # New tags are found straight away
+        Tag.objects.get_or_create(name='Plotly')
+        self.assertEqual(index.search('plot', limit=2), ['plot3d', 'Plotly'])
+
+    def test_view(self):
+        request = RequestFactory().get('/', {'term': 'nom'})
+        response = tag_autocomplete(request)
+        self.assertEqual(json.loads(response.content), ['polynomial'])
@@ -1,14 +1,19 @@
+from django.conf import settings
 from django.http import HttpResponse
 from django.utils import simplejson
 from django.template.defaultfilters import slugify
 from django.utils.encoding import force_unicode
-from django.core.exceptions import ValidationError
+from django.db import transaction, IntegrityError
+from django.db.models import Count
 
 import models
+from index import tag_index
 from scipy_central.submission.models import TagCreation
 
 import datetime
-from collections import defaultdict
+import logging
+
+logger = logging.getLogger('scipycentral')
 
 
 def get_tag_uses(start_date=None, end_date=None):
@@ -20,36 +25,28 @@ def get_tag_uses(start_date=None, end_date=None):
     The list will be returned in the order of the ``Tag.pk``, but the
     first tuple entry is the number of uses of that tag, allowing for easy
     sorting using Python's ``sort`` method.
+
+    Without dates, the maintained ``Tag.submission_count`` is used.
     """
+    if start_date is None and end_date is None:
+        tags = models.Tag.objects.filter(submission_count__gt=0)\
+                                 .values_list('pk', 'submission_count')\
+                                 .order_by('pk')
+        return [(count, pk) for pk, count in tags]
     if start_date is None:
         start_date = datetime.date.min
     if end_date is None:
         end_date = datetime.date.max
 
-    tags_created = TagCreation.objects.all().\
-                                       filter(date_created__gte=start_date).\
-                                       filter(date_created__lte=end_date)
-
-    # Let all the revisions from each submission be grouped, so that duplicate
-    # tags across revisions only have a single influence
-    uses_by_sub_pk = defaultdict(set)
-    for use in tags_created:
-        uses_by_sub_pk[use.revision.entry_id].add(use.tag)
-
-    # Then for each set of tags in each submission, iterate a create a dict
-    # where the keys are the tag's primary key and the values are the number
-    # of uses of that tag
-    uses_by_pk = defaultdict(int)
-    for tag_set in uses_by_sub_pk.itervalues():
-        for tag in tag_set:
-            uses_by_pk[tag.pk] += 1
-
-    # Finally, create a list of hit counts, which can be used for sorting
-    hit_counts = []
-    for key, val in uses_by_pk.iteritems():
-        hit_counts.append((val, key))
-
-    return hit_counts
+    # All the revisions of a submission count once: duplicate tags across
+    # revisions only have a single influence
+    tag_uses = TagCreation.objects.filter(date_created__gte=start_date)\
+                                  .filter(date_created__lte=end_date)\
+                                  .values('tag')\
+                                  .annotate(uses=Count('revision__entry',
+                                                       distinct=True))\
+                                  .order_by('tag')
+    return [(row['uses'], row['tag']) for row in tag_uses]
 
 
 def parse_tags(tagstring):
@@ -152,22 +149,44 @@ def split_strip(string, delimiter=u','):
 
 
 def get_and_create_tags(tagstring):
+    """
+    Returns the tags in ``tagstring``, creating those that do not exist yet,
+    with a constant number of queries.
 
-    tag_list = []
+    Tags are found by their slug, so that e.g. "2D" and "2d" are the same
+    tag. Tags whose name has no valid slug are skipped.
+    """
+    slugs, names = [], {}
     for tag in parse_tags(tagstring):
+        slug = slugify(tag)
+        if slug and slug not in names:
+            slugs.append(slug)
+            names[slug] = tag
+
+    tags = dict((tag.slug, tag) for tag in
+                models.Tag.objects.filter(slug__in=slugs))
+    missing = [models.Tag(slug=slug, name=names[slug]) for slug in slugs
+               if slug not in tags]
+    if missing:
+        sid = transaction.savepoint()
         try:
-            tag_obj = models.Tag.objects.get_or_create(name=tag)[0]
-        except ValidationError:
-            pass
-        else:
-            # Does the tag really exist or was it found because of the lack of
-            # case sensitivity (e.g. "2D" vs "2d"
-            if tag_obj.id is None:
-                tag_obj = models.Tag.objects.get(slug=slugify(tag))
+            models.Tag.objects.bulk_create(missing)
+            transaction.savepoint_commit(sid)
+        except IntegrityError:
+            # Some were created by another request in the mean time
+            transaction.savepoint_rollback(sid)
+            for tag in missing:
+                models.Tag.objects.get_or_create(slug=tag.slug,
+                                                 defaults={'name': tag.name})
+        for tag in missing:
+            logger.info('TAGS: created a new tag: %s', tag.slug)
 
-            tag_list.append(tag_obj)
+        # ``bulk_create`` neither sets the primary keys, nor sends signals
+        tags.update((tag.slug, tag) for tag in models.Tag.objects.filter(
+                                    slug__in=[tag.slug for tag in missing]))
+        models.tags_changed(models.Tag)
 
-    return tag_list
+    return [tags[slug] for slug in slugs if slug in tags]
 
 
 def tag_autocomplete(request):
@@ -177,26 +196,12 @@ def tag_autocomplete(request):
 
     Parts from http://djangosnippets.org/snippets/233/
     """
-    # TODO(KGD): cache this lookup for 30 minutes
-    # Also, randomize the tag order to prevent only the those with lower
-    # primary keys from being shown more frequently
-
     # TODO(KGD): put the typed text in bold, e.g. typed="bi" then return
     # proba<b>bi</b>lity
-    all_tags = [tag.name for tag in models.Tag.objects.all()]
-
-    contains_str = request.REQUEST.get('term', '').lower()
-
-    starts = []
-    includes = []
-    for item in all_tags:
-        index = item.lower().find(contains_str)
-        if index == 0:
-            starts.append(item)
-        elif index > 0:
-            includes.append(item)
+    contains_str = request.REQUEST.get('term', '')
 
     # Return tags starting with ``contains_str`` at the top of the list,
     # followed by tags that only include ``contains_str``
-    starts.extend(includes)
-    return HttpResponse(simplejson.dumps(starts), mimetype='text/text')
+    matches = tag_index.search(contains_str,
+                               settings.SPC.get('tag_autocomplete_limit', 20))
+    return HttpResponse(simplejson.dumps(matches), mimetype='text/text')
@@ -131,8 +131,11 @@ def send_email(to_addresses, subject, message, from_address=None):
 def paginated_queryset(request, queryset):
     """
     Show items in a paginated table.
+
+    ``queryset`` may be a list, but should be a (lazy) ``QuerySet``
+    wherever possible: only the items on the requested page are then fetched
+    from the database (with LIMIT/OFFSET), along with a count of all items.
     """
-    queryset = list(queryset)
     paginator = Paginator(queryset, settings.SPC['entries_per_page'])
     try:
         page = int(request.GET.get('page', '1'))